@@ -0,0 +1,147 @@
+"""
+Начисления дома за год: расход всех счетчиков одним оконным запросом
+(utils/billing_utils.py) против двух запросов показаний на каждый счетчик.
+
+Запуск:
+    python -m benchmarks.bench_billing --apartments 173 --months 12
+
+В каждой квартире три счетчика (горячая, холодная вода, электричество),
+показания подаются раз в месяц. У электричества ступенчатый тариф
+с дневной и ночной зонами, у воды - одна цена.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+METER_TYPES = ("hot_water", "cold_water", "electricity")
+
+
+async def seed(session_maker, apartments: int, months: int, start: datetime) -> None:
+    from dateutil.relativedelta import relativedelta
+    from sqlalchemy import insert, select
+
+    from database.database import Database
+    from database.models import meter_types, meters, readings, serials, users
+
+    async with session_maker() as session:
+        db = Database(session, 1)
+        await db._ensure_meter_types_exist()
+        type_ids = dict((await session.execute(select(meter_types.c.name, meter_types.c.type_id))).all())
+        await session.execute(
+            insert(users),
+            [{"user_id": i, "building_id": 1, "apartment_number": i, "first_name": f"User{i}"} for i in range(1, apartments + 1)],
+        )
+        pairs = [(apartment, meter_type) for apartment in range(1, apartments + 1) for meter_type in METER_TYPES]
+        ids = [(apartment, meter_type, i) for i, (apartment, meter_type) in enumerate(pairs, start=1)]
+        await session.execute(
+            insert(meters),
+            [
+                {"meter_id": i, "building_id": 1, "apartment_number": apartment, "type_id": type_ids[meter_type], "count_meter": 1}
+                for apartment, meter_type, i in ids
+            ],
+        )
+        await session.execute(
+            insert(serials), [{"serial_id": i, "meter_id": i, "serial_number": f"{meter_type}-{apartment}"} for apartment, meter_type, i in ids]
+        )
+        # Показание перед первым месяцем и по одному за каждый месяц года
+        await session.execute(
+            insert(readings),
+            [
+                {
+                    "building_id": 1, "meter_id": i, "user_id": apartment, "serial_id": i,
+                    "value": month * (100 if meter_type == "electricity" else 5) + apartment,
+                    "reading_date": start + relativedelta(months=month - 1, days=20),
+                }
+                for month in range(months + 1)
+                for apartment, meter_type, i in ids
+            ],
+        )
+        await session.commit()
+        for meter_type, price in (("hot_water", 250.0), ("cold_water", 45.0)):
+            await db.add_tariff(meter_type, price, start)
+        await db.add_tariff("electricity", 5.0, start, "day", 0.7)
+        await db.add_tariff("electricity", 7.15, start, "day", 0.7, 50)
+        await db.add_tariff("electricity", 2.5, start, "night", 0.3)
+
+
+async def per_meter_consumption(session, period_start: datetime, period_end: datetime) -> list[dict]:
+    """Расход как в таблице после выгрузки: последнее показание месяца и предыдущее по каждому счетчику"""
+    from sqlalchemy import select
+
+    from database.models import meters, readings, serials
+
+    consumption = []
+    rows = await session.execute(
+        select(serials.c.serial_id, meters.c.apartment_number, meters.c.type_id)
+        .join(meters, serials.c.meter_id == meters.c.meter_id)
+        .where(meters.c.building_id == 1)
+    )
+    for serial_id, apartment, type_id in rows.all():
+        values = []
+        for bound in (period_end, period_start):
+            values.append(
+                await session.scalar(
+                    select(readings.c.value)
+                    .where(readings.c.serial_id == serial_id, readings.c.reading_date < bound)
+                    .order_by(readings.c.reading_date.desc())
+                    .limit(1)
+                )
+            )
+        current, previous = values
+        consumption.append({"apartment_number": apartment, "type_id": type_id, "consumption": current - previous})
+    return consumption
+
+
+async def run(workdir: Path, apartments: int, months: int) -> None:
+    from dateutil.relativedelta import relativedelta
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+    from database.database import Database
+    from database.models import metadata
+    from utils.billing_utils import compute_invoices
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{workdir / 'billing.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+    session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    start = datetime(2024, 1, 1)
+    await seed(session_maker, apartments, months, start)
+    periods = [start + relativedelta(months=month) for month in range(months)]
+    meters_count = apartments * len(METER_TYPES)
+
+    started = time.perf_counter()
+    async with session_maker() as session:
+        for period in periods:
+            await per_meter_consumption(session, period, period + relativedelta(months=1))
+    elapsed = time.perf_counter() - started
+    print(f"per-meter queries   meters={meters_count} months={months} {elapsed:6.2f}s")
+
+    started = time.perf_counter()
+    invoices = 0
+    async with session_maker() as session:
+        db = Database(session, 1)
+        for period in periods:
+            invoices += len(await compute_invoices(db, period.date()))
+    elapsed = time.perf_counter() - started
+    print(f"window + invoices   meters={meters_count} months={months} invoices={invoices} {elapsed:6.2f}s")
+    await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--apartments", type=int, default=173)
+    parser.add_argument("--months", type=int, default=12)
+    args = parser.parse_args()
+    os.environ.setdefault("DB_LITE", "sqlite+aiosqlite:///:memory:")
+    os.environ.setdefault("BOT_TOKEN", "42:BENCH")
+    os.environ.setdefault("ADMIN_IDS", "[]")
+    workdir = Path(tempfile.mkdtemp(prefix="meters-billing-"))
+    asyncio.run(run(workdir, args.apartments, args.months))
+
+
+if __name__ == "__main__":
+    main()
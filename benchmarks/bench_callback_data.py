@@ -0,0 +1,58 @@
+"""
+Разбор данных кнопок: строки с replace/split (как было) против CallbackData
+с числовым id и поиском имени в callback_cache.
+
+Запуск:
+    python -m benchmarks.bench_callback_data --calls 100000
+"""
+import argparse
+import os
+import time
+
+
+def parse_strings(data: str) -> tuple[int, str]:
+    user_data = data.split("_")
+    return int(user_data[1]), "".join(user_data[2:])
+
+
+def measure(parse, payloads: list[str], calls: int) -> float:
+    started = time.perf_counter()
+    for i in range(calls):
+        parse(payloads[i % len(payloads)])
+    return (time.perf_counter() - started) / calls * 1_000_000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Разбор данных кнопок")
+    parser.add_argument("--calls", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+    os.environ.setdefault("DB_LITE", "sqlite+aiosqlite:///:memory:")
+    os.environ.setdefault("BOT_TOKEN", "42:BENCH")
+    os.environ.setdefault("ADMIN_IDS", "[]")
+
+    from kbds.callback_data import UserCallback, callback_cache
+
+    users = [(5_000_000_000 + i, f"Resident_{i}") for i in range(args.users)]
+    old_payloads = [f"deleteuser_{user_id}_{name}" for user_id, name in users]
+    new_payloads = []
+    for user_id, name in users:
+        callback_cache.put(("user", user_id), name)
+        new_payloads.append(UserCallback(user_id=user_id).pack())
+
+    def parse_callback_data(data: str) -> tuple[int, str]:
+        user_id = UserCallback.unpack(data).user_id
+        return user_id, callback_cache.get(("user", user_id))
+
+    old = measure(parse_strings, old_payloads, args.calls)
+    new = measure(parse_callback_data, new_payloads, args.calls)
+    print(f"replace/split:            {old:6.2f} мкс (имя 'Resident_1' разбирается как {parse_strings(old_payloads[1])[1]!r})")
+    print(f"CallbackData + кэш:       {new:6.2f} мкс (имя {parse_callback_data(new_payloads[1])[1]!r})")
+    print(
+        f"длина данных кнопки: было до {max(len(p.encode()) for p in old_payloads)} байт, "
+        f"стало до {max(len(p.encode()) for p in new_payloads)} байт (лимит 64)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Выгрузка показаний за период: старый путь (fetchall и книга openpyxl
+в памяти) против потоковой выгрузки utils/export_utils.py во все форматы.
+
+Запуск:
+    python -m benchmarks.bench_export --rows 100000
+
+Для каждого формата печатаются время, строк в секунду, размер файла и пик
+памяти Python (tracemalloc, поэтому время больше, чем без замера).
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime
+from io import BytesIO
+from pathlib import Path
+
+
+async def seed(session_maker, rows: int) -> None:
+    from dateutil.relativedelta import relativedelta
+    from sqlalchemy import insert
+
+    from config import settings
+    from database.models import meters, readings, serials, users
+
+    reading_date = datetime.combine(
+        date.today() - relativedelta(months=settings.DELTA_MONTH), datetime.min.time()
+    )
+    # Один счетчик горячей воды на квартиру: в отчёт попадает последнее показание счетчика
+    async with session_maker() as session:
+        await session.execute(
+            insert(users),
+            [{"user_id": i, "building_id": 1, "apartment_number": i, "first_name": f"User{i}"} for i in range(1, rows + 1)],
+        )
+        await session.execute(
+            insert(meters),
+            [{"meter_id": i, "building_id": 1, "apartment_number": i, "type_id": 3, "count_meter": 1} for i in range(1, rows + 1)],
+        )
+        await session.execute(
+            insert(serials), [{"serial_id": i, "meter_id": i, "serial_number": f"HW-{i}"} for i in range(1, rows + 1)]
+        )
+        await session.execute(
+            insert(readings),
+            [
+                {"building_id": 1, "meter_id": i, "user_id": i, "serial_id": i, "value": i, "reading_date": reading_date}
+                for i in range(1, rows + 1)
+            ],
+        )
+        await session.commit()
+
+
+def build_workbook(readings) -> BytesIO:
+    """Прежний create_excel_file: вся книга собирается в памяти"""
+    import openpyxl
+
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["Квартира", "Тип счётчика", "Серийный номер", "Значение", "Дата подачи"])
+    for reading in readings:
+        sheet.append([reading["apartment_number"], reading["name"], reading["serial_number"], reading["value"], reading["reading_date"]])
+    excel_file = BytesIO()
+    workbook.save(excel_file)
+    return excel_file
+
+
+async def measure(name: str, rows: int, export) -> None:
+    tracemalloc.start()
+    started = time.perf_counter()
+    size = await export()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(
+        f"{name:<22} {elapsed:6.2f}s {rows / elapsed:8.0f} rows/s "
+        f"size={size / 1024:8.0f}KB peak={peak / 1024 / 1024:6.1f}MB"
+    )
+
+
+async def run(workdir: Path, rows: int) -> None:
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+    from database.database import Database
+    from database.models import metadata
+    from utils.export_utils import EXPORT_FORMATS, export_readings_file
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{workdir / 'export.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+    session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with session_maker() as session:
+        await Database(session, 1)._ensure_meter_types_exist()
+    await seed(session_maker, rows)
+
+    async def fetchall_workbook() -> int:
+        async with session_maker() as session:
+            readings = await Database(session, 1).get_all_readings_for_period()
+        return len((await asyncio.to_thread(build_workbook, readings)).getvalue())
+
+    await measure("fetchall + workbook", rows, fetchall_workbook)
+    for export_format, writer_class in EXPORT_FORMATS.items():
+        for compress in (False, True) if writer_class.compressible else (False,):
+
+            async def stream() -> int:
+                async with session_maker() as session:
+                    path, exported = await export_readings_file(
+                        Database(session, 1), workdir, export_format, compress
+                    )
+                assert exported == rows
+                return path.stat().st_size
+
+            await measure(f"stream {export_format}{' gz' if compress else ''}", rows, stream)
+    await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=100_000)
+    args = parser.parse_args()
+    os.environ.setdefault("DB_LITE", "sqlite+aiosqlite:///:memory:")
+    os.environ.setdefault("BOT_TOKEN", "42:BENCH")
+    os.environ.setdefault("ADMIN_IDS", "[]")
+    workdir = Path(tempfile.mkdtemp(prefix="meters-export-"))
+    asyncio.run(run(workdir, args.rows))
+
+
+if __name__ == "__main__":
+    main()
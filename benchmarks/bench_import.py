@@ -0,0 +1,140 @@
+"""
+Импорт счетчиков из файла (utils/import_utils.py) против регистрации
+квартир по одной через Database.add_info_apartment, как в диалоге жильца.
+
+Запуск:
+    python -m benchmarks.bench_import --rows 10000 --months 12
+
+Файл содержит по три счетчика на квартиру (горячая, холодная вода,
+электричество), импортируется в CSV и в xlsx в пустую базу SQLite.
+Затем в базу из CSV загружается история показаний этих счетчиков
+за --months месяцев, а потом тот же файл повторно (все строки - дубликаты).
+"""
+import argparse
+import asyncio
+import csv
+import os
+import tempfile
+import time
+from pathlib import Path
+
+METER_TYPES = ("hot_water", "cold_water", "electricity")
+HEADER = ["Квартира", "Тип счётчика", "Серийный номер", "Описание"]
+
+
+def file_rows(apartments: int) -> list[list]:
+    return [
+        [apartment, meter_type, f"{meter_type}-{apartment}", "Кухня"]
+        for apartment in range(1, apartments + 1)
+        for meter_type in METER_TYPES
+    ]
+
+
+def write_files(workdir: Path, apartments: int) -> dict[str, Path]:
+    import openpyxl
+
+    rows = file_rows(apartments)
+    csv_path = workdir / "meters.csv"
+    with open(csv_path, "w", encoding="utf-8-sig", newline="") as file:
+        writer = csv.writer(file, delimiter=";")
+        writer.writerow(HEADER)
+        writer.writerows(rows)
+    xlsx_path = workdir / "meters.xlsx"
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(HEADER)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(xlsx_path)
+    return {"csv": csv_path, "xlsx": xlsx_path}
+
+
+def write_readings(workdir: Path, apartments: int, months: int) -> Path:
+    path = workdir / "readings.csv"
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["Серийный номер", "Показания", "Дата"])
+        for month in range(1, months + 1):
+            for apartment in range(1, apartments + 1):
+                for meter_type in METER_TYPES:
+                    writer.writerow(
+                        [f"{meter_type}-{apartment}", month * 10, f"01.{month % 12 + 1:02}.{2000 + month // 12}"]
+                    )
+    return path
+
+
+async def fresh_session_maker(url: str):
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+    from database.models import metadata
+
+    engine = create_async_engine(url)
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+    return engine, async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+
+async def run(workdir: Path, apartments: int, months: int) -> None:
+    from benchmarks.bench_backends import apartment_info
+    from database.database import Database
+    from utils.import_utils import import_meters_file, import_readings_file
+
+    rows = apartments * len(METER_TYPES)
+    for kind, path in write_files(workdir, apartments).items():
+        engine, session_maker = await fresh_session_maker(
+            f"sqlite+aiosqlite:///{workdir / f'import_{kind}.db'}"
+        )
+        started = time.perf_counter()
+        async with session_maker() as session:
+            report = await import_meters_file(Database(session, 1), path)
+        elapsed = time.perf_counter() - started
+        print(
+            f"import {kind:<5} rows={report.total} imported={report.imported} "
+            f"errors={len(report.errors)} {elapsed:6.2f}s {report.total / elapsed:8.0f} rows/s"
+        )
+        if kind == "csv" and months:
+            readings_path = write_readings(workdir, apartments, months)
+            for attempt in ("readings", "again"):
+                if attempt == "again":
+                    # Другой хэш файла: импорт не продолжается, а проходит все строки заново
+                    readings_path.write_text(readings_path.read_text() + "\n", encoding="utf-8")
+                started = time.perf_counter()
+                async with session_maker() as session:
+                    report = await import_readings_file(Database(session, 1), readings_path)
+                elapsed = time.perf_counter() - started
+                print(
+                    f"import {attempt:<8} rows={report.total} imported={report.imported} "
+                    f"duplicates={report.duplicates} errors={len(report.errors)} "
+                    f"{elapsed:6.2f}s {report.total / elapsed:8.0f} rows/s"
+                )
+        await engine.dispose()
+
+    engine, session_maker = await fresh_session_maker(
+        f"sqlite+aiosqlite:///{workdir / 'register.db'}"
+    )
+    started = time.perf_counter()
+    async with session_maker() as session:
+        db = Database(session, 1)
+        for apartment in range(1, apartments + 1):
+            await db.add_info_apartment(apartment_info(apartment))
+    elapsed = time.perf_counter() - started
+    await engine.dispose()
+    print(f"add_info_apartment rows={rows} {elapsed:6.2f}s {rows / elapsed:8.0f} rows/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--months", type=int, default=12, help="месяцев истории показаний")
+    args = parser.parse_args()
+    apartments = max(args.rows // len(METER_TYPES), 1)
+    os.environ.setdefault("DB_LITE", "sqlite+aiosqlite:///:memory:")
+    os.environ.setdefault("BOT_TOKEN", "42:BENCH")
+    os.environ.setdefault("ADMIN_IDS", "[]")
+    os.environ["BUILDINGS"] = f'{{"1": {apartments}}}'
+    workdir = Path(tempfile.mkdtemp(prefix="meters-import-"))
+    asyncio.run(run(workdir, apartments, args.months))
+
+
+if __name__ == "__main__":
+    main()
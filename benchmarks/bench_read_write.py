@@ -0,0 +1,154 @@
+"""
+Подача показаний жильцами во время выгрузки отчёта: одна база SQLite с общими
+соединениями (DB_SPLIT_READS=false) против разделения чтения (mode=ro, WAL)
+и записи (одно соединение).
+
+Запуск:
+    python -m benchmarks.bench_read_write --apartments 50 --history-months 100
+
+Отчёт непрерывно читает всю историю показаний курсором (как потоковая
+выгрузка), пока `--concurrency` задач подают показания через Database.add_reading.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from statistics import quantiles
+
+from dateutil.relativedelta import relativedelta
+
+METER_TYPES = ("hot_water", "cold_water", "electricity")
+
+
+async def seed(session_maker, apartments: int, months: int) -> None:
+    from sqlalchemy import insert, select
+
+    from benchmarks.bench_backends import apartment_info
+    from database.database import Database
+    from database.models import readings, serials, meters
+
+    async with session_maker() as session:
+        db = Database(session, 1)
+        for apartment in range(1, apartments + 1):
+            await db.add_info_apartment(apartment_info(apartment))
+        rows = (
+            await session.execute(
+                select(meters.c.meter_id, serials.c.serial_id).join(
+                    serials, serials.c.meter_id == meters.c.meter_id
+                )
+            )
+        ).all()
+        first_month = datetime(2000, 1, 1)
+        await session.execute(
+            insert(readings),
+            [
+                {
+                    "building_id": 1,
+                    "meter_id": meter_id,
+                    "serial_id": serial_id,
+                    "value": month,
+                    "reading_date": first_month + relativedelta(months=month),
+                }
+                for meter_id, serial_id in rows
+                for month in range(months)
+            ],
+        )
+        await session.commit()
+
+
+async def run(split: bool, workdir: Path, apartments: int, months: int, concurrency: int) -> None:
+    from sqlalchemy import func, select
+
+    from config import settings
+    from database.database import Database
+    from database.engine import get_engine, get_read_engine, get_session_maker
+    from database.models import metadata, readings
+
+    settings.DB_SPLIT_READS = split
+    settings.BUILDING_DB_URLS[1] = f"sqlite+aiosqlite:///{workdir / f'split_{split}.db'}"
+    async with get_engine(1).begin() as conn:
+        await conn.run_sync(metadata.create_all)
+    session_maker = get_session_maker(1)
+    await seed(session_maker, apartments, months)
+
+    writing = True
+    exports = 0
+
+    async def export() -> None:
+        nonlocal exports
+        while writing:
+            async with session_maker() as session:
+                result = await session.stream(select(readings))
+                async for chunk in result.partitions(500):
+                    await asyncio.sleep(0.001)  # запись строк в файл
+            exports += 1
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+
+    async def submit(apartment: int, meter_type: str) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            async with session_maker() as session:
+                await Database(session, 1).add_reading(
+                    {
+                        "apartment_number": apartment,
+                        "meter_type": meter_type,
+                        "serial_number": f"{meter_type}-{apartment}",
+                        "user_id": apartment,
+                        "value": 10_000,
+                    }
+                )
+            latencies.append(time.perf_counter() - started)
+
+    exporter = asyncio.create_task(export())
+    await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(
+            submit(apartment, meter_type)
+            for apartment in range(1, apartments + 1)
+            for meter_type in METER_TYPES
+        )
+    )
+    elapsed = time.perf_counter() - started
+    writing = False
+    await exporter
+
+    async with session_maker() as session:
+        stored = (
+            await session.execute(
+                select(func.count()).select_from(readings).where(readings.c.value == 10_000)
+            )
+        ).scalar()
+    await get_read_engine(1).dispose()
+    await get_engine(1).dispose()
+
+    p50, p95 = (quantiles(latencies, n=100)[i] for i in (49, 94))
+    mode = "split (ro + 1 writer)" if split else "shared connections"
+    print(
+        f"{mode:<22} stored={stored}/{apartments * len(METER_TYPES)} "
+        f"{len(latencies) / elapsed:7.1f} writes/s p50={p50 * 1000:.1f}ms "
+        f"p95={p95 * 1000:.1f}ms max={max(latencies) * 1000:.1f}ms exports={exports}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--apartments", type=int, default=50)
+    parser.add_argument("--history-months", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+    os.environ.setdefault("DB_LITE", "sqlite+aiosqlite:///:memory:")
+    os.environ.setdefault("BOT_TOKEN", "42:BENCH")
+    os.environ.setdefault("ADMIN_IDS", "[]")
+    workdir = Path(tempfile.mkdtemp(prefix="meters-rw-"))
+    for split in (False, True):
+        asyncio.run(run(split, workdir, args.apartments, args.history_months, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
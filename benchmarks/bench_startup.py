@@ -0,0 +1,88 @@
+"""
+Время холодного старта: импорт main (роутеры, middleware, база данных,
+утилиты) в отдельном процессе с python -X importtime.
+
+Запуск:
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --runs 5 --budget-ms 4000 --top 15
+
+Печатается медиана времени импорта main и самые долгие пакеты верхнего
+уровня (собственное время всех их модулей). Скрипт завершается с кодом 1,
+если медиана больше бюджета BUDGET_MS (или --budget-ms) или при старте
+загрузился модуль, который должен загружаться лениво (LAZY_MODULES).
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from collections import Counter
+from pathlib import Path
+from statistics import median
+
+ROOT = Path(__file__).parent.parent
+
+# Бюджет импорта main; основную часть занимает aiogram
+BUDGET_MS = 5000
+
+# Нужны редким командам администратора и загружаются при первом вызове
+LAZY_MODULES = ("openpyxl", "sqlalchemy.dialects.postgresql")
+
+
+def import_times(workdir: str) -> dict[str, tuple[int, int]]:
+    """Модуль -> (собственное, накопленное время импорта в мкс) для import main"""
+    env = dict(os.environ, PYTHONPATH=str(ROOT))
+    env.setdefault("BOT_TOKEN", "42:STARTUP")
+    env.setdefault("ADMIN_IDS", "[]")
+    env.setdefault("DB_LITE", f"sqlite+aiosqlite:///{Path(workdir) / 'startup.db'}")
+    # .env из каталога проекта не подхватывается
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=workdir,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time:       123 |        456 |   package.module
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS, help="порог медианы импорта main")
+    parser.add_argument("--top", type=int, default=10, help="сколько пакетов показать")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="meters-startup-")
+    runs = [import_times(workdir) for _ in range(args.runs)]
+    totals = [times["main"][1] / 1000 for times in runs]
+    total = median(totals)
+    # Разбивка по пакетам - для прогона с медианным временем
+    times = runs[totals.index(sorted(totals)[len(totals) // 2])]
+
+    packages: Counter[str] = Counter()
+    for name, (self_us, _) in times.items():
+        packages[name.split(".")[0]] += self_us
+    print(f"import main: {total:.1f} ms (median of {args.runs}, budget {args.budget_ms:.0f} ms)")
+    for package, self_us in packages.most_common(args.top):
+        print(f"  {package:<24} {self_us / 1000:8.1f} ms {self_us / 10 / total:5.1f}%")
+
+    eager = [module for module in LAZY_MODULES if module in times]
+    print(f"lazy modules imported at startup: {', '.join(eager) or 'none'}")
+
+    failed = total > args.budget_ms or bool(eager)
+    if failed:
+        print("FAILED: превышен бюджет времени старта", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
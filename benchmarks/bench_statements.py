@@ -0,0 +1,104 @@
+"""
+Накладные расходы на один вызов: text(), собираемый при каждом вызове (как было),
+против выражений SQLAlchemy Core из database.queries, собранных один раз.
+
+Запуск:
+    python -m benchmarks.bench_statements --calls 5000
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from database import queries
+from database.models import metadata
+
+
+def text_select_user(user_id: int):
+    return text(
+        """
+        SELECT first_name, apartment_number, building_id
+        FROM users
+        WHERE users.user_id = :user_id
+        """
+    ).bindparams(user_id=user_id)
+
+
+def text_previous_reading(serial_number: str, current_period: datetime):
+    return text(
+        """
+        SELECT value, reading_date
+        FROM readings
+            JOIN serials USING (serial_id)
+            JOIN meters USING (meter_id)
+            JOIN meter_types USING (type_id)
+        WHERE serials.serial_number = :serial_number
+        AND name = :meter_type
+        AND meters.building_id = :building_id
+        AND readings.reading_date < :current_period
+        ORDER BY readings.reading_date DESC
+        LIMIT 1
+        """
+    ).bindparams(
+        building_id=1,
+        serial_number=serial_number,
+        current_period=current_period,
+        meter_type="hot_water",
+    )
+
+
+async def measure(session: AsyncSession, calls: int, build) -> float:
+    started = time.perf_counter()
+    for i in range(calls):
+        stmt, params = build(i)
+        (await session.execute(stmt, params)).mappings().first()
+    return (time.perf_counter() - started) / calls * 1_000_000
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=5000)
+    args = parser.parse_args()
+
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+    now = datetime.now()
+
+    async with async_sessionmaker(engine, class_=AsyncSession)() as session:
+        cases = {
+            "select_user": (
+                lambda i: (text_select_user(i), None),
+                lambda i: (queries.select_user, {"user_id": i}),
+            ),
+            "previous_reading": (
+                lambda i: (text_previous_reading(str(i), now), None),
+                lambda i: (
+                    queries.select_previous_reading,
+                    {
+                        "building_id": 1,
+                        "serial_number": str(i),
+                        "current_period": now,
+                        "meter_type": "hot_water",
+                    },
+                ),
+            ),
+        }
+        for name, (before, after) in cases.items():
+            # Прогрев: первая компиляция выражения
+            await measure(session, 10, after)
+            text_us = await measure(session, args.calls, before)
+            core_us = await measure(session, args.calls, after)
+            print(
+                f"{name:<18} text(): {text_us:7.1f} us/call   "
+                f"core: {core_us:7.1f} us/call   x{text_us / core_us:.2f}"
+            )
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,276 @@
+"""
+Нагрузочный прогон бота целиком: синтетические обновления идут через
+main.dp.feed_update (настоящие роутеры, middleware и база данных SQLite),
+а запросы к Telegram перехватывает заглушка сессии Bot.
+
+Запуск:
+    python -m benchmarks.load_dispatcher --apartments 173
+    python -m benchmarks.load_dispatcher --max-p95-ms 200 --min-throughput 100
+
+Сначала все квартиры одновременно регистрируются, затем одновременно подают
+показания. В конце печатаются пропускная способность, перцентили задержки
+обработки обновления и время записи в БД. С порогами --max-* / --min-*
+скрипт завершается с кодом 1, если они нарушены (для проверки регрессий).
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+from itertools import count
+from pathlib import Path
+from statistics import quantiles
+from typing import Any, AsyncGenerator
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods.base import TelegramMethod
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+METER_TYPES = ("hot_water", "cold_water", "electricity")
+
+
+class RecordingSession(BaseSession):
+    """Сессия Bot, которая записывает вызовы API вместо отправки в Telegram"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.calls: Counter[str] = Counter()
+        self._message_ids = count(1)
+
+    async def make_request(
+        self, bot: Bot, method: TelegramMethod[Any], timeout: int | None = None
+    ) -> Any:
+        self.calls[type(method).__name__] += 1
+        if method.__returning__ is Message:
+            chat_id = int(getattr(method, "chat_id", 0) or 0)
+            return Message(
+                message_id=next(self._message_ids),
+                date=datetime.now(),
+                chat=Chat(id=chat_id, type="private"),
+                text=getattr(method, "text", None),
+            )
+        return True
+
+    async def stream_content(
+        self,
+        url: str,
+        headers: dict[str, Any] | None = None,
+        timeout: int = 30,
+        chunk_size: int = 65536,
+        raise_for_status: bool = True,
+    ) -> AsyncGenerator[bytes, None]:
+        """Синтетические обновления не содержат файлов: скачивание только записывается"""
+        self.calls["stream_content"] += 1
+        for chunk in ():
+            yield chunk
+
+    async def close(self) -> None:
+        pass
+
+
+class UpdateFactory:
+    """Собирает обновления Telegram от имени жильца"""
+
+    def __init__(self) -> None:
+        self._ids = count(1)
+
+    def message(self, user_id: int, text: str) -> Update:
+        update_id = next(self._ids)
+        return Update(
+            update_id=update_id,
+            message=Message(
+                message_id=update_id,
+                date=datetime.now(),
+                chat=Chat(id=user_id, type="private"),
+                from_user=User(id=user_id, is_bot=False, first_name=f"Resident{user_id}"),
+                text=text,
+            ),
+        )
+
+    def callback(self, user_id: int, data: str) -> Update:
+        update_id = next(self._ids)
+        user = User(id=user_id, is_bot=False, first_name=f"Resident{user_id}")
+        return Update(
+            update_id=update_id,
+            callback_query=CallbackQuery(
+                id=str(update_id),
+                from_user=user,
+                chat_instance=str(user_id),
+                data=data,
+                message=Message(
+                    message_id=update_id,
+                    date=datetime.now(),
+                    chat=Chat(id=user_id, type="private"),
+                    text="keyboard",
+                ),
+            ),
+        )
+
+
+def registration_updates(factory: UpdateFactory, apartment: int) -> list[Update]:
+    user_id = 1_000_000 + apartment
+    texts = ["/start", str(apartment)]
+    for meter_type in METER_TYPES:
+        texts += ["1", f"{meter_type}-{apartment}", "Кухня"]
+    texts.append("0")  # счётчиков тепла нет
+    return [factory.message(user_id, text) for text in texts]
+
+
+def submission_updates(factory: UpdateFactory, apartment: int) -> list[Update]:
+    # После /submit бот сам предлагает счетчики по очереди, жилец вводит только числа
+    user_id = 1_000_000 + apartment
+    updates = [factory.message(user_id, "/submit")]
+    for value, meter_type in enumerate(METER_TYPES, start=1):
+        updates.append(factory.message(user_id, str(apartment * 10 + value)))
+    updates.append(factory.callback(user_id, "finish_submit"))
+    return updates
+
+
+class DbWriteTimer:
+    """Время выполнения записывающих выражений - в SQLite сюда входит ожидание блокировки"""
+
+    def __init__(self, engine) -> None:
+        from sqlalchemy import event
+
+        self.durations: list[float] = []
+        self.lock_errors = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._before)
+        event.listen(engine.sync_engine, "after_cursor_execute", self._after)
+        event.listen(engine.sync_engine, "handle_error", self._error)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info["started"] = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().split(" ", 1)[0].upper() in ("INSERT", "UPDATE", "DELETE"):
+            self.durations.append(time.perf_counter() - conn.info.pop("started"))
+
+    def _error(self, context):
+        if "locked" in str(context.original_exception):
+            self.lock_errors += 1
+
+
+def percentile(values: list[float], pct: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return quantiles(values, n=100)[pct - 1]
+
+
+async def run_phase(dp, bot: Bot, streams: list[list[Update]]) -> dict[str, Any]:
+    """Каждый жилец отправляет свои обновления по очереди, жильцы - одновременно"""
+    latencies: list[float] = []
+    errors = 0
+
+    async def resident(updates: list[Update]) -> None:
+        nonlocal errors
+        for update in updates:
+            started = time.perf_counter()
+            try:
+                await dp.feed_update(bot, update)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(resident(updates) for updates in streams))
+    elapsed = time.perf_counter() - started
+    return {
+        "updates": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50) * 1000,
+        "p95": percentile(latencies, 95) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+    }
+
+
+async def run(apartments: int) -> dict[str, dict[str, Any]]:
+    from sqlalchemy import func, select
+
+    from database.engine import create_db, engine, session_maker
+    from database.models import readings
+    from main import dp
+
+    await create_db()
+    timer = DbWriteTimer(engine)
+    session = RecordingSession()
+    bot = Bot(token="42:LOADTEST", session=session)
+    factory = UpdateFactory()
+
+    results = {}
+    for phase, build in (
+        ("registration", registration_updates),
+        ("submission", submission_updates),
+    ):
+        timer.durations.clear()
+        calls_before = session.calls.copy()
+        streams = [build(factory, apartment) for apartment in range(1, apartments + 1)]
+        results[phase] = await run_phase(dp, bot, streams)
+        results[phase]["db_write_p95"] = percentile(timer.durations, 95) * 1000
+        results[phase]["db_write_total"] = sum(timer.durations)
+        results[phase]["db_lock_errors"] = timer.lock_errors
+        results[phase]["api_calls"] = dict(session.calls - calls_before)
+
+    async with session_maker() as db_session:
+        stored = (await db_session.execute(select(func.count()).select_from(readings))).scalar()
+    results["submission"]["stored_readings"] = stored
+    await engine.dispose()
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--apartments", type=int, default=173)
+    parser.add_argument("--db-url", help="база данных (по умолчанию временный файл SQLite)")
+    parser.add_argument("--max-p95-ms", type=float, help="порог p95 задержки обновления")
+    parser.add_argument("--min-throughput", type=float, help="порог обновлений в секунду")
+    parser.add_argument("--max-errors", type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="meters-load-")
+    # Настройки читаются при импорте config, поэтому окружение задаётся до импорта
+    os.environ["DB_LITE"] = args.db_url or f"sqlite+aiosqlite:///{Path(workdir) / 'load.db'}"
+    os.environ.setdefault("BOT_TOKEN", "42:LOADTEST")
+    os.environ.setdefault("ADMIN_IDS", "[]")
+    os.environ["BUILDINGS"] = f'{{"1": {max(args.apartments, 1)}}}'
+    # Синтетический жилец отвечает мгновенно, антифлуд не должен его отсекать
+    os.environ["THROTTLE_BURST"] = "1000"
+    os.environ["DEDUP_FILE"] = str(Path(workdir) / "seen_updates.json")
+    os.chdir(workdir)  # logs.log пишется рядом с main.py, .env не подхватывается
+
+    results = asyncio.run(run(args.apartments))
+
+    failed = False
+    for phase in ("registration", "submission"):
+        r = results[phase]
+        print(
+            f"{phase:<13} updates={r['updates']} errors={r['errors']} "
+            f"{r['throughput']:8.1f} upd/s p50={r['p50']:.1f}ms p95={r['p95']:.1f}ms "
+            f"p99={r['p99']:.1f}ms db_write_p95={r['db_write_p95']:.1f}ms "
+            f"db_write_total={r['db_write_total']:.2f}s lock_errors={r['db_lock_errors']}"
+        )
+        per_resident = {
+            method: round(calls / args.apartments, 1) for method, calls in sorted(r["api_calls"].items())
+        }
+        print(
+            f"{'':<13} api calls per resident: "
+            f"{round(sum(r['api_calls'].values()) / args.apartments, 1)} {per_resident}"
+        )
+        failed |= r["errors"] > args.max_errors
+        failed |= args.max_p95_ms is not None and r["p95"] > args.max_p95_ms
+        failed |= args.min_throughput is not None and r["throughput"] < args.min_throughput
+    expected = args.apartments * len(METER_TYPES)
+    stored = results["submission"]["stored_readings"]
+    print(f"stored readings: {stored}/{expected}")
+    failed |= stored != expected
+    if failed:
+        print("FAILED: нарушены пороги нагрузочного прогона", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,4 +6,5 @@ privat = [
     BotCommand(
         command="edit_serials", description="Редактировать серийные номера счётчиков"
     ),
+    BotCommand(command="history", description="Расход за последний год"),
 ]
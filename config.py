@@ -6,15 +6,140 @@ BASE_DIR = Path(__file__).parent
 class Settings(BaseSettings):
     # Database config
     DB_LITE: str
+    # Отдельные файлы БД для домов (building_id -> URL).
+    # Дома, которых нет в словаре, хранятся в общей БД DB_LITE
+    BUILDING_DB_URLS: dict[int, str] = {}
+    # Настройки пула соединений (для PostgreSQL, DB_LITE=postgresql+asyncpg://...)
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_RECYCLE: int = 1800
+    # Размер кэша скомпилированных выражений SQLAlchemy
+    DB_QUERY_CACHE_SIZE: int = 500
+    # Размер кэша подготовленных выражений asyncpg на соединение
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    # Для файла SQLite: отчёты читают через отдельные соединения mode=ro (WAL),
+    # запись идёт через одно соединение
+    DB_SPLIT_READS: bool = True
     
     # App config
     BOT_TOKEN: str
     ADMIN_IDS: list[int]
     DELTA_MONTH: int = 1
+    # Дома, обслуживаемые ботом: building_id -> количество квартир
+    BUILDINGS: dict[int, int] = {1: 173}
+    DEFAULT_BUILDING_ID: int = 1
+    # Кэш дома пользователя: USER_BUILDING_CACHE_SIZE записей; незарегистрированный
+    # пользователь запоминается на USER_BUILDING_MISS_SECONDS секунд
+    USER_BUILDING_CACHE_SIZE: int = 10000
+    USER_BUILDING_MISS_SECONDS: float = 60.0
+
+    # Archive config: показания старше ARCHIVE_AFTER_MONTHS месяцев переносятся
+    # в сжатый архив ARCHIVE_DIR (последние показания счётчика остаются в БД)
+    ARCHIVE_AFTER_MONTHS: int = 36
+    ARCHIVE_DIR: Path = BASE_DIR / "archive"
+    ARCHIVE_BATCH_SIZE: int = 1000
+    ARCHIVE_INTERVAL_HOURS: int = 24
+
+    # Backup config: сжатые снимки баз SQLite в BACKUP_DIR, хранятся BACKUP_KEEP
+    # последних. Копирование идёт пачками по BACKUP_PAGES_PER_STEP страниц
+    # с паузой BACKUP_STEP_SLEEP секунд между пачками, чтобы не задерживать
+    # запись. Запись в базу начинает копирование заново; после
+    # BACKUP_MAX_RESTARTS перезапусков база копируется за один шаг
+    BACKUP_DIR: Path = BASE_DIR / "backups"
+    BACKUP_KEEP: int = 7
+    BACKUP_INTERVAL_HOURS: int = 24
+    BACKUP_PAGES_PER_STEP: int = 256
+    BACKUP_STEP_SLEEP: float = 0.01
+    BACKUP_MAX_RESTARTS: int = 3
+
+    # Import config: файлы импорта читаются и проверяются пачками по IMPORT_BATCH_SIZE строк
+    IMPORT_BATCH_SIZE: int = 1000
+
+    # Export config: показания читаются курсором и пишутся в файл пачками по EXPORT_CHUNK_SIZE строк
+    EXPORT_CHUNK_SIZE: int = 1000
+
+    # Report config: REPORT_DAY числа отчётный период закрывается, и отчёт в формате
+    # REPORT_FORMAT рассылается всем ADMIN_IDS. Планировщик проверяет это раз в
+    # REPORT_CHECK_MINUTES минут, пропущенные за время простоя отчёты досылаются
+    REPORT_DAY: int = 25
+    REPORT_FORMAT: str = "xlsx"
+    REPORT_CHECK_MINUTES: int = 30
+
+    # Throttling config: каждый пользователь может отправить до THROTTLE_BURST
+    # обновлений подряд, дальше - не чаще THROTTLE_RATE обновлений в секунду
+    THROTTLE_RATE: float = 1.0
+    THROTTLE_BURST: int = 5
+
+    # Broadcast config: жилец, которому рассылка не доставлена (бот заблокирован,
+    # аккаунт удалён), пропускается DELIVERY_BACKOFF_HOURS * 2^(ошибок-1) часов,
+    # но не больше DELIVERY_BACKOFF_MAX_DAYS дней. После UNREACHABLE_AFTER ошибок
+    # подряд он считается недоступным и может быть удалён через /unreachable purge
+    DELIVERY_BACKOFF_HOURS: int = 24
+    DELIVERY_BACKOFF_MAX_DAYS: int = 30
+    UNREACHABLE_AFTER: int = 3
+
+    # Bot API session config: одновременных соединений с Bot API до BOT_CONNECTION_LIMIT,
+    # простаивающее соединение держится BOT_KEEPALIVE_SECONDS, адрес api.telegram.org
+    # кэшируется на BOT_DNS_CACHE_SECONDS. BOT_TIMEOUT - таймаут запроса по умолчанию,
+    # BOT_METHOD_TIMEOUTS - для отдельных методов. Файлы (выгрузки, отчёты, копии)
+    # отправляются через отдельную сессию: BOT_UPLOAD_CONNECTIONS соединений,
+    # таймаут BOT_UPLOAD_TIMEOUT. BOT_API_URL - локальный сервер Bot API
+    BOT_CONNECTION_LIMIT: int = 100
+    BOT_KEEPALIVE_SECONDS: float = 30
+    BOT_DNS_CACHE_SECONDS: int = 3600
+    BOT_TIMEOUT: float = 60
+    BOT_METHOD_TIMEOUTS: dict[str, float] = {
+        "sendMessage": 15,
+        "editMessageText": 15,
+        "answerCallbackQuery": 5,
+    }
+    BOT_UPLOAD_CONNECTIONS: int = 2
+    BOT_UPLOAD_TIMEOUT: float = 300
+    BOT_API_URL: str | None = None
+
+    # Concurrency config: одновременно обрабатываемые обновления и очередь
+    # тяжёлых задач администратора (выгрузки, рассылки)
+    MAX_CONCURRENT_UPDATES: int = 20
+    JOB_WORKERS: int = 1
+    JOB_QUEUE_SIZE: int = 10
+
+    # Idempotency config: обновление с уже обработанным update_id и повторное нажатие
+    # той же кнопки того же сообщения в течение DEDUP_CALLBACK_SECONDS секунд
+    # отбрасываются до открытия сессии БД. Помнятся DEDUP_WINDOW последних
+    # update_id, между перезапусками они хранятся в DEDUP_FILE (None - только
+    # в памяти). При старте накопившиеся обновления обрабатываются, а не
+    # отбрасываются (DROP_PENDING_UPDATES)
+    DEDUP_WINDOW: int = 10000
+    DEDUP_CALLBACK_SECONDS: float = 3.0
+    DEDUP_FILE: Path | None = BASE_DIR / "seen_updates.json"
+    DEDUP_SAVE_EVERY: int = 100
+    DROP_PENDING_UPDATES: bool = False
+
+    # Сколько записей о кнопках (серийные номера, имена) держать в памяти
+    CALLBACK_CACHE_SIZE: int = 10000
+
+    # History config: /history показывает расход за HISTORY_MONTHS месяцев.
+    # Результат хранится в кэше на HISTORY_CACHE_SIZE квартир до новых показаний
+    HISTORY_MONTHS: int = 12
+    HISTORY_CACHE_SIZE: int = 1000
+
+    # Billing config: расход за период считается от последнего показания
+    # не старше BILLING_LOOKBACK_MONTHS месяцев до начала периода
+    BILLING_LOOKBACK_MONTHS: int = 12
+
+    # Estimate config: перед ежемесячным отчётом неподанные показания заменяются
+    # расчётными по среднему расходу счетчика в день за ESTIMATE_HISTORY_MONTHS месяцев
+    ESTIMATE_MISSING: bool = True
+    ESTIMATE_HISTORY_MONTHS: int = 12
 
     @property
     def db_url(self):
         return self.DB_LITE  # Используем SQLite по умолчанию
+
+    def db_url_for(self, building_id: int) -> str:
+        """URL базы данных, в которой хранится дом"""
+        return self.BUILDING_DB_URLS.get(building_id, self.DB_LITE)
         
     model_config = SettingsConfigDict(env_file=".env")
 
@@ -1,52 +1,77 @@
+from collections import Counter
+import math
 from logging import Logger, getLogger
 from datetime import datetime, date
-from typing import Any, Sequence
+from typing import Any, AsyncIterator, Sequence
 
 from dateutil.relativedelta import relativedelta
-from sqlalchemy import TextClause, text
 from sqlalchemy.engine.row import RowMapping
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
+from database import queries
+from database.models import DEFAULT_METER_TYPES
 from utils.schemas import (
     UserRegistrShema,
-    MeterCountSchema,
-    MeterSeriesSchema,
+    ApartmentMetersSchema,
+    MeterSetSchema,
     SubmissionSchema,
-    DescriptionSchema,
+    MeterImportSchema,
 )
+from utils.cache import LRUCache
 from config import settings
 
 logger: Logger = getLogger(__name__)
 
+# История расхода квартир: (building_id, квартира) -> (начало окна, строки).
+# Запись удаляется, когда у квартиры появляются новые показания
+history_cache = LRUCache(settings.HISTORY_CACHE_SIZE)
+
+# Дом пользователя для DbSessionMiddleware: user_id -> (building_id, годен до).
+# Запись заменяется при регистрации и удаляется вместе с пользователем
+user_building_cache = LRUCache(settings.USER_BUILDING_CACHE_SIZE)
+
+
+def get_period_bounds(period: date) -> tuple[datetime, datetime]:
+    """
+    Возвращает границы месяца периода: [начало месяца, начало следующего).
+
+    Сравнение reading_date с диапазоном одинаково работает в SQLite и PostgreSQL
+    (в отличие от strftime) и позволяет использовать индексы по reading_date.
+    """
+    start = datetime(period.year, period.month, 1)
+    return start, start + relativedelta(months=1)
+
+
+def get_reading_date() -> datetime:
+    """
+    Дата показаний текущего отчётного периода: сегодняшнее число
+    на DELTA_MONTH месяцев назад.
+
+    Этой же датой помечаются установка и снятие счетчика при замене,
+    чтобы расход месяца замены попадал в тот же период, что и показания.
+    """
+    previous_month = date.today() - relativedelta(months=settings.DELTA_MONTH)
+    return datetime.combine(previous_month, datetime.min.time())
+
 
 class Database:
-    def __init__(self, session: AsyncSession):
+    def __init__(self, session: AsyncSession, building_id: int | None = None):
         self.session = session
+        # Все запросы ограничены одним домом
+        self.building_id = building_id or settings.DEFAULT_BUILDING_ID
 
     async def _ensure_meter_types_exist(self):
         # Проверяем, есть ли уже данные в таблице
         try:
-            result = await self.session.execute(
-                text("SELECT COUNT(*) FROM meter_types")
-            )
+            result = await self.session.execute(queries.count_meter_types)
             count = result.scalar()
 
             if count == 0:
                 # Заполняем таблицу типами счетчиков
-                meter_types = [
-                    {"name": "electricity", "unit": "kWh"},
-                    {"name": "heat", "unit": "Gcal"},
-                    {"name": "hot_water", "unit": "m3"},
-                    {"name": "cold_water", "unit": "m3"},
-                ]
-
-                for mt in meter_types:
-                    stmt = text(
-                        "INSERT INTO meter_types (name, unit) VALUES (:name, :unit)"
-                    )
-                    await self.session.execute(stmt.bindparams(**mt))
-
+                await self.session.execute(
+                    queries.insert_meter_type, DEFAULT_METER_TYPES
+                )
                 await self.session.commit()
         except SQLAlchemyError as e:
             await self.session.rollback()
@@ -55,40 +80,31 @@ class Database:
     async def add_user_info(self, user_info: UserRegistrShema):
         """Добавляет информацию о пользователе в базу данных"""
         try:
-            stmt = text(
-                """
-                INSERT INTO users 
-                VALUES (:user_id, :apartment_number, :first_name, :last_name)
-            """
+            await self.session.execute(
+                queries.insert_user,
+                {**user_info.model_dump(), "building_id": self.building_id},
             )
-            await self.session.execute(stmt.bindparams(**user_info.model_dump()))
             await self.session.commit()
+            user_building_cache.put(user_info.user_id, (self.building_id, math.inf))
             logger.info("Добавлен пользователе: %s", user_info)
         except SQLAlchemyError as e:
             await self.session.rollback()
             logger.error("Ошибка при добавлении информации о пользователе: %s", e)
 
-    async def add_meters_info(self, user_id: int, meters_info: MeterCountSchema):
+    async def add_meters_info(self, user_id: int, meters: dict[str, MeterSetSchema]):
         """Добавляет информацию о счетчиках в базу данных"""
         try:
             # Сохраняем информацию о счетчиках
-            for meter_type, count in meters_info:
-                meter_type = meter_type.replace("_count", "")
-                if count > 0:  # Добавляем только если есть счетчики
-                    stmt = text(
-                        """
-                        INSERT INTO meters (apartment_number, type_id, "count_meter")
-                        SELECT apartment_number, type_id, :count_meter
-                        FROM users
-                            JOIN meter_types ON meter_types.name = :meter_type
-                        WHERE user_id = :user_id
-                    """
-                    )
+            for meter_type, meter_set in meters.items():
+                if meter_set.serials:  # Добавляем только если есть счетчики
                     logger.info("Счетчик: %s добавлен в БД", meter_type)
                     await self.session.execute(
-                        stmt.bindparams(
-                            user_id=user_id, meter_type=meter_type, count_meter=count
-                        )
+                        queries.insert_meters,
+                        {
+                            "user_id": user_id,
+                            "meter_type": meter_type,
+                            "count_meter": len(meter_set.serials),
+                        },
                     )
             await self.session.commit()
         except SQLAlchemyError as e:
@@ -96,36 +112,27 @@ class Database:
             logger.error("Ошибка при добавлении информации о счётчиках: %s", e)
 
     async def add_meter_series_info(
-        self, apartment_number: int, series_info: MeterSeriesSchema
+        self, apartment_number: int, meters: dict[str, MeterSetSchema]
     ):
         """Добавляет информацию о серийных номерах счетчиков в базу данных"""
         try:
             # Сохраняем информацию о сериях счетчиков
-            for series in series_info:
-                meter_type = series[0].replace("_serials", "")
-                if series[1]:
-                    for serial_number in series[1]:
-                        stmt: TextClause = text(
-                            """
-                            INSERT INTO serials (meter_id, serial_number)
-                            SELECT meter_id, :series
-                            FROM meters
-                                    JOIN meter_types USING (type_id)
-                            WHERE apartment_number = :apartment_number AND meter_types.name = :meter_type
-                        """
-                        )
-                        logger.info(
-                            "Серийный номер %s счётчика: %s добавлен в БД",
-                            serial_number,
-                            meter_type,
-                        )
-                        await self.session.execute(
-                            stmt.bindparams(
-                                apartment_number=apartment_number,
-                                meter_type=meter_type,
-                                series=serial_number,
-                            )
-                        )
+            for meter_type, meter_set in meters.items():
+                for serial_number in meter_set.serials:
+                    logger.info(
+                        "Серийный номер %s счётчика: %s добавлен в БД",
+                        serial_number,
+                        meter_type,
+                    )
+                    await self.session.execute(
+                        queries.insert_serial,
+                        {
+                            "building_id": self.building_id,
+                            "apartment_number": apartment_number,
+                            "meter_type": meter_type,
+                            "serial": serial_number,
+                        },
+                    )
             await self.session.commit()
         except SQLAlchemyError as e:
             await self.session.rollback()
@@ -134,86 +141,277 @@ class Database:
             )
 
     async def add_meter_descriptions(
-        self,
-        apartment_number: int,
-        descriptions_info: DescriptionSchema,
-        series_info: MeterSeriesSchema,
+        self, apartment_number: int, meters: dict[str, MeterSetSchema]
     ) -> None:
         """Добавляет описания счетчиков в базу данных"""
-        descriptions_info = descriptions_info.model_dump()
-        series_info = series_info.model_dump()
-        logger.info("Описания счётчиков %s", descriptions_info)
-        try:
-            for meter_type in ["hot_water", "cold_water", "electricity", "heat"]:
-                if (
-                    series_info[f"{meter_type}_serials"]
-                    and descriptions_info[f"{meter_type}_descriptions"]
-                ):
-                    for serial, description in zip(
-                        series_info[f"{meter_type}_serials"],
-                        descriptions_info[f"{meter_type}_descriptions"],
-                    ):
-                        logger.info("Счётчик %s: %s", meter_type, serial)
-                        stmt: TextClause = text(
-                            """
-                            INSERT INTO meter_descriptions (serial_id, description)
-                            SELECT serial_id, :description
-                            FROM serials
-                                JOIN meters USING (meter_id)
-                                JOIN meter_types USING (type_id)
-                            WHERE meters.apartment_number = :apartment_number
-                            AND meter_types.name = :meter_type
-                            AND serials.serial_number = :serial
-                        """
-                        )
-                        await self.session.execute(
-                            stmt.bindparams(
-                                apartment_number=apartment_number,
-                                meter_type=meter_type,
-                                serial=serial,
-                                description=description,
-                            )
-                        )
+        try:
+            for meter_type, meter_set in meters.items():
+                for serial, description in zip(meter_set.serials, meter_set.descriptions):
+                    logger.info("Счётчик %s: %s", meter_type, serial)
+                    await self.session.execute(
+                        queries.insert_description,
+                        {
+                            "building_id": self.building_id,
+                            "apartment_number": apartment_number,
+                            "meter_type": meter_type,
+                            "serial": serial,
+                            "description": description,
+                        },
+                    )
             await self.session.commit()
         except (Exception, SQLAlchemyError) as e:
             await self.session.rollback()
             logger.error("Ошибка при добавлении описаний счетчиков: %s", e)
 
-    async def add_info_apartment(self, apartment_info) -> None:
-        """Добавляет информацию о квартирах в базу данных"""
+    async def add_info_apartment(self, apartment_info: dict) -> None:
+        """
+        Добавляет информацию о квартирах в базу данных.
+
+        apartment_info - данные пользователя (UserRegistrShema) и meters:
+        {тип счетчика: {"serials": [...], "descriptions": [...]}}.
+        """
         # Убедимся, что типы счетчиков существуют
         await self._ensure_meter_types_exist()
         logger.info("Вся инфа %s", apartment_info)
 
         user_info = UserRegistrShema(**apartment_info)
-        meters_info = MeterCountSchema(**apartment_info)
-        series_info = MeterSeriesSchema(**apartment_info)
-        descriptions_info = DescriptionSchema(**apartment_info)
+        meters = ApartmentMetersSchema(**apartment_info).meters
         # Сохраняем основную информацию о пользователе
         await self.add_user_info(user_info)
         # Сохраняем информацию о счетчиках
-        await self.add_meters_info(user_info.user_id, meters_info)
+        await self.add_meters_info(user_info.user_id, meters)
         # Сохраняем информацию о сериях счетчиков
-        await self.add_meter_series_info(user_info.apartment_number, series_info)
+        await self.add_meter_series_info(user_info.apartment_number, meters)
         # Сохраняем описания счетчиков
-        await self.add_meter_descriptions(
-            user_info.apartment_number, descriptions_info, series_info
+        await self.add_meter_descriptions(user_info.apartment_number, meters)
+
+    async def get_meter_types(self) -> Sequence[RowMapping]:
+        """Типы счетчиков в порядке опроса с названиями и допустимым количеством"""
+        try:
+            result = await self.session.execute(queries.select_meter_types)
+            return result.mappings().fetchall()
+        except SQLAlchemyError as e:
+            logger.error("Ошибка при получении типов счетчиков: %s", e)
+            raise
+
+    async def get_meter_type_ids(self) -> dict[str, int]:
+        """Справочник типов счетчиков: название -> type_id"""
+        try:
+            result = await self.session.execute(queries.select_meter_type_ids)
+            return dict(result.tuples().all())
+        except SQLAlchemyError as e:
+            logger.error("Ошибка при получении типов счетчиков: %s", e)
+            raise
+
+    async def get_building_serials(self) -> Sequence[RowMapping]:
+        """Все серийные номера счетчиков дома с квартирой и типом счетчика"""
+        try:
+            result = await self.session.execute(
+                queries.select_building_serials, {"building_id": self.building_id}
+            )
+            return result.mappings().all()
+        except SQLAlchemyError as e:
+            logger.error("Ошибка при получении серийных номеров дома: %s", e)
+            raise
+
+    async def import_meters(self, rows: list[MeterImportSchema]) -> int:
+        """
+        Загружает счетчики квартир одной транзакцией, возвращает число строк.
+
+        Счетчики, серийные номера и описания добавляются пакетными INSERT
+        (executemany), id новых строк возвращает RETURNING. Если в квартире
+        уже есть счетчик этого типа, серийные номера добавляются к нему.
+        """
+        if not rows:
+            return 0
+        try:
+            type_ids = await self.get_meter_type_ids()
+            result = await self.session.execute(
+                queries.select_building_meters, {"building_id": self.building_id}
+            )
+            meters = {
+                (row.apartment_number, row.type_id): row for row in result.all()
+            }
+
+            added = Counter(
+                (row.apartment_number, type_ids[row.meter_type]) for row in rows
+            )
+            new_meters = [
+                {
+                    "building_id": self.building_id,
+                    "apartment_number": apartment_number,
+                    "type_id": type_id,
+                    "count_meter": count,
+                }
+                for (apartment_number, type_id), count in added.items()
+                if (apartment_number, type_id) not in meters
+            ]
+            changed_meters = [
+                {"b_meter_id": meter.meter_id, "count_meter": meter.count_meter + added[key]}
+                for key, meter in meters.items()
+                if key in added
+            ]
+            meter_ids = {key: meter.meter_id for key, meter in meters.items()}
+            if new_meters:
+                result = await self.session.execute(
+                    queries.insert_meter_rows, new_meters
+                )
+                for meter_id, apartment_number, type_id in result.tuples():
+                    meter_ids[apartment_number, type_id] = meter_id
+            if changed_meters:
+                await self.session.execute(queries.update_meter_count, changed_meters)
+
+            result = await self.session.execute(
+                queries.insert_serial_rows,
+                [
+                    {
+                        "meter_id": meter_ids[row.apartment_number, type_ids[row.meter_type]],
+                        "serial_number": row.serial_number,
+                    }
+                    for row in rows
+                ],
+            )
+            serial_ids = {
+                (meter_id, serial_number): serial_id
+                for serial_id, meter_id, serial_number in result.tuples()
+            }
+            await self.session.execute(
+                queries.insert_description_rows,
+                [
+                    {
+                        "serial_id": serial_ids[
+                            meter_ids[row.apartment_number, type_ids[row.meter_type]],
+                            row.serial_number,
+                        ],
+                        "description": row.description,
+                    }
+                    for row in rows
+                ],
+            )
+            await self.session.commit()
+            logger.info("Импортировано счетчиков: %s", len(rows))
+            return len(rows)
+        except SQLAlchemyError as e:
+            await self.session.rollback()
+            logger.error("Ошибка при импорте счетчиков: %s", e)
+            return 0
+
+    async def get_import_checkpoint(self, file_hash: str) -> RowMapping | None:
+        """До какой строки файл показаний уже загружен (None - файл новый)"""
+        try:
+            result = await self.session.execute(
+                queries.select_import_checkpoint,
+                {"file_hash": file_hash, "building_id": self.building_id},
+            )
+            return result.mappings().first()
+        except SQLAlchemyError as e:
+            logger.error("Ошибка при получении хода импорта: %s", e)
+            raise
+
+    async def import_readings(
+        self, rows: list[dict], file_hash: str, row_number: int, new_file: bool = False
+    ) -> int:
+        """
+        Загружает пачку исторических показаний, возвращает число вставленных строк.
+
+        Показания, которые уже есть в readings, пропускаются (ON CONFLICT по
+        uix_meter_reading_date), а расчётные показания тех же месяцев удаляются.
+        Ход импорта фиксируется в той же транзакции, поэтому после сбоя импорт
+        продолжается с первой незагруженной пачки.
+        """
+        statement = queries.insert_readings_ignore[self.session.bind.dialect.name]
+        try:
+            inserted = 0
+            if rows:
+                await self._delete_superseded_estimates(rows)
+                result = await self.session.execute(
+                    statement,
+                    [{**row, "building_id": self.building_id} for row in rows],
+                )
+                inserted = len(result.all())
+            checkpoint = {
+                "file_hash": file_hash,
+                "building_id": self.building_id,
+                "row_number": row_number,
+                "imported": inserted,
+                "updated_at": datetime.now(),
+            }
+            if new_file:
+                await self.session.execute(queries.insert_import_checkpoint, checkpoint)
+            else:
+                await self.session.execute(
+                    queries.update_import_checkpoint,
+                    {**checkpoint, "b_file_hash": file_hash, "b_building_id": self.building_id},
+                )
+            await self.session.commit()
+            if inserted:
+                history_cache.clear()
+            return inserted
+        except SQLAlchemyError as e:
+            await self.session.rollback()
+            logger.error("Ошибка при импорте показаний: %s", e)
+            raise
+
+    async def _delete_superseded_estimates(self, rows: list[dict]) -> None:
+        """Удаляет расчётные показания счетчиков за месяцы, в которых есть rows (без фиксации)"""
+        months = {(row["serial_id"], row["reading_date"].year, row["reading_date"].month) for row in rows}
+        result = await self.session.execute(
+            queries.select_estimated_readings,
+            {"serial_ids": list({serial_id for serial_id, _, _ in months})},
         )
+        superseded = [
+            reading["reading_id"]
+            for reading in result.mappings()
+            if (reading["serial_id"], reading["reading_date"].year, reading["reading_date"].month) in months
+        ]
+        if superseded:
+            await self.session.execute(queries.delete_readings, {"reading_ids": superseded})
+
+    async def get_estimate_history(self, period: date) -> Sequence[RowMapping]:
+        """
+        Счетчики дома без показаний за месяц period и границы их истории:
+        первое и последнее настоящее показание за ESTIMATE_HISTORY_MONTHS месяцев.
+        """
+        period_start, period_end = get_period_bounds(period)
+        try:
+            result = await self.session.execute(
+                queries.select_estimate_history,
+                {
+                    "building_id": self.building_id,
+                    "period_start": period_start,
+                    "period_end": period_end,
+                    "since": period_start - relativedelta(months=settings.ESTIMATE_HISTORY_MONTHS),
+                },
+            )
+            return result.mappings().fetchall()
+        except SQLAlchemyError as e:
+            logger.error("Ошибка при получении истории для расчётных показаний: %s", e)
+            raise
+
+    async def add_estimated_readings(self, rows: list[dict]) -> int:
+        """Сохраняет расчётные показания одной транзакцией"""
+        if not rows:
+            return 0
+        try:
+            await self.session.execute(
+                queries.insert_estimated_readings,
+                [{**row, "building_id": self.building_id, "estimated": True} for row in rows],
+            )
+            await self.session.commit()
+            history_cache.clear()
+            return len(rows)
+        except SQLAlchemyError as e:
+            await self.session.rollback()
+            logger.error("Ошибка при сохранении расчётных показаний: %s", e)
+            raise
 
     async def get_info_for_user(self, user_id: int) -> dict[str, Any]:
         """Получает информацию о пользователе и его счетчиках"""
         try:
             # Получаем информацию о пользователе
-            query: TextClause = text(
-                """
-                        SELECT first_name, apartment_number
-                        FROM users
-                        WHERE users.user_id = :user_id
-                    """
+            result = await self.session.execute(
+                queries.select_user, {"user_id": user_id}
             )
-            query = query.bindparams(user_id=user_id)
-
-            result = await self.session.execute(query)
             res = result.mappings().first()
             if res:
                 logger.info("Найденные данные о пользователе: %s", res)
@@ -230,23 +428,14 @@ class Database:
     ):
         """Получает список серийных номеров счётчиков"""
         try:
-            query: TextClause = text(
-                """
-                SELECT serial_number, description
-                FROM serials
-                    JOIN meters USING (meter_id)
-                    JOIN meter_types USING (type_id)
-                    JOIN meter_descriptions USING (serial_id)
-                WHERE meters.apartment_number = :apartment_number 
-                AND meter_types.name = :meter_type
-            """
-            )
-
-            query = query.bindparams(
-                apartment_number=apartment,
-                meter_type=meter_type,
+            result = await self.session.execute(
+                queries.select_serials_and_descriptions_by_type,
+                {
+                    "building_id": self.building_id,
+                    "apartment_number": apartment,
+                    "meter_type": meter_type,
+                },
             )
-            result = await self.session.execute(query)
             res = result.mappings().fetchall()
             if res:
                 logger.info("Найденные данные о серийных номерах счётчиков: %s", res)
@@ -263,18 +452,10 @@ class Database:
     async def get_all_meters_serials_and_descriptions(self, apartment: int):
         """Получает список серийных номеров счётчиков с описаниями"""
         try:
-            query: TextClause = text(
-                """
-                SELECT serial_number, description
-                FROM serials
-                    JOIN meters USING (meter_id)
-                    JOIN meter_types USING (type_id)
-                    JOIN meter_descriptions USING (serial_id)
-                WHERE meters.apartment_number = :apartment_number
-            """
-            )
-            query = query.bindparams(apartment_number=apartment)
-            result = await self.session.execute(query)
+            result = await self.session.execute(
+                queries.select_serials_and_descriptions,
+                {"building_id": self.building_id, "apartment_number": apartment},
+            )
             res = result.mappings().fetchall()
             logger.info(
                 "Найденные данные о серийных номерах счётчиков с описаниями: %s", res
@@ -288,42 +469,74 @@ class Database:
 
     async def add_reading(self, meter_value_info: dict) -> None:
         """Добавляет показания счётчика"""
-        previous_month = date.today() - relativedelta(months=settings.DELTA_MONTH)
-        meter_value_info["reading_date"] = previous_month
+        meter_value_info["reading_date"] = get_reading_date()
         readings = SubmissionSchema(**meter_value_info)
         logger.info("Показания от пользователя: %s", readings)
+        period_start, period_end = get_period_bounds(readings.reading_date)
         try:
+            # Настоящее показание заменяет расчётное за тот же месяц
+            await self.session.execute(
+                queries.delete_estimated_reading,
+                {
+                    **readings.model_dump(),
+                    "building_id": self.building_id,
+                    "period_start": period_start,
+                    "period_end": period_end,
+                },
+            )
             # Добавляем показания
-            stmt = text(
-                """
-                INSERT INTO readings (meter_id, user_id, serial_id, value, reading_date)
-                SELECT meter_id, :user_id as user_id, serial_id, :value AS value, :reading_date AS reading_date
-                FROM meters
-                    JOIN meter_types USING (type_id)
-                    JOIN serials USING (meter_id)
-                WHERE apartment_number = :apartment_number 
-                    AND meter_types.name = :meter_type 
-                    AND  serial_number = :serial_number
-            """
-            )
-            await self.session.execute(stmt.bindparams(**readings.model_dump()))
+            await self.session.execute(
+                queries.insert_reading,
+                {**readings.model_dump(), "building_id": self.building_id},
+            )
             logger.info("Показания добавлены")
             await self.session.commit()
+            history_cache.pop((self.building_id, readings.apartment_number))
 
         except SQLAlchemyError as e:
             await self.session.rollback()
             logger.error("Ошибка при сохранении показаний: %s", e)
 
+    async def get_consumption_history(
+        self, apartment: int, months: int | None = None
+    ) -> Sequence[RowMapping]:
+        """
+        Показания и расход счетчиков квартиры за последние months отчётных месяцев.
+
+        Расход считается в базе одним оконным запросом (LAG по серийному
+        номеру). Результат кэшируется до следующих показаний квартиры.
+        """
+        months = months or settings.HISTORY_MONTHS
+        period = date.today() - relativedelta(months=settings.DELTA_MONTH)
+        window_start = get_period_bounds(period)[0] - relativedelta(months=months - 1)
+        key = (self.building_id, apartment)
+        cached = history_cache.get(key)
+        if cached and cached[0] == window_start:
+            return cached[1]
+        try:
+            result = await self.session.execute(
+                queries.select_consumption_history,
+                {
+                    "building_id": self.building_id,
+                    "apartment_number": apartment,
+                    "period_start": window_start,
+                    # Запас на пропущенные месяцы перед началом окна
+                    "since": window_start - relativedelta(months=months),
+                },
+            )
+            rows = result.mappings().fetchall()
+        except SQLAlchemyError as e:
+            logger.error("Ошибка при получении истории расхода: %s", e)
+            raise
+        history_cache.put(key, (window_start, rows))
+        return rows
+
     async def get_all_users(self):
         """Получает информацию обо всех пользователях"""
         try:
-            query: TextClause = text(
-                """
-                SELECT user_id
-                FROM users
-                """
+            result = await self.session.execute(
+                queries.select_users, {"building_id": self.building_id}
             )
-            result = await self.session.execute(query)
             res = result.mappings().fetchall()
             return res
         except SQLAlchemyError as e:
@@ -336,24 +549,16 @@ class Database:
             f"{period.month:02d}",
             str(period.year),
         )
+        period_start, period_end = get_period_bounds(period)
         try:
-            stmt = text(
-                """
-                SELECT name
-                FROM readings
-                    JOIN meters USING (meter_id)
-                    JOIN meter_types USING (type_id)
-                WHERE  strftime('%Y', reading_date) = :year
-                AND strftime('%m', reading_date) = :month
-                AND apartment_number = :apartment_number
-            """
-            )
             result = await self.session.execute(
-                stmt.bindparams(
-                    year=str(period.year),
-                    month=f"{period.month:02d}",
-                    apartment_number=apartment_number,
-                )
+                queries.select_meter_types_for_period,
+                {
+                    "building_id": self.building_id,
+                    "period_start": period_start,
+                    "period_end": period_end,
+                    "apartment_number": apartment_number,
+                },
             )
             res = [
                 row[0] for row in result.fetchall()
@@ -365,28 +570,16 @@ class Database:
 
     async def get_previous_reading(self, meter_type, serial_number: str) -> dict | None:
         """Получает предыдущие показания для указанного счетчика"""
-        current_period = date.today()
-        try:
-            stmt = text(
-                """
-                SELECT value, reading_date
-                FROM readings 
-                    JOIN serials USING (serial_id)
-                    JOIN meters USING (meter_id)
-                    JOIN meter_types USING (type_id)
-                WHERE serials.serial_number = :serial_number 
-                AND name = :meter_type
-                AND readings.reading_date < :current_period
-                ORDER BY readings.reading_date DESC
-                LIMIT 1
-            """
-            )
+        current_period = datetime.combine(date.today(), datetime.min.time())
+        try:
             result = await self.session.execute(
-                stmt.bindparams(
-                    serial_number=serial_number,
-                    current_period=current_period,
-                    meter_type=meter_type,
-                )
+                queries.select_previous_reading,
+                {
+                    "building_id": self.building_id,
+                    "serial_number": serial_number,
+                    "current_period": current_period,
+                    "meter_type": meter_type,
+                },
             )
             return result.mappings().first()
         except SQLAlchemyError as e:
@@ -395,98 +588,202 @@ class Database:
     async def update_serial_number(
         self, old_serial: str, new_serial: str, user_id: int
     ) -> bool:
-        """Обновляет серийный номер счетчика"""
-        try:
-            stmt = text(
-                """
-                UPDATE serials
-                SET serial_number = :new_serial
-                WHERE serial_id IN (
-                    SELECT s.serial_id
-                    FROM serials s
-                    JOIN meters m USING (meter_id)
-                    JOIN users u USING (apartment_number)
-                    WHERE s.serial_number = :old_serial
-                    AND u.user_id = :user_id
-                )
-            """
+        """
+        Обновляет серийный номер установленного счетчика. Возвращает False,
+        если такой серийный номер у счетчика уже есть или старый номер снят
+        при замене
+        """
+        if await self.get_user_serial(new_serial, user_id) is not None:
+            return False
+        try:
+            result = await self.session.execute(
+                queries.update_serial_number,
+                {"old_serial": old_serial, "new_serial": new_serial, "user_id": user_id},
+            )
+            await self.session.commit()
+            if not result.rowcount:
+                return False
+            history_cache.clear()
+            return True
+        except IntegrityError as e:
+            # Номер совпал со снятым счетчиком или добавлен параллельно
+            await self.session.rollback()
+            logger.warning("Серийный номер %s уже есть: %s", new_serial, e)
+            return False
+        except SQLAlchemyError as e:
+            await self.session.rollback()
+            logger.error("Ошибка при обновлении серийного номера: %s", e)
+            raise
+
+    async def get_user_serial(self, serial_number: str, user_id: int) -> RowMapping | None:
+        """Установленный счетчик пользователя по серийному номеру"""
+        try:
+            result = await self.session.execute(
+                queries.select_user_serial,
+                {"serial_number": serial_number, "user_id": user_id},
+            )
+            return result.mappings().first()
+        except SQLAlchemyError as e:
+            logger.error("Ошибка при получении счетчика: %s", e)
+            raise
+
+    async def replace_serial(
+        self,
+        old_serial: str,
+        new_serial: str,
+        user_id: int,
+        replaced_at: datetime | None = None,
+        end_value: int | None = None,
+        start_value: int | None = None,
+    ) -> bool:
+        """
+        Замена счетчика: новый серийный номер заводится отдельной строкой
+        serials, старый остаётся со своими показаниями и закрывается в
+        serial_history датой снятия. Показания при снятии и установке
+        делят расход месяца замены между счетчиками. По умолчанию замена
+        датируется датой показаний текущего периода (get_reading_date).
+        Возвращает False, если старого счетчика нет или новый номер уже есть.
+        """
+        old = await self.get_user_serial(old_serial, user_id)
+        if old is None or await self.get_user_serial(new_serial, user_id) is not None:
+            return False
+        replaced_at = replaced_at or get_reading_date()
+        try:
+            result = await self.session.execute(
+                queries.insert_serial_rows,
+                {"meter_id": old.meter_id, "serial_number": new_serial},
             )
+            new_serial_id = result.one().serial_id
             await self.session.execute(
-                stmt.bindparams(
-                    old_serial=old_serial, new_serial=new_serial, user_id=user_id
-                )
+                queries.copy_description,
+                {"new_serial_id": new_serial_id, "old_serial_id": old.serial_id},
             )
+            result = await self.session.execute(
+                queries.close_serial_history,
+                {"b_serial_id": old.serial_id, "b_valid_to": replaced_at, "b_end_value": end_value},
+            )
+            # executemany: у всех строк одинаковый набор столбцов
+            history = [
+                {
+                    "serial_id": new_serial_id,
+                    "meter_id": old.meter_id,
+                    "valid_from": replaced_at,
+                    "valid_to": None,
+                    "start_value": start_value,
+                    "end_value": None,
+                }
+            ]
+            if not result.rowcount:
+                history.append(
+                    {
+                        "serial_id": old.serial_id,
+                        "meter_id": old.meter_id,
+                        "valid_from": None,
+                        "valid_to": replaced_at,
+                        "start_value": None,
+                        "end_value": end_value,
+                    }
+                )
+            await self.session.execute(queries.insert_serial_history, history)
             await self.session.commit()
+            history_cache.clear()
+            logger.info("Счетчик %s заменён на %s", old_serial, new_serial)
+            return True
+        except IntegrityError as e:
+            await self.session.rollback()
+            logger.warning("Серийный номер %s уже есть: %s", new_serial, e)
+            return False
+        except SQLAlchemyError as e:
+            await self.session.rollback()
+            logger.error("Ошибка при замене счетчика: %s", e)
+            raise
 
+    async def get_readings_to_archive(
+        self, before: datetime, limit: int
+    ) -> Sequence[RowMapping]:
+        """Получает пачку показаний старше before, кроме последних показаний счётчиков"""
+        try:
+            result = await self.session.execute(
+                queries.select_readings_to_archive,
+                {"building_id": self.building_id, "before": before, "limit": limit},
+            )
+            return result.mappings().fetchall()
+        except SQLAlchemyError as e:
+            logger.error("Ошибка при получении показаний для архивации: %s", e)
+            raise
+
+    async def delete_readings(self, reading_ids: list[int]) -> None:
+        """Удаляет показания по идентификаторам"""
+        try:
+            await self.session.execute(
+                queries.delete_readings, {"reading_ids": reading_ids}
+            )
+            await self.session.commit()
+            history_cache.clear()
         except SQLAlchemyError as e:
             await self.session.rollback()
-            logger.error("Ошибка при обновлении серийного номера: %e", e)
+            logger.error("Ошибка при удалении показаний: %s", e)
             raise
 
     async def get_all_readings_for_period(self) -> Sequence[RowMapping] | None:
         """Получает показания всех счетчиков за указанный период"""
         period: date = date.today() - relativedelta(months=settings.DELTA_MONTH)
+        period_start, period_end = get_period_bounds(period)
         try:
-            stmt = text(
-                """
-            WITH last_readings AS (
-                SELECT 
-                    meter_id,
-                    MAX(reading_date) AS last_date
-                FROM readings
-                WHERE strftime('%Y', readings.reading_date) = :year
-                AND strftime('%m', readings.reading_date) = :month
-                GROUP BY meter_id
-            )
-            SELECT 
-                users.apartment_number, 
-                name, 
-                serial_number, 
-                value, 
-                reading_date
-            FROM readings
-                JOIN meters USING (meter_id)
-                JOIN serials USING (serial_id)
-                JOIN meter_types USING (type_id)
-                JOIN users USING (user_id)
-                JOIN last_readings ON readings.meter_id = last_readings.meter_id 
-                        AND readings.reading_date = last_readings.last_date
-            WHERE strftime('%Y', readings.reading_date) = :year
-            AND strftime('%m', readings.reading_date) = :month     
-            ORDER BY users.apartment_number, meter_types.name
-            """
-            )
             result = await self.session.execute(
-                stmt.bindparams(year=str(period.year), month=f"{period.month:02d}")
+                queries.select_readings_for_period,
+                {
+                    "building_id": self.building_id,
+                    "period_start": period_start,
+                    "period_end": period_end,
+                },
             )
             return result.mappings().fetchall()
         except SQLAlchemyError as e:
             logger.error("Ошибка при получении показаний за период: %s", e)
             raise
 
+    async def stream_readings_for_period(
+        self, chunk_size: int | None = None, period: date | None = None
+    ) -> AsyncIterator[Sequence[RowMapping]]:
+        """
+        Показания всех счетчиков за период пачками по chunk_size строк.
+
+        Строки читаются курсором (в PostgreSQL - серверным), поэтому выгрузка
+        не держит в памяти весь результат, сколько бы показаний ни было.
+        По умолчанию период - текущий отчётный.
+        """
+        chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+        if period is None:
+            period = date.today() - relativedelta(months=settings.DELTA_MONTH)
+        period_start, period_end = get_period_bounds(period)
+        try:
+            result = await self.session.stream(
+                queries.select_readings_for_period.execution_options(yield_per=chunk_size),
+                {
+                    "building_id": self.building_id,
+                    "period_start": period_start,
+                    "period_end": period_end,
+                },
+            )
+            async for partition in result.mappings().partitions():
+                yield partition
+        except SQLAlchemyError as e:
+            logger.error("Ошибка при выгрузке показаний за период: %s", e)
+            raise
+
     async def get_apartments_without_readings(self):
         """Получает список квартир, не подавших показания за указанный период"""
         period: date = date.today() - relativedelta(months=settings.DELTA_MONTH)
+        period_start, period_end = get_period_bounds(period)
         try:
-            stmt: TextClause = text(
-                """
-                WITH apartments_with_readings 
-                    AS (
-                        SELECT DISTINCT apartment_number
-                        FROM readings
-                            JOIN meters USING (meter_id)
-                        WHERE strftime('%Y', readings.reading_date) = :year
-                        AND strftime('%m', readings.reading_date) = :month
-                    )
-                SELECT users.apartment_number
-                FROM users
-                WHERE users.apartment_number NOT IN (
-                    SELECT apartment_number FROM apartments_with_readings
-                )
-            """
-            )
             result = await self.session.execute(
-                stmt.bindparams(year=str(period.year), month=f"{period.month:02d}")
+                queries.select_apartments_without_readings,
+                {
+                    "building_id": self.building_id,
+                    "period_start": period_start,
+                    "period_end": period_end,
+                },
             )
             return result.scalars().all()
         except SQLAlchemyError as e:
@@ -496,34 +793,264 @@ class Database:
     async def get_users_by_apartment(self, apartment_number: int) -> dict | None:
         """Получает пользователя по номеру квартиры"""
         try:
-            stmt: TextClause = text(
-                """
-                SELECT first_name, user_id 
-                FROM users
-                WHERE apartment_number = :apartment_number
-            """
-            )
             result = await self.session.execute(
-                stmt.bindparams(apartment_number=apartment_number)
+                queries.select_users_by_apartment,
+                {"building_id": self.building_id, "apartment_number": apartment_number},
             )
             return result.mappings().fetchall()
         except SQLAlchemyError as e:
             logger.error("Ошибка при получении пользователя по номеру квартиры: %s", e)
 
     async def delete_user_by_apartment(self, apartment_number: int, user_id: int):
-        """Удаляет пользователя по номеру квартиры"""
+        """Удаляет пользователя по номеру квартиры вместе с его состоянием доставки"""
+        try:
+            result = await self.session.execute(
+                queries.delete_user,
+                {
+                    "building_id": self.building_id,
+                    "apartment_number": apartment_number,
+                    "user_id": user_id,
+                },
+            )
+            if result.rowcount:
+                await self.session.execute(queries.clear_readings_user, {"b_user_id": user_id})
+                await self.session.execute(queries.delete_user_delivery, {"user_id": user_id})
+            await self.session.commit()
+            user_building_cache.pop(user_id)
+        except SQLAlchemyError as e:
+            await self.session.rollback()
+            logger.error("Ошибка при удалении пользователя: %s", e)
+
+    async def get_broadcast_users(self, now: datetime) -> Sequence[RowMapping]:
+        """Жильцы дома, которым пора отправлять рассылку, с их ошибками доставки"""
+        try:
+            result = await self.session.execute(
+                queries.select_broadcast_users, {"building_id": self.building_id, "now": now}
+            )
+            return result.mappings().fetchall()
+        except SQLAlchemyError as e:
+            logger.error("Ошибка при получении жильцов для рассылки: %s", e)
+            raise
+
+    async def count_skipped_users(self, now: datetime) -> int:
+        """Сколько жильцов пропускается в рассылке до окончания отсрочки"""
         try:
-            stmt = text(
-                """
-                DELETE FROM users
-                WHERE apartment_number = :apartment_number
-                AND user_id = :user_id
-            """
+            return await self.session.scalar(
+                queries.count_skipped_users, {"building_id": self.building_id, "now": now}
             )
+        except SQLAlchemyError as e:
+            logger.error("Ошибка при подсчёте пропускаемых жильцов: %s", e)
+            raise
+
+    async def record_deliveries(self, outcomes: list[dict]) -> None:
+        """Сохраняет результаты рассылки одним пакетным INSERT ... ON CONFLICT"""
+        if not outcomes:
+            return
+        statement = queries.upsert_user_deliveries[self.session.bind.dialect.name]
+        try:
             await self.session.execute(
-                stmt.bindparams(apartment_number=apartment_number, user_id=user_id)
+                statement, [{**row, "building_id": self.building_id} for row in outcomes]
             )
             await self.session.commit()
         except SQLAlchemyError as e:
             await self.session.rollback()
-            logger.error("Ошибка при удалении пользователя: %s", e)
+            logger.error("Ошибка при сохранении результатов рассылки: %s", e)
+            raise
+
+    async def get_unreachable_users(self, min_failures: int | None = None) -> Sequence[RowMapping]:
+        """Жильцы, которым рассылка не доставлена min_failures раз подряд"""
+        try:
+            result = await self.session.execute(
+                queries.select_unreachable_users,
+                {
+                    "building_id": self.building_id,
+                    "min_failures": min_failures or settings.UNREACHABLE_AFTER,
+                },
+            )
+            return result.mappings().fetchall()
+        except SQLAlchemyError as e:
+            logger.error("Ошибка при получении недоступных жильцов: %s", e)
+            raise
+
+    async def purge_unreachable_users(self, min_failures: int | None = None) -> int:
+        """
+        Удаляет недоступных жильцов дома одной транзакцией, возвращает их число.
+
+        Показания жильцов остаются за квартирами (user_id обнуляется).
+        """
+        params = {
+            "b_building_id": self.building_id,
+            "min_failures": min_failures or settings.UNREACHABLE_AFTER,
+        }
+        try:
+            await self.session.execute(queries.clear_unreachable_readings_user, params)
+            result = await self.session.execute(queries.delete_unreachable_users, params)
+            await self.session.execute(queries.delete_unreachable_deliveries, params)
+            await self.session.commit()
+            user_building_cache.clear()
+            logger.info("Удалено недоступных жильцов дома %s: %s", self.building_id, result.rowcount)
+            return result.rowcount
+        except SQLAlchemyError as e:
+            await self.session.rollback()
+            logger.error("Ошибка при удалении недоступных жильцов: %s", e)
+            raise
+
+    async def get_period_consumption(self, period: date) -> Sequence[RowMapping]:
+        """
+        Расход всех квартир дома за месяц period по типам счетчиков.
+
+        Разницы показаний всех серийных номеров дома считаются одним оконным
+        запросом и суммируются в базе. Расход счетчика без предыдущего
+        показания - None.
+        """
+        period_start, period_end = get_period_bounds(period)
+        try:
+            result = await self.session.execute(
+                queries.select_period_consumption,
+                {
+                    "building_id": self.building_id,
+                    "period_start": period_start,
+                    "period_end": period_end,
+                    "since": period_start - relativedelta(months=settings.BILLING_LOOKBACK_MONTHS),
+                },
+            )
+            return result.mappings().fetchall()
+        except SQLAlchemyError as e:
+            logger.error("Ошибка при получении расхода за период: %s", e)
+            raise
+
+    async def get_tariffs(self, period: date) -> Sequence[RowMapping]:
+        """Тарифы дома, действующие на начало месяца period"""
+        try:
+            result = await self.session.execute(
+                queries.select_tariffs,
+                {"building_id": self.building_id, "period_start": get_period_bounds(period)[0]},
+            )
+            return result.mappings().fetchall()
+        except SQLAlchemyError as e:
+            logger.error("Ошибка при получении тарифов: %s", e)
+            raise
+
+    async def add_tariff(
+        self,
+        meter_type: str,
+        price: float,
+        valid_from: datetime,
+        zone: str = "",
+        zone_share: float = 1.0,
+        tier_from: float = 0.0,
+    ) -> bool:
+        """
+        Добавляет тариф с даты valid_from.
+
+        Действующий тариф той же зоны и ступени закрывается этой датой.
+        Возвращает False, если тип счетчика не найден.
+        """
+        params = {
+            "meter_type": meter_type,
+            "b_building_id": self.building_id,
+            "b_zone": zone,
+            "b_zone_share": zone_share,
+            "b_tier_from": tier_from,
+            "b_price": price,
+            "b_valid_from": valid_from,
+        }
+        try:
+            await self.session.execute(queries.close_tariffs, params)
+            result = await self.session.execute(queries.insert_tariff, params)
+            if not result.rowcount:
+                await self.session.rollback()
+                return False
+            await self.session.commit()
+            return True
+        except SQLAlchemyError as e:
+            await self.session.rollback()
+            logger.error("Ошибка при добавлении тарифа: %s", e)
+            raise
+
+    async def get_report_run(self, period: datetime) -> RowMapping | None:
+        """Отчёт дома за период, если он уже сформирован"""
+        try:
+            result = await self.session.execute(
+                queries.select_report_run,
+                {"building_id": self.building_id, "period": period},
+            )
+            return result.mappings().first()
+        except SQLAlchemyError as e:
+            logger.error("Ошибка при получении отчёта за период: %s", e)
+            raise
+
+    async def get_last_report_period(self) -> datetime | None:
+        """Период последнего сформированного отчёта дома"""
+        try:
+            result = await self.session.execute(
+                queries.select_last_report_period, {"building_id": self.building_id}
+            )
+            return result.scalar()
+        except SQLAlchemyError as e:
+            logger.error("Ошибка при получении последнего отчёта: %s", e)
+            raise
+
+    async def add_report_run(
+        self, period: datetime, file_id: str | None, rows: int, uploaded_to: int | None = None
+    ) -> None:
+        """
+        Сохраняет сформированный отчёт за период. Доставка администратору
+        uploaded_to, которому файл загружен, сохраняется в той же транзакции
+        """
+        try:
+            await self.session.execute(
+                queries.insert_report_run,
+                {
+                    "building_id": self.building_id,
+                    "period": period,
+                    "file_id": file_id,
+                    "rows": rows,
+                    "created_at": datetime.now(),
+                },
+            )
+            if uploaded_to is not None:
+                await self.session.execute(
+                    queries.insert_report_delivery,
+                    {
+                        "building_id": self.building_id,
+                        "period": period,
+                        "chat_id": uploaded_to,
+                        "delivered_at": datetime.now(),
+                    },
+                )
+            await self.session.commit()
+        except SQLAlchemyError as e:
+            await self.session.rollback()
+            logger.error("Ошибка при сохранении отчёта: %s", e)
+            raise
+
+    async def get_report_deliveries(self, period: datetime) -> set[int]:
+        """Администраторы, которым отчёт за период уже отправлен"""
+        try:
+            result = await self.session.execute(
+                queries.select_report_deliveries,
+                {"building_id": self.building_id, "period": period},
+            )
+            return set(result.scalars())
+        except SQLAlchemyError as e:
+            logger.error("Ошибка при получении рассылки отчёта: %s", e)
+            raise
+
+    async def add_report_delivery(self, period: datetime, chat_id: int) -> None:
+        """Отмечает, что отчёт за период отправлен администратору"""
+        try:
+            await self.session.execute(
+                queries.insert_report_delivery,
+                {
+                    "building_id": self.building_id,
+                    "period": period,
+                    "chat_id": chat_id,
+                    "delivered_at": datetime.now(),
+                },
+            )
+            await self.session.commit()
+        except SQLAlchemyError as e:
+            await self.session.rollback()
+            logger.error("Ошибка при сохранении рассылки отчёта: %s", e)
+            raise
@@ -1,28 +1,197 @@
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
-from sqlalchemy import MetaData
+"""
+Engine и сессии баз данных.
+
+Для файла SQLite чтение и запись идут через разные engine:
+    - запись - единственное соединение (pool_size=1) в режиме WAL, поэтому
+      записи выстраиваются в очередь пула, а не ждут блокировку файла;
+    - чтение - соединения mode=ro, которые в режиме WAL читают свой снимок
+      базы и не мешают записи, даже если отчёт читается долго.
+Сессия RoutingSession направляет SELECT в engine чтения, а INSERT/UPDATE/DELETE
+и прочие выражения - в engine записи, поэтому методы Database маршрутизируются
+по назначению сами. После записи SELECT до конца транзакции идут в engine
+записи и видят её незафиксированные изменения. PostgreSQL и SQLite в памяти используют один engine.
+"""
+from pathlib import Path
+from typing import Any
+
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy import MetaData, event, make_url
+from sqlalchemy.orm import Session
 
 from config import settings
-from database.models import metadata
+from database import queries
+from database.migrations import migrate
+from database.models import DEFAULT_METER_TYPES, metadata
+
+# Engine и фабрики сессий по URL базы данных: дома с общим файлом
+# используют один engine, дома с отдельным файлом - свой
+_engines: dict[str, AsyncEngine] = {}
+_read_engines: dict[str, AsyncEngine] = {}
+_session_makers: dict[str, async_sessionmaker[AsyncSession]] = {}
+
+
+def splits_reads(url: str) -> bool:
+    """Разделяются ли чтение и запись: только для файла SQLite"""
+    database_url = make_url(url)
+    return (
+        settings.DB_SPLIT_READS
+        and database_url.get_backend_name() == "sqlite"
+        and database_url.database not in (None, "", ":memory:")
+        and "mode" not in database_url.query
+    )
+
+
+def read_only_url(url: str) -> str:
+    """URL того же файла SQLite, открываемого только для чтения"""
+    database_url = make_url(url)
+    path = Path(database_url.database).resolve()
+    return database_url.set(
+        database=f"file:{path}",
+        query={**database_url.query, "mode": "ro", "uri": "true"},
+    ).render_as_string(hide_password=False)
+
+
+def engine_options(url: str) -> dict[str, Any]:
+    """Параметры create_async_engine в зависимости от диалекта базы данных"""
+    options: dict[str, Any] = {
+        "echo": False,
+        "future": True,
+        "query_cache_size": settings.DB_QUERY_CACHE_SIZE,
+    }
+    backend = make_url(url).get_backend_name()
+    if splits_reads(url):
+        # Единственный писатель: записи ждут соединение в пуле, а не блокировку файла
+        options.update(pool_size=1, max_overflow=0)
+    elif backend == "postgresql":
+        options.update(
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_pre_ping=settings.DB_POOL_PRE_PING,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+            connect_args={
+                "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            },
+        )
+    return options
+
+
+def _enable_wal(dbapi_connection, connection_record) -> None:
+    """В режиме WAL читатели не блокируют запись и наоборот"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
+def get_engine(building_id: int | None = None) -> AsyncEngine:
+    """Возвращает engine базы данных, в которой хранится дом (для записи)"""
+    url = settings.db_url_for(building_id or settings.DEFAULT_BUILDING_ID)
+    if url not in _engines:
+        _engines[url] = create_async_engine(url, **engine_options(url))
+        if splits_reads(url):
+            event.listen(_engines[url].sync_engine, "connect", _enable_wal)
+    return _engines[url]
+
+
+def get_read_engine(building_id: int | None = None) -> AsyncEngine:
+    """Возвращает engine для чтения базы данных дома"""
+    url = settings.db_url_for(building_id or settings.DEFAULT_BUILDING_ID)
+    if not splits_reads(url):
+        return get_engine(building_id)
+    if url not in _read_engines:
+        _read_engines[url] = create_async_engine(
+            read_only_url(url), echo=False, query_cache_size=settings.DB_QUERY_CACHE_SIZE
+        )
+    return _read_engines[url]
+
+
+class RoutingSession(Session):
+    """
+    Сессия, которая выполняет SELECT через engine чтения, остальное - через
+    engine записи.
+
+    После первой записи в транзакции SELECT тоже идут в engine записи:
+    соединение чтения не видит незафиксированных изменений сессии
+    """
+
+    def __init__(self, *args: Any, read_bind=None, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.read_bind = read_bind
+        self._wrote = False
+        event.listen(self, "after_transaction_end", self._transaction_ended)
+
+    def _transaction_ended(self, session: Session, transaction) -> None:
+        if transaction.parent is None:
+            self._wrote = False
+
+    def get_bind(self, mapper=None, clause=None, **kwargs: Any):
+        if self.read_bind is not None and clause is not None:
+            if clause.is_select and not self._flushing and not self._wrote:
+                return self.read_bind
+            if not clause.is_select:
+                self._wrote = True
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
+
+def get_session_maker(
+    building_id: int | None = None,
+) -> async_sessionmaker[AsyncSession]:
+    """Возвращает фабрику сессий для базы данных дома"""
+    url = settings.db_url_for(building_id or settings.DEFAULT_BUILDING_ID)
+    if url not in _session_makers:
+        write_engine = get_engine(building_id)
+        read_engine = get_read_engine(building_id)
+        _session_makers[url] = async_sessionmaker(
+            bind=write_engine,
+            class_=AsyncSession,
+            expire_on_commit=False,
+            sync_session_class=RoutingSession,
+            read_bind=None if read_engine is write_engine else read_engine.sync_engine,
+        )
+    return _session_makers[url]
+
+
+def get_all_engines() -> list[AsyncEngine]:
+    """Возвращает engine всех баз данных (общей и отдельных файлов домов)"""
+    for building_id in settings.BUILDINGS:
+        get_engine(building_id)
+    return list(_engines.values())
+
 
 # Создание engine с настройками подключения
-engine = create_async_engine(settings.DB_LITE, echo=False, future=True)
+engine = get_engine()
 
 # Создание фабрики сессий
-session_maker = async_sessionmaker(
-    bind=engine, class_=AsyncSession, expire_on_commit=False
-)
+session_maker = get_session_maker()
 
 
 async def create_db():
-    """Создает все таблицы в БД"""
-    async with engine.begin() as conn:
-        await conn.run_sync(metadata.create_all)
+    """
+    Создает все таблицы в БД, применяет миграции и заполняет справочник
+    типов счетчиков
+    """
+    for db_engine in get_all_engines():
+        async with db_engine.begin() as conn:
+            await conn.run_sync(metadata.create_all)
+        # create_all не добавляет новые столбцы в существующие таблицы:
+        # справочник заполняется только после миграций
+        await migrate(db_engine)
+        async with db_engine.begin() as conn:
+            # Заполняется при старте, а не при первой регистрации, чтобы
+            # одновременные регистрации не добавили типы несколько раз
+            if not (await conn.execute(queries.count_meter_types)).scalar():
+                await conn.execute(queries.insert_meter_type, DEFAULT_METER_TYPES)
 
 
 async def drop_db():
     """Удаляет все таблицы из БД"""
-    async with engine.begin() as conn:
-        await conn.run_sync(metadata.drop_all)
+    for db_engine in get_all_engines():
+        async with db_engine.begin() as conn:
+            await conn.run_sync(metadata.drop_all)
 
 
 async def get_metadata() -> MetaData:
@@ -0,0 +1,438 @@
+"""
+Версионные миграции схемы базы данных.
+
+metadata.create_all создаёт только отсутствующие таблицы, поэтому новые столбцы,
+индексы и ограничения попадают в существующую базу данных через миграции.
+Каждая миграция идемпотентна: она проверяет текущую схему и пропускает уже
+выполненные изменения, поэтому на новой базе, созданной create_all, миграции
+только отмечаются в таблице schema_migrations.
+
+Долгие операции (заполнение столбцов, перестройка таблиц SQLite) выполняются
+пачками с фиксацией после каждой пачки, чтобы не блокировать запись надолго.
+
+Запуск вручную:
+    python -m database.migrations            # все базы данных из настроек
+    python -m database.migrations --url URL  # одна база данных
+    python -m database.migrations --status   # показать применённые миграции
+"""
+import argparse
+import asyncio
+from datetime import datetime
+from logging import Logger, basicConfig, getLogger, INFO
+from typing import Callable, NamedTuple
+
+from sqlalchemy import (
+    Column,
+    Connection,
+    Index,
+    MetaData,
+    Table,
+    func,
+    inspect,
+    select,
+    text,
+)
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.schema import CreateColumn, CreateTable
+
+from database.models import (
+    DEFAULT_METER_TYPES,
+    meter_descriptions,
+    meter_types,
+    meters,
+    metadata,
+    readings,
+    schema_migrations,
+    serial_history,
+    serials,
+    user_deliveries,
+    users,
+)
+
+logger: Logger = getLogger(__name__)
+
+BATCH_SIZE = 5000
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+
+
+MIGRATIONS: list[Migration] = []
+
+
+def migration(version: int, name: str):
+    """Регистрирует функцию как миграцию с указанной версией"""
+
+    def decorator(upgrade: Callable[[Connection], None]):
+        MIGRATIONS.append(Migration(version, name, upgrade))
+        return upgrade
+
+    return decorator
+
+
+############################### Помощники ###############################
+
+
+def column_names(conn: Connection, table_name: str) -> set[str]:
+    return {column["name"] for column in inspect(conn).get_columns(table_name)}
+
+
+def index_names(conn: Connection, table_name: str) -> set[str]:
+    return {index["name"] for index in inspect(conn).get_indexes(table_name)}
+
+
+def add_column(conn: Connection, column: Column) -> None:
+    """Добавляет столбец из модели, если его ещё нет"""
+    table_name = column.table.name
+    if column.name in column_names(conn, table_name):
+        return
+    ddl = CreateColumn(column).compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {ddl}"))
+    logger.info("Добавлен столбец %s.%s", table_name, column.name)
+
+
+def create_index(conn: Connection, index: Index) -> None:
+    """
+    Создаёт индекс из модели, если его ещё нет.
+
+    В PostgreSQL индекс строится CONCURRENTLY (вне транзакции), чтобы не
+    блокировать запись в таблицу на время построения.
+    """
+    if index.name in index_names(conn, index.table.name):
+        return
+    if conn.dialect.name == "postgresql":
+        conn.commit()
+        columns = ", ".join(column.name for column in index.columns)
+        unique = "UNIQUE " if index.unique else ""
+        autocommit = conn.execution_options(isolation_level="AUTOCOMMIT")
+        autocommit.execute(
+            text(
+                f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {index.name} "
+                f"ON {index.table.name} ({columns})"
+            )
+        )
+        conn.commit()
+        conn.execution_options(isolation_level=conn.default_isolation_level)
+    else:
+        index.create(conn)
+    logger.info("Создан индекс %s", index.name)
+
+
+def batched(conn: Connection, table: Table, statement, batch_size: int = BATCH_SIZE) -> None:
+    """
+    Выполняет statement пачками по диапазонам первичного ключа table.
+
+    statement должен ограничивать строки параметрами :lo < ключ <= :hi.
+    После каждой пачки транзакция фиксируется, чтобы освободить блокировку.
+    """
+    key = table.primary_key.columns.values()[0]
+    max_key = conn.execute(select(func.max(key))).scalar() or 0
+    for lo in range(0, max_key, batch_size):
+        conn.execute(statement, {"lo": lo, "hi": lo + batch_size})
+        conn.commit()
+
+
+def rebuild_table(conn: Connection, table: Table, batch_size: int = BATCH_SIZE) -> None:
+    """
+    Перестраивает таблицу SQLite по описанию из модели.
+
+    SQLite не умеет изменять ограничения существующей таблицы, поэтому создаётся
+    новая таблица, данные копируются в неё пачками (между пачками бот может
+    писать в старую таблицу), а затем в одной короткой транзакции копируется
+    остаток, старая таблица удаляется и новая переименовывается.
+    """
+    new_name = f"{table.name}_new"
+    key = table.primary_key.columns.values()[0].name
+    # Столбцы, добавленные более поздними миграциями, получают значения по умолчанию
+    existing = column_names(conn, table.name)
+    columns = ", ".join(column.name for column in table.columns if column.name in existing)
+    # Остальные таблицы копируются, чтобы внешние ключи новой таблицы разрешались
+    rebuild_metadata = MetaData()
+    for other in metadata.sorted_tables:
+        if other is not table:
+            other.to_metadata(rebuild_metadata)
+    new_table = table.to_metadata(rebuild_metadata, name=new_name)
+
+    conn.execute(text(f"DROP TABLE IF EXISTS {new_name}"))
+    conn.execute(CreateTable(new_table))
+    conn.commit()
+
+    copy = text(
+        f"INSERT INTO {new_name} ({columns}) "
+        f"SELECT {columns} FROM {table.name} WHERE {key} > :lo AND {key} <= :hi"
+    )
+    batched(conn, table, copy, batch_size)
+
+    copied = conn.execute(text(f"SELECT COALESCE(MAX({key}), 0) FROM {new_name}")).scalar()
+    conn.execute(
+        text(f"INSERT INTO {new_name} ({columns}) SELECT {columns} FROM {table.name} WHERE {key} > :copied"),
+        {"copied": copied},
+    )
+    conn.execute(text(f"DROP TABLE {table.name}"))
+    conn.execute(text(f"ALTER TABLE {new_name} RENAME TO {table.name}"))
+    for index in table.indexes:
+        index.create(conn)
+    conn.commit()
+    logger.info("Таблица %s перестроена", table.name)
+
+
+def foreign_keys(conn: Connection, table_name: str) -> dict[str, dict]:
+    """Внешние ключи таблицы: столбец -> описание"""
+    return {
+        fk["constrained_columns"][0]: fk
+        for fk in inspect(conn).get_foreign_keys(table_name)
+    }
+
+
+############################### Миграции ###############################
+
+
+@migration(1, "building_id в users, meters и readings")
+def add_building_columns(conn: Connection) -> None:
+    for table in (users, meters, readings):
+        add_column(conn, table.c.building_id)
+    conn.commit()
+    # Показания наследуют дом счётчика
+    batched(
+        conn,
+        readings,
+        text(
+            """
+            UPDATE readings
+            SET building_id = (
+                SELECT meters.building_id FROM meters
+                WHERE meters.meter_id = readings.meter_id
+            )
+            WHERE reading_id > :lo AND reading_id <= :hi
+            AND building_id <> (
+                SELECT meters.building_id FROM meters
+                WHERE meters.meter_id = readings.meter_id
+            )
+            """
+        ),
+    )
+
+
+@migration(2, "индексы по дому и периоду")
+def add_building_indexes(conn: Connection) -> None:
+    for table in (users, meters, readings):
+        for index in table.indexes:
+            create_index(conn, index)
+
+
+@migration(3, "уникальные серийные номера счётчика")
+def unique_serials(conn: Connection) -> None:
+    if "ux_serials_meter_serial" in index_names(conn, "serials"):
+        return
+    # Дубликаты сводятся к серийному номеру с наименьшим serial_id
+    conn.execute(
+        text(
+            """
+            CREATE TEMPORARY TABLE serial_duplicates AS
+            SELECT s.serial_id AS duplicate_id, keep.serial_id AS keep_id
+            FROM serials s
+                JOIN (
+                    SELECT meter_id, serial_number, MIN(serial_id) AS serial_id
+                    FROM serials
+                    GROUP BY meter_id, serial_number
+                ) keep ON keep.meter_id = s.meter_id
+                    AND keep.serial_number = s.serial_number
+            WHERE s.serial_id <> keep.serial_id
+            """
+        )
+    )
+    # На оставляемый номер переносится одно показание на дату: при трёх и
+    # более дубликатах показания за одну дату могут быть у нескольких из них
+    conn.execute(
+        text(
+            """
+            UPDATE readings
+            SET serial_id = (
+                SELECT keep_id FROM serial_duplicates WHERE duplicate_id = readings.serial_id
+            )
+            WHERE serial_id IN (SELECT duplicate_id FROM serial_duplicates)
+            AND NOT EXISTS (
+                SELECT 1 FROM readings kept
+                    JOIN serial_duplicates d ON d.keep_id = kept.serial_id
+                WHERE d.duplicate_id = readings.serial_id
+                AND kept.meter_id = readings.meter_id
+                AND kept.reading_date = readings.reading_date
+            )
+            AND reading_id = (
+                SELECT MIN(other.reading_id) FROM readings other
+                    JOIN serial_duplicates od ON od.duplicate_id = other.serial_id
+                    JOIN serial_duplicates d ON d.keep_id = od.keep_id
+                WHERE d.duplicate_id = readings.serial_id
+                AND other.meter_id = readings.meter_id
+                AND other.reading_date = readings.reading_date
+            )
+            """
+        )
+    )
+    # Оставшиеся показания дубликатов совпадают с уже имеющимися
+    conn.execute(
+        text("DELETE FROM readings WHERE serial_id IN (SELECT duplicate_id FROM serial_duplicates)")
+    )
+    # Описание дубликата переносится, если у оставляемого номера его нет
+    conn.execute(
+        text(
+            """
+            UPDATE meter_descriptions
+            SET serial_id = (
+                SELECT keep_id FROM serial_duplicates WHERE duplicate_id = meter_descriptions.serial_id
+            )
+            WHERE desc_id IN (
+                SELECT MIN(md.desc_id) FROM meter_descriptions md
+                    JOIN serial_duplicates d ON d.duplicate_id = md.serial_id
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM meter_descriptions kept WHERE kept.serial_id = d.keep_id
+                )
+                GROUP BY d.keep_id
+            )
+            """
+        )
+    )
+    conn.execute(
+        text(
+            """
+            DELETE FROM meter_descriptions
+            WHERE serial_id IN (SELECT duplicate_id FROM serial_duplicates)
+            """
+        )
+    )
+    conn.execute(text("DELETE FROM serials WHERE serial_id IN (SELECT duplicate_id FROM serial_duplicates)"))
+    conn.execute(text("DROP TABLE serial_duplicates"))
+    conn.commit()
+    for index in serials.indexes:
+        create_index(conn, index)
+
+
+@migration(4, "внешние ключи meters и readings (перестройка таблиц SQLite)")
+def rebuild_foreign_keys(conn: Connection) -> None:
+    # В PostgreSQL схема создаётся create_all сразу в актуальном виде
+    if conn.dialect.name != "sqlite":
+        return
+    if "apartment_number" in foreign_keys(conn, "meters"):
+        rebuild_table(conn, meters)
+    user_fk = foreign_keys(conn, "readings").get("user_id", {})
+    if user_fk.get("options", {}).get("ondelete") != "SET NULL":
+        rebuild_table(conn, readings)
+
+
+@migration(5, "индекс показаний по серийному номеру и дате")
+def add_serial_date_index(conn: Connection) -> None:
+    for index in readings.indexes:
+        create_index(conn, index)
+
+
+@migration(6, "признак расчётных показаний")
+def add_estimated_column(conn: Connection) -> None:
+    add_column(conn, readings.c.estimated)
+    conn.commit()
+
+
+@migration(7, "история замен счётчиков и индекс описаний")
+def add_serial_history(conn: Connection) -> None:
+    serial_history.create(conn, checkfirst=True)
+    conn.commit()
+    for index in meter_descriptions.indexes:
+        create_index(conn, index)
+
+
+@migration(8, "результаты доставки рассылок жильцам")
+def add_user_deliveries(conn: Connection) -> None:
+    user_deliveries.create(conn, checkfirst=True)
+    conn.commit()
+
+
+@migration(9, "порядок и названия типов счётчиков для регистрации")
+def add_meter_type_steps(conn: Connection) -> None:
+    for column in ("label", "title", "min_count", "max_count", "position"):
+        add_column(conn, meter_types.c[column])
+    # Стандартные типы получают прежние вопросы и ограничения, остальные -
+    # значения по умолчанию (название типа, 0-3 счётчика)
+    for meter_type in DEFAULT_METER_TYPES:
+        conn.execute(
+            meter_types.update()
+            .where(meter_types.c.name == meter_type["name"], meter_types.c.title.is_(None))
+            .values({key: value for key, value in meter_type.items() if key not in ("name", "unit")})
+        )
+    conn.commit()
+
+
+############################### Запуск ###############################
+
+
+def applied_versions(conn: Connection) -> set[int]:
+    return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def upgrade(conn: Connection) -> list[int]:
+    """Применяет недостающие миграции, возвращает их версии"""
+    schema_migrations.create(conn, checkfirst=True)
+    conn.commit()
+    done = applied_versions(conn)
+    applied = []
+    for step in sorted(MIGRATIONS):
+        if step.version in done:
+            continue
+        logger.info("Миграция %s: %s", step.version, step.name)
+        step.upgrade(conn)
+        conn.execute(
+            schema_migrations.insert().values(
+                version=step.version, name=step.name, applied_at=datetime.now()
+            )
+        )
+        conn.commit()
+        applied.append(step.version)
+    return applied
+
+
+async def migrate(engine: AsyncEngine) -> list[int]:
+    """Применяет миграции к базе данных engine"""
+    async with engine.connect() as conn:
+        return await conn.run_sync(upgrade)
+
+
+async def migrate_all() -> None:
+    """Применяет миграции ко всем базам данных из настроек"""
+    from database.engine import get_all_engines
+
+    for engine in get_all_engines():
+        applied = await migrate(engine)
+        if applied:
+            logger.info("%s: применены миграции %s", engine.url, applied)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Миграции схемы базы данных")
+    parser.add_argument("--url", help="URL базы данных (по умолчанию все из настроек)")
+    parser.add_argument("--status", action="store_true", help="показать применённые миграции")
+    args = parser.parse_args()
+    basicConfig(level=INFO, format="%(asctime)s:%(levelname)s:%(name)s:%(message)s")
+
+    if args.url:
+        engines = [create_async_engine(args.url)]
+    else:
+        from database.engine import get_all_engines
+
+        engines = get_all_engines()
+
+    for engine in engines:
+        if args.status:
+            async with engine.connect() as conn:
+                await conn.run_sync(schema_migrations.create, checkfirst=True)
+                done = await conn.run_sync(applied_versions)
+            for step in sorted(MIGRATIONS):
+                mark = "x" if step.version in done else " "
+                print(f"{engine.url} [{mark}] {step.version}: {step.name}")
+        else:
+            await migrate(engine)
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,15 +1,32 @@
 from datetime import datetime
 
-from sqlalchemy import Table, MetaData, Column, Integer, String, DateTime, ForeignKey, UniqueConstraint
+from sqlalchemy import (
+    Table,
+    MetaData,
+    Column,
+    Integer,
+    BigInteger,
+    Boolean,
+    String,
+    DateTime,
+    Float,
+    ForeignKey,
+    UniqueConstraint,
+    Index,
+    false,
+)
 
 metadata = MetaData()
 
 users = Table(
     "users", metadata,
-    Column("user_id", Integer, primary_key=True),
+    Column("user_id", BigInteger, primary_key=True),  # Telegram ID не помещается в int4
+    Column("building_id", Integer, nullable=False, server_default="1"),
     Column("apartment_number", Integer, nullable=False),
     Column("first_name", String, nullable=True),
     Column("last_name", String, nullable=True),
+    # Запросы всегда начинаются с дома, поэтому building_id первым в индексе
+    Index("ix_users_building_apartment", "building_id", "apartment_number"),
 )
 
 meter_types = Table(
@@ -17,14 +34,46 @@ meter_types = Table(
     Column("type_id", Integer, primary_key=True),
     Column("name", String, nullable=False),  # "electric", "heat", "hot_water", "cold_water"
     Column("unit", String, nullable=False),  # "kWh", "Gcal", "m3"
+    # Регистрация и подача показаний опрашивают типы в порядке position:
+    # label - название на кнопке, title - в родительном падеже для вопросов,
+    # min_count-max_count - сколько счетчиков типа может быть в квартире
+    Column("label", String(50), nullable=True),  # "Горячая вода"
+    Column("title", String(50), nullable=True),  # "горячей воды"
+    Column("min_count", Integer, nullable=False, server_default="0"),
+    Column("max_count", Integer, nullable=False, server_default="3"),
+    Column("position", Integer, nullable=False, server_default="0"),
 )
 
+# Типы счётчиков, которыми заполняется пустая таблица meter_types.
+# Новый тип счётчика - новая строка meter_types, обработчики не меняются
+DEFAULT_METER_TYPES = [
+    {
+        "name": "electricity", "unit": "kWh", "label": "Электричество", "title": "электричества",
+        "min_count": 1, "max_count": 3, "position": 3,
+    },
+    {
+        "name": "heat", "unit": "Gcal", "label": "Тепло", "title": "тепла",
+        "min_count": 0, "max_count": 1, "position": 4,
+    },
+    {
+        "name": "hot_water", "unit": "m3", "label": "Горячая вода", "title": "горячей воды",
+        "min_count": 1, "max_count": 3, "position": 1,
+    },
+    {
+        "name": "cold_water", "unit": "m3", "label": "Холодная вода", "title": "холодной воды",
+        "min_count": 1, "max_count": 3, "position": 2,
+    },
+]
+
 meters = Table(
     "meters", metadata,
     Column("meter_id", Integer, primary_key=True),
-    Column("apartment_number", Integer, ForeignKey("users.apartment_number")),
+    Column("building_id", Integer, nullable=False, server_default="1"),
+    # Не внешний ключ: в квартире может быть несколько пользователей (или ни одного)
+    Column("apartment_number", Integer),
     Column("type_id", Integer, ForeignKey("meter_types.type_id"), nullable=False),
     Column("count_meter", Integer, nullable=False),
+    Index("ix_meters_building_apartment_type", "building_id", "apartment_number", "type_id"),
 )
 
 serials = Table(
@@ -32,17 +81,40 @@ serials = Table(
     Column("serial_id", Integer, primary_key=True),
     Column("meter_id", Integer, ForeignKey("meters.meter_id")),
     Column("serial_number", String(20), nullable=False), 
+    # Серийный номер не повторяется у одного счётчика
+    Index("ux_serials_meter_serial", "meter_id", "serial_number", unique=True),
+)
+
+# Замены счётчиков: интервал, в котором серийный номер был установлен.
+# Строка появляется при замене, серийный номер без строки установлен
+# с регистрации и не снят. Показания при установке и снятии делят расход
+# месяца замены между старым и новым счётчиком
+serial_history = Table(
+    "serial_history", metadata,
+    Column("serial_id", Integer, ForeignKey("serials.serial_id"), primary_key=True),
+    Column("meter_id", Integer, ForeignKey("meters.meter_id"), nullable=False),
+    Column("valid_from", DateTime, nullable=True),  # None - с регистрации
+    Column("valid_to", DateTime, nullable=True),  # None - установлен сейчас
+    Column("start_value", Integer, nullable=True),  # Показание при установке
+    Column("end_value", Integer, nullable=True),  # Показание при снятии
 )
 
 readings = Table(
     "readings", metadata,
     Column("reading_id", Integer, primary_key=True),
+    Column("building_id", Integer, nullable=False, server_default="1"),  # Денормализовано для отчётов по дому
     Column("meter_id", Integer, ForeignKey("meters.meter_id")),
-    Column("user_id", Integer, ForeignKey("users.user_id")),  # Кто подал показания
+    Column("user_id", BigInteger, ForeignKey("users.user_id", ondelete="SET NULL")),  # Кто подал показания
     Column("serial_id", Integer, default=None),
     Column("value", Integer, nullable=False),
     Column("reading_date", DateTime, nullable=False),  # Дата снятия показаний
+    # Расчётное показание вместо неподанного (см. utils/estimate_utils.py),
+    # удаляется, когда за этот месяц приходит настоящее
+    Column("estimated", Boolean, nullable=False, server_default=false()),
     UniqueConstraint('meter_id', 'reading_date', "serial_id", name='uix_meter_reading_date'),  # Проверка дублирования
+    Index("ix_readings_building_date", "building_id", "reading_date"),
+    # Поиск последних показаний счётчика (предыдущие показания, архивация)
+    Index("ix_readings_serial_date", "serial_id", "reading_date"),
 )
 
 meter_descriptions = Table(
@@ -50,4 +122,76 @@ meter_descriptions = Table(
     Column("desc_id", Integer, primary_key=True),
     Column("serial_id", Integer, ForeignKey("serials.serial_id")),
     Column("description", String(50), nullable=False),
+    Index("ix_meter_descriptions_serial", "serial_id"),
+)
+
+# Ход импорта файлов показаний: до какой строки файл загружен (см. utils/import_utils.py)
+import_checkpoints = Table(
+    "import_checkpoints", metadata,
+    Column("file_hash", String(64), primary_key=True),  # sha256 содержимого файла
+    Column("building_id", Integer, primary_key=True),
+    Column("row_number", Integer, nullable=False),  # Последняя загруженная строка файла
+    Column("imported", Integer, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+)
+
+# Автоматические ежемесячные отчёты (см. utils/report_utils.py): отчёт
+# загружается в Telegram один раз, администраторам рассылается его file_id
+report_runs = Table(
+    "report_runs", metadata,
+    Column("building_id", Integer, primary_key=True),
+    Column("period", DateTime, primary_key=True),  # Начало месяца отчётного периода
+    Column("file_id", String, nullable=True),  # None - за период нет показаний
+    Column("rows", Integer, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+)
+
+# Кому из администраторов отчёт уже отправлен: после перезапуска бота
+# рассылка продолжается без повторов
+report_deliveries = Table(
+    "report_deliveries", metadata,
+    Column("building_id", Integer, primary_key=True),
+    Column("period", DateTime, primary_key=True),
+    Column("chat_id", BigInteger, primary_key=True),
+    Column("delivered_at", DateTime, nullable=False),
+)
+
+# Доставка рассылок жильцам (см. utils/broadcast_utils.py): жилец, заблокировавший
+# бота или удаливший аккаунт, пропускается в рассылках до retry_after, после
+# UNREACHABLE_AFTER ошибок подряд он попадает в отчёт /unreachable
+user_deliveries = Table(
+    "user_deliveries", metadata,
+    Column("user_id", BigInteger, ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True),
+    Column("building_id", Integer, nullable=False, server_default="1"),
+    Column("failures", Integer, nullable=False, server_default="0"),  # Ошибок доставки подряд
+    Column("last_error", String, nullable=True),
+    Column("last_attempt_at", DateTime, nullable=False),
+    Column("delivered_at", DateTime, nullable=True),  # Последняя успешная доставка
+    Column("retry_after", DateTime, nullable=True),  # None - доставлять в каждой рассылке
+    Index("ix_user_deliveries_building_failures", "building_id", "failures"),
+)
+
+# Тарифы домов по типам счетчиков (см. utils/billing_utils.py). Ступенчатый
+# тариф - несколько строк одной зоны с разными tier_from. Показания
+# однотарифные, поэтому для зон "day"/"night" задаётся доля расхода zone_share
+tariffs = Table(
+    "tariffs", metadata,
+    Column("tariff_id", Integer, primary_key=True),
+    Column("building_id", Integer, nullable=False, server_default="1"),
+    Column("type_id", Integer, ForeignKey("meter_types.type_id"), nullable=False),
+    Column("zone", String(10), nullable=False, server_default=""),  # "", "day", "night"
+    Column("zone_share", Float, nullable=False, server_default="1"),
+    Column("tier_from", Float, nullable=False, server_default="0"),  # Цена действует для расхода свыше
+    Column("price", Float, nullable=False),  # Цена за единицу расхода, руб.
+    Column("valid_from", DateTime, nullable=False),
+    Column("valid_to", DateTime, nullable=True),  # None - действует сейчас
+    Index("ix_tariffs_building_type", "building_id", "type_id", "valid_from"),
+)
+
+# Применённые миграции схемы (см. database/migrations.py)
+schema_migrations = Table(
+    "schema_migrations", metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
 )
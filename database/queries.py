@@ -0,0 +1,796 @@
+"""
+Запросы к базе данных на выражениях SQLAlchemy Core.
+
+Выражения строятся один раз при импорте модуля, а значения передаются
+параметрами при выполнении. Благодаря этому SQLAlchemy компилирует каждое
+выражение один раз и берёт его из кэша скомпилированных выражений
+(см. DB_QUERY_CACHE_SIZE), а параметры получают типы столбцов.
+"""
+from importlib import import_module
+from typing import Any, Callable
+
+from sqlalchemy import (
+    BigInteger,
+    DateTime,
+    Float,
+    Integer,
+    String,
+    and_,
+    bindparam,
+    delete,
+    func,
+    insert,
+    literal_column,
+    or_,
+    select,
+    union_all,
+    update,
+)
+
+from database.models import (
+    import_checkpoints,
+    meter_descriptions,
+    meter_types,
+    meters,
+    readings,
+    report_deliveries,
+    report_runs,
+    serial_history,
+    serials,
+    tariffs,
+    user_deliveries,
+    users,
+)
+
+
+class ByDialect(dict):
+    """
+    Выражения, зависящие от диалекта (INSERT ... ON CONFLICT), по имени
+    диалекта. Выражение строится при первом обращении: модуль диалекта
+    postgresql не загружается, пока бот работает на SQLite.
+    """
+
+    def __init__(self, build: Callable[[Any], Any]):
+        super().__init__()
+        self.build = build
+
+    def __missing__(self, name: str) -> Any:
+        statement = self[name] = self.build(import_module(f"sqlalchemy.dialects.{name}"))
+        return statement
+
+
+# Общие параметры запросов
+building_id = bindparam("building_id", type_=Integer)
+apartment_number = bindparam("apartment_number", type_=Integer)
+meter_type = bindparam("meter_type", type_=String)
+user_id = bindparam("user_id", type_=BigInteger)
+period_start = bindparam("period_start", type_=DateTime)
+period_end = bindparam("period_end", type_=DateTime)
+
+# Счётчики квартиры дома с их типами
+apartment_meters = meters.join(meter_types, meters.c.type_id == meter_types.c.type_id)
+apartment_meters_filter = and_(
+    meters.c.building_id == building_id,
+    meters.c.apartment_number == apartment_number,
+)
+
+# Серийный номер установлен сейчас: снятые при замене счётчики не показываются
+# жильцу и не получают новых показаний
+def serial_retired(serial_id):
+    """Счётчик снят при замене: в serial_history есть дата снятия (поиск по первичному ключу)"""
+    return (
+        select(serial_history.c.serial_id)
+        .where(serial_history.c.serial_id == serial_id, serial_history.c.valid_to.is_not(None))
+        .exists()
+    )
+
+
+serial_installed = ~serial_retired(serials.c.serial_id)
+
+############################### meter_types ###############################
+
+count_meter_types = select(func.count()).select_from(meter_types)
+
+insert_meter_type = insert(meter_types)
+
+# Типы счетчиков в порядке опроса; без названий - имя типа
+select_meter_types = select(
+    meter_types.c.name,
+    func.coalesce(meter_types.c.label, meter_types.c.name).label("label"),
+    func.coalesce(meter_types.c.title, meter_types.c.name).label("title"),
+    meter_types.c.min_count,
+    meter_types.c.max_count,
+).order_by(meter_types.c.position, meter_types.c.type_id)
+
+################################# users ###################################
+
+insert_user = insert(users)
+
+select_user = select(
+    users.c.first_name, users.c.apartment_number, users.c.building_id
+).where(users.c.user_id == user_id)
+
+select_user_building = select(users.c.building_id).where(users.c.user_id == user_id)
+
+select_users = select(users.c.user_id).where(users.c.building_id == building_id)
+
+select_users_by_apartment = select(users.c.first_name, users.c.user_id).where(
+    users.c.building_id == building_id,
+    users.c.apartment_number == apartment_number,
+)
+
+delete_user = delete(users).where(
+    users.c.building_id == building_id,
+    users.c.apartment_number == apartment_number,
+    users.c.user_id == user_id,
+)
+
+# Вместе с жильцом удаляется его состояние доставки, а поданные им показания
+# остаются за квартирой (SQLite не проверяет внешние ключи, поэтому явно)
+clear_readings_user = (
+    update(readings)
+    .where(readings.c.user_id == bindparam("b_user_id", type_=BigInteger))
+    .values(user_id=None)
+)
+
+delete_user_delivery = delete(user_deliveries).where(user_deliveries.c.user_id == user_id)
+
+################################# meters ##################################
+
+insert_meters = insert(meters).from_select(
+    ["building_id", "apartment_number", "type_id", "count_meter"],
+    select(
+        users.c.building_id,
+        users.c.apartment_number,
+        meter_types.c.type_id,
+        bindparam("count_meter", type_=Integer),
+    )
+    .join_from(users, meter_types, meter_types.c.name == meter_type)
+    .where(users.c.user_id == user_id),
+)
+
+insert_serial = insert(serials).from_select(
+    ["meter_id", "serial_number"],
+    select(meters.c.meter_id, bindparam("serial", type_=String))
+    .select_from(apartment_meters)
+    .where(apartment_meters_filter, meter_types.c.name == meter_type),
+)
+
+insert_description = insert(meter_descriptions).from_select(
+    ["serial_id", "description"],
+    select(serials.c.serial_id, bindparam("description", type_=String))
+    .select_from(
+        serials.join(apartment_meters, serials.c.meter_id == meters.c.meter_id)
+    )
+    .where(
+        apartment_meters_filter,
+        meter_types.c.name == meter_type,
+        serials.c.serial_number == bindparam("serial", type_=String),
+    ),
+)
+
+select_serials_and_descriptions = (
+    select(
+        serials.c.serial_id,
+        serials.c.serial_number,
+        meter_descriptions.c.description,
+    )
+    .select_from(
+        serials.join(apartment_meters, serials.c.meter_id == meters.c.meter_id).join(
+            meter_descriptions, meter_descriptions.c.serial_id == serials.c.serial_id
+        )
+    )
+    .where(apartment_meters_filter, serial_installed)
+)
+
+select_serials_and_descriptions_by_type = select_serials_and_descriptions.where(
+    meter_types.c.name == meter_type
+)
+
+# Исправление опечатки в номере установленного счетчика пользователя
+_old_serials = serials.alias("s")
+update_serial_number = (
+    update(serials)
+    .where(
+        serials.c.serial_id.in_(
+            select(_old_serials.c.serial_id)
+            .join(meters, _old_serials.c.meter_id == meters.c.meter_id)
+            .join(
+                users,
+                and_(
+                    users.c.building_id == meters.c.building_id,
+                    users.c.apartment_number == meters.c.apartment_number,
+                ),
+            )
+            .where(
+                _old_serials.c.serial_number == bindparam("old_serial", type_=String),
+                users.c.user_id == user_id,
+                # Снятый счетчик не исправляется: его номер связан с историей замен
+                ~serial_retired(_old_serials.c.serial_id),
+            )
+        )
+    )
+    .values(serial_number=bindparam("new_serial", type_=String))
+)
+
+# Установленный счётчик пользователя по серийному номеру: при замене по нему
+# заводится новый серийный номер, has_readings отличает замену от опечатки
+select_user_serial = (
+    select(
+        serials.c.serial_id,
+        serials.c.meter_id,
+        select(readings.c.reading_id)
+        .where(readings.c.serial_id == serials.c.serial_id)
+        .exists()
+        .label("has_readings"),
+    )
+    .join(meters, serials.c.meter_id == meters.c.meter_id)
+    .join(
+        users,
+        and_(
+            users.c.building_id == meters.c.building_id,
+            users.c.apartment_number == meters.c.apartment_number,
+        ),
+    )
+    .where(
+        serials.c.serial_number == bindparam("serial_number", type_=String),
+        users.c.user_id == user_id,
+        serial_installed,
+    )
+)
+
+copy_description = insert(meter_descriptions).from_select(
+    ["serial_id", "description"],
+    select(bindparam("new_serial_id", type_=Integer), meter_descriptions.c.description).where(
+        meter_descriptions.c.serial_id == bindparam("old_serial_id", type_=Integer)
+    ),
+)
+
+# Снятие счётчика: у ранее заменённого строка истории уже есть (valid_from),
+# иначе она добавляется insert_serial_history
+close_serial_history = (
+    update(serial_history)
+    .where(serial_history.c.serial_id == bindparam("b_serial_id", type_=Integer))
+    .values(
+        valid_to=bindparam("b_valid_to", type_=DateTime),
+        end_value=bindparam("b_end_value", type_=Integer),
+    )
+)
+
+insert_serial_history = insert(serial_history)
+
+select_meter_type_ids = select(meter_types.c.name, meter_types.c.type_id)
+
+# Массовая загрузка счётчиков дома (импорт из файла)
+select_building_meters = select(
+    meters.c.meter_id, meters.c.apartment_number, meters.c.type_id, meters.c.count_meter
+).where(meters.c.building_id == building_id)
+
+select_building_serials = (
+    select(
+        serials.c.serial_id,
+        serials.c.meter_id,
+        serials.c.serial_number,
+        meters.c.apartment_number,
+        meter_types.c.name.label("meter_type"),
+    )
+    .select_from(serials.join(apartment_meters, serials.c.meter_id == meters.c.meter_id))
+    .where(meters.c.building_id == building_id)
+)
+
+# RETURNING при executemany отдаёт id новых строк без повторного SELECT
+insert_meter_rows = insert(meters).returning(
+    meters.c.meter_id, meters.c.apartment_number, meters.c.type_id
+)
+
+update_meter_count = (
+    update(meters)
+    .where(meters.c.meter_id == bindparam("b_meter_id", type_=Integer))
+    .values(count_meter=bindparam("count_meter", type_=Integer))
+)
+
+insert_serial_rows = insert(serials).returning(
+    serials.c.serial_id, serials.c.meter_id, serials.c.serial_number
+)
+
+insert_description_rows = insert(meter_descriptions)
+
+################################ readings #################################
+
+insert_reading = insert(readings).from_select(
+    ["building_id", "meter_id", "user_id", "serial_id", "value", "reading_date"],
+    select(
+        meters.c.building_id,
+        meters.c.meter_id,
+        user_id,
+        serials.c.serial_id,
+        bindparam("value", type_=Float),
+        bindparam("reading_date", type_=DateTime),
+    )
+    .select_from(
+        apartment_meters.join(serials, serials.c.meter_id == meters.c.meter_id)
+    )
+    .where(
+        apartment_meters_filter,
+        meter_types.c.name == meter_type,
+        serials.c.serial_number == bindparam("serial_number", type_=String),
+        serial_installed,
+    ),
+)
+
+select_meter_types_for_period = (
+    select(meter_types.c.name)
+    .select_from(
+        readings.join(apartment_meters, readings.c.meter_id == meters.c.meter_id)
+    )
+    .where(
+        readings.c.reading_date >= period_start,
+        readings.c.reading_date < period_end,
+        readings.c.estimated.is_(False),
+        apartment_meters_filter,
+    )
+)
+
+select_previous_reading = (
+    select(readings.c.value, readings.c.reading_date)
+    .select_from(
+        readings.join(serials, readings.c.serial_id == serials.c.serial_id)
+        .join(meters, serials.c.meter_id == meters.c.meter_id)
+        .join(meter_types, meters.c.type_id == meter_types.c.type_id)
+    )
+    .where(
+        serials.c.serial_number == bindparam("serial_number", type_=String),
+        meter_types.c.name == meter_type,
+        meters.c.building_id == building_id,
+        readings.c.reading_date < bindparam("current_period", type_=DateTime),
+        readings.c.estimated.is_(False),
+    )
+    .order_by(readings.c.reading_date.desc())
+    .limit(1)
+)
+
+since = bindparam("since", type_=DateTime)
+
+
+# Показания счетчиков и показания при установке и снятии из serial_history:
+# по ним расход месяца замены делится между старым и новым счетчиком.
+# Замена датируется датой показаний периода, поэтому при равной дате
+# установка идёт раньше показаний, а снятие - позже (point_order)
+_meter_points = union_all(
+    select(
+        readings.c.serial_id,
+        readings.c.value,
+        readings.c.reading_date,
+        literal_column("1").label("point_order"),
+    ),
+    select(
+        serial_history.c.serial_id,
+        serial_history.c.start_value,
+        serial_history.c.valid_from,
+        literal_column("0"),
+    ).where(serial_history.c.start_value.is_not(None), serial_history.c.valid_from.is_not(None)),
+    select(
+        serial_history.c.serial_id,
+        serial_history.c.end_value,
+        serial_history.c.valid_to,
+        literal_column("2"),
+    ).where(serial_history.c.end_value.is_not(None), serial_history.c.valid_to.is_not(None)),
+).subquery("meter_points")
+
+
+def _consumption_deltas(*filters):
+    """
+    Показания с расходом - разницей с предыдущим показанием серийного номера.
+
+    Предыдущее показание ищется не раньше since (начало окна минус запас),
+    поэтому запрос читает по индексам по дате только последние показания,
+    сколько бы лет истории ни было
+    """
+    return (
+        select(
+            meters.c.apartment_number,
+            meters.c.type_id,
+            meter_types.c.name.label("meter_type"),
+            func.coalesce(meter_types.c.label, meter_types.c.name).label("label"),
+            meter_types.c.unit,
+            serials.c.serial_number,
+            _meter_points.c.value,
+            _meter_points.c.reading_date,
+            _meter_points.c.point_order,
+            (
+                _meter_points.c.value
+                - func.lag(_meter_points.c.value).over(
+                    partition_by=_meter_points.c.serial_id,
+                    order_by=(_meter_points.c.reading_date, _meter_points.c.point_order),
+                )
+            ).label("consumption"),
+        )
+        .select_from(
+            apartment_meters.join(serials, serials.c.meter_id == meters.c.meter_id).join(
+                _meter_points, _meter_points.c.serial_id == serials.c.serial_id
+            )
+        )
+        .where(*filters, _meter_points.c.reading_date >= since)
+        .subquery()
+    )
+
+
+# История квартиры по месяцам окна (команда /history)
+_history = _consumption_deltas(apartment_meters_filter)
+select_consumption_history = (
+    select(
+        _history.c.meter_type,
+        _history.c.label,
+        _history.c.unit,
+        _history.c.serial_number,
+        _history.c.value,
+        _history.c.reading_date,
+        _history.c.consumption,
+    )
+    .where(_history.c.reading_date >= period_start)
+    .order_by(
+        _history.c.meter_type,
+        _history.c.serial_number,
+        _history.c.reading_date,
+        _history.c.point_order,
+    )
+)
+
+# Расход всех квартир дома за период по типам счетчиков (начисления)
+_building_deltas = _consumption_deltas(meters.c.building_id == building_id)
+select_period_consumption = (
+    select(
+        _building_deltas.c.apartment_number,
+        _building_deltas.c.type_id,
+        _building_deltas.c.meter_type,
+        _building_deltas.c.label,
+        _building_deltas.c.unit,
+        func.sum(_building_deltas.c.consumption).label("consumption"),
+    )
+    .where(
+        _building_deltas.c.reading_date >= period_start,
+        _building_deltas.c.reading_date < period_end,
+    )
+    .group_by(
+        _building_deltas.c.apartment_number,
+        _building_deltas.c.type_id,
+        _building_deltas.c.meter_type,
+        _building_deltas.c.label,
+        _building_deltas.c.unit,
+    )
+    .order_by(_building_deltas.c.apartment_number, _building_deltas.c.meter_type)
+)
+
+_newer_readings = readings.alias("newer")
+select_readings_to_archive = (
+    select(
+        readings.c.reading_id,
+        readings.c.building_id,
+        meters.c.apartment_number,
+        meter_types.c.name.label("meter_type"),
+        serials.c.serial_number,
+        readings.c.user_id,
+        readings.c.value,
+        readings.c.reading_date,
+    )
+    .select_from(
+        readings.join(apartment_meters, readings.c.meter_id == meters.c.meter_id).join(
+            serials, readings.c.serial_id == serials.c.serial_id
+        )
+    )
+    .where(
+        readings.c.building_id == building_id,
+        readings.c.reading_date < bindparam("before", type_=DateTime),
+        # Последние показания счётчика остаются для get_previous_reading
+        select(_newer_readings.c.reading_id)
+        .where(
+            _newer_readings.c.serial_id == readings.c.serial_id,
+            _newer_readings.c.reading_date > readings.c.reading_date,
+        )
+        .exists(),
+    )
+    .order_by(readings.c.reading_id)
+    .limit(bindparam("limit", type_=Integer))
+)
+
+# Импорт истории показаний: строки, уже имеющиеся в readings (тот же счётчик,
+# дата и серийный номер), пропускаются. RETURNING отдаёт только вставленные строки
+insert_readings_ignore = ByDialect(
+    lambda dialect: dialect.insert(readings)
+    .on_conflict_do_nothing(index_elements=["meter_id", "reading_date", "serial_id"])
+    .returning(readings.c.reading_id)
+)
+
+select_import_checkpoint = select(
+    import_checkpoints.c.row_number, import_checkpoints.c.imported
+).where(
+    import_checkpoints.c.file_hash == bindparam("file_hash", type_=String),
+    import_checkpoints.c.building_id == building_id,
+)
+
+insert_import_checkpoint = insert(import_checkpoints)
+
+update_import_checkpoint = (
+    update(import_checkpoints)
+    .where(
+        import_checkpoints.c.file_hash == bindparam("b_file_hash", type_=String),
+        import_checkpoints.c.building_id == bindparam("b_building_id", type_=Integer),
+    )
+    .values(
+        row_number=bindparam("row_number", type_=Integer),
+        imported=import_checkpoints.c.imported + bindparam("imported", type_=Integer),
+        updated_at=bindparam("updated_at", type_=DateTime),
+    )
+)
+
+delete_readings = delete(readings).where(
+    readings.c.reading_id.in_(bindparam("reading_ids", expanding=True))
+)
+
+_last_readings = (
+    select(
+        readings.c.meter_id,
+        func.max(readings.c.reading_date).label("last_date"),
+    )
+    .where(
+        readings.c.building_id == building_id,
+        readings.c.reading_date >= period_start,
+        readings.c.reading_date < period_end,
+    )
+    .group_by(readings.c.meter_id)
+    .cte("last_readings")
+)
+
+select_readings_for_period = (
+    select(
+        meters.c.apartment_number,
+        meter_types.c.name,
+        serials.c.serial_number,
+        readings.c.value,
+        readings.c.reading_date,
+        readings.c.estimated,
+    )
+    .select_from(
+        readings.join(meters, readings.c.meter_id == meters.c.meter_id)
+        .join(serials, readings.c.serial_id == serials.c.serial_id)
+        .join(meter_types, meters.c.type_id == meter_types.c.type_id)
+        .join(
+            _last_readings,
+            and_(
+                readings.c.meter_id == _last_readings.c.meter_id,
+                readings.c.reading_date == _last_readings.c.last_date,
+            ),
+        )
+    )
+    .where(
+        readings.c.building_id == building_id,
+        readings.c.reading_date >= period_start,
+        readings.c.reading_date < period_end,
+    )
+    .order_by(meters.c.apartment_number, meter_types.c.name)
+)
+
+_apartments_with_readings = (
+    select(meters.c.apartment_number)
+    .distinct()
+    .join_from(readings, meters, readings.c.meter_id == meters.c.meter_id)
+    .where(
+        readings.c.building_id == building_id,
+        readings.c.reading_date >= period_start,
+        readings.c.reading_date < period_end,
+        readings.c.estimated.is_(False),
+    )
+    .cte("apartments_with_readings")
+)
+
+select_apartments_without_readings = select(users.c.apartment_number).where(
+    users.c.building_id == building_id,
+    users.c.apartment_number.not_in(select(_apartments_with_readings.c.apartment_number)),
+)
+
+########################## расчётные показания ############################
+
+# Серийные номера дома без показаний за период и их показания за историю
+# (от since до начала периода): по ним оценивается средний расход в день
+_serials_with_readings = select(readings.c.serial_id).where(
+    readings.c.building_id == building_id,
+    readings.c.reading_date >= period_start,
+    readings.c.reading_date < period_end,
+)
+select_estimate_history = (
+    select(
+        readings.c.serial_id,
+        readings.c.meter_id,
+        func.min(readings.c.value).label("first_value"),
+        func.min(readings.c.reading_date).label("first_date"),
+        func.max(readings.c.value).label("last_value"),
+        func.max(readings.c.reading_date).label("last_date"),
+    )
+    .where(
+        readings.c.building_id == building_id,
+        readings.c.reading_date >= since,
+        readings.c.reading_date < period_start,
+        readings.c.estimated.is_(False),
+        readings.c.serial_id.not_in(_serials_with_readings),
+        ~serial_retired(readings.c.serial_id),
+    )
+    .group_by(readings.c.serial_id, readings.c.meter_id)
+    .having(func.count() > 1)
+)
+
+insert_estimated_readings = insert(readings)
+
+# Настоящее показание заменяет расчётное того же месяца
+delete_estimated_reading = delete(readings).where(
+    readings.c.estimated.is_(True),
+    readings.c.serial_id.in_(
+        select(serials.c.serial_id)
+        .select_from(apartment_meters.join(serials, serials.c.meter_id == meters.c.meter_id))
+        .where(
+            apartment_meters_filter,
+            meter_types.c.name == meter_type,
+            serials.c.serial_number == bindparam("serial_number", type_=String),
+        )
+    ),
+    readings.c.reading_date >= period_start,
+    readings.c.reading_date < period_end,
+)
+
+select_estimated_readings = select(
+    readings.c.reading_id, readings.c.serial_id, readings.c.reading_date
+).where(
+    readings.c.estimated.is_(True),
+    readings.c.serial_id.in_(bindparam("serial_ids", expanding=True)),
+)
+
+############################## report_runs ################################
+
+report_period = bindparam("period", type_=DateTime)
+
+select_report_run = select(report_runs.c.file_id, report_runs.c.rows).where(
+    report_runs.c.building_id == building_id,
+    report_runs.c.period == report_period,
+)
+
+select_last_report_period = select(func.max(report_runs.c.period)).where(
+    report_runs.c.building_id == building_id
+)
+
+insert_report_run = insert(report_runs)
+
+select_report_deliveries = select(report_deliveries.c.chat_id).where(
+    report_deliveries.c.building_id == building_id,
+    report_deliveries.c.period == report_period,
+)
+
+insert_report_delivery = insert(report_deliveries)
+
+################################ tariffs ##################################
+
+# Тарифы, действующие на начало периода
+select_tariffs = (
+    select(
+        tariffs.c.type_id,
+        meter_types.c.name.label("meter_type"),
+        func.coalesce(meter_types.c.label, meter_types.c.name).label("label"),
+        tariffs.c.zone,
+        tariffs.c.zone_share,
+        tariffs.c.tier_from,
+        tariffs.c.price,
+        tariffs.c.valid_from,
+    )
+    .join_from(tariffs, meter_types, tariffs.c.type_id == meter_types.c.type_id)
+    .where(
+        tariffs.c.building_id == building_id,
+        tariffs.c.valid_from <= period_start,
+        or_(tariffs.c.valid_to.is_(None), tariffs.c.valid_to > period_start),
+    )
+    .order_by(tariffs.c.type_id, tariffs.c.zone, tariffs.c.tier_from)
+)
+
+_tariff_type_id = (
+    select(meter_types.c.type_id).where(meter_types.c.name == meter_type).scalar_subquery()
+)
+tariff_valid_from = bindparam("b_valid_from", type_=DateTime)
+
+# Новый тариф закрывает действующий тариф той же зоны и ступени
+close_tariffs = (
+    update(tariffs)
+    .where(
+        tariffs.c.building_id == bindparam("b_building_id", type_=Integer),
+        tariffs.c.type_id == _tariff_type_id,
+        tariffs.c.zone == bindparam("b_zone", type_=String),
+        tariffs.c.tier_from == bindparam("b_tier_from", type_=Float),
+        tariffs.c.valid_to.is_(None),
+        tariffs.c.valid_from < tariff_valid_from,
+    )
+    .values(valid_to=tariff_valid_from)
+)
+
+insert_tariff = insert(tariffs).from_select(
+    ["building_id", "type_id", "zone", "zone_share", "tier_from", "price", "valid_from"],
+    select(
+        bindparam("b_building_id", type_=Integer),
+        meter_types.c.type_id,
+        bindparam("b_zone", type_=String),
+        bindparam("b_zone_share", type_=Float),
+        bindparam("b_tier_from", type_=Float),
+        bindparam("b_price", type_=Float),
+        tariff_valid_from,
+    ).where(meter_types.c.name == meter_type),
+)
+
+############################ user_deliveries ##############################
+
+now = bindparam("now", type_=DateTime)
+
+# Жильцы дома для рассылки: недоставленным пропускается время отсрочки
+select_broadcast_users = (
+    select(
+        users.c.user_id,
+        user_deliveries.c.failures,
+        user_deliveries.c.delivered_at,
+    )
+    .select_from(users.outerjoin(user_deliveries, user_deliveries.c.user_id == users.c.user_id))
+    .where(
+        users.c.building_id == building_id,
+        or_(user_deliveries.c.retry_after.is_(None), user_deliveries.c.retry_after <= now),
+    )
+)
+
+count_skipped_users = (
+    select(func.count())
+    .select_from(user_deliveries)
+    .where(user_deliveries.c.building_id == building_id, user_deliveries.c.retry_after > now)
+)
+
+
+def _upsert_user_deliveries(dialect):
+    statement = dialect.insert(user_deliveries)
+    return statement.on_conflict_do_update(
+        index_elements=["user_id"],
+        set_={
+            column: statement.excluded[column]
+            for column in ("failures", "last_error", "last_attempt_at", "delivered_at", "retry_after")
+        },
+    )
+
+
+# Результаты рассылки пишутся одним executemany: строка жильца заменяется целиком
+upsert_user_deliveries = ByDialect(_upsert_user_deliveries)
+
+min_failures = bindparam("min_failures", type_=Integer)
+
+select_unreachable_users = (
+    select(
+        users.c.user_id,
+        users.c.apartment_number,
+        users.c.first_name,
+        user_deliveries.c.failures,
+        user_deliveries.c.last_error,
+        user_deliveries.c.last_attempt_at,
+        user_deliveries.c.delivered_at,
+    )
+    .join(user_deliveries, user_deliveries.c.user_id == users.c.user_id)
+    .where(user_deliveries.c.building_id == building_id, user_deliveries.c.failures >= min_failures)
+    .order_by(users.c.apartment_number, users.c.user_id)
+)
+
+# Очистка недоступных жильцов дома: три выражения над одним подзапросом
+# вместо удаления по одному (delete_user). b_building_id - у readings есть
+# столбец building_id
+_unreachable_filter = and_(
+    user_deliveries.c.building_id == bindparam("b_building_id", type_=Integer),
+    user_deliveries.c.failures >= min_failures,
+)
+_unreachable_user_ids = select(user_deliveries.c.user_id).where(_unreachable_filter)
+
+clear_unreachable_readings_user = (
+    update(readings)
+    .where(readings.c.user_id.in_(_unreachable_user_ids))
+    .values(user_id=None)
+)
+
+delete_unreachable_users = delete(users).where(users.c.user_id.in_(_unreachable_user_ids))
+
+delete_unreachable_deliveries = delete(user_deliveries).where(_unreachable_filter)
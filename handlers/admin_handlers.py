@@ -1,24 +1,44 @@
-from io import BytesIO
+import time
+from functools import partial
 from logging import Logger, getLogger
-from typing import Sequence
 from aiogram import Bot, Router, types, F
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from datetime import date
+from dateutil.relativedelta import relativedelta
+from pathlib import Path
+from tempfile import TemporaryDirectory
 
-from aiogram.types import BufferedInputFile
-from aiogram.filters import Command
-from sqlalchemy.engine.row import RowMapping
+from aiogram.types import FSInputFile
+from aiogram.exceptions import TelegramAPIError
+from aiogram.filters import Command, CommandObject
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
-from utils.excel_utils import create_excel_file
+from utils.billing_utils import format_tariffs, parse_tariff
+from utils.bot_session import api_metrics
+from utils.broadcast_utils import broadcast, format_unreachable
+from utils.estimate_utils import estimate_missing_readings
+from utils.export_utils import EXPORT_FORMATS, export_invoices_file, export_readings_file
+from utils.archive_utils import read_archive
+from utils.backup_utils import backup_databases
+from utils.import_utils import (
+    IMPORT_SUFFIXES,
+    ImportReport,
+    import_meters_file,
+    import_readings_file,
+)
+from utils.job_queue import job_queue
+from middlewere.concurrency_middleware import update_metrics
 
 
 from config import settings
 from filters.chat_type import ChatTypeFilter, IsAdmin
 from kbds.repley import get_kyboard
 from kbds.inline import get_btns
+from kbds.callback_data import UserCallback, callback_cache
 from database.database import Database
-from states.states import DeleteUserState
+from database.engine import get_session_maker
+from states.states import DeleteUserState, ImportState
 
 logger: Logger = getLogger(__name__)
 
@@ -33,50 +53,380 @@ ADMIN_KB: types.ReplyKeyboardMarkup = get_kyboard(
     placeholder="Выберите действие",
 )
 
+# Ограничение Telegram на размер документа, отправляемого ботом
+DOCUMENT_SEND_LIMIT = 50 * 1024 * 1024
+# Сколько ошибок импорта показывать в сообщении
+IMPORT_ERRORS_SHOWN = 30
+# Не чаще раза в столько секунд обновлять сообщение о ходе импорта
+IMPORT_PROGRESS_INTERVAL = 5
+
+async def reset_state(state: FSMContext) -> None:
+    """Сбрасывает состояние, сохраняя выбранный администратором дом"""
+    building_id = (await state.get_data()).get("building_id")
+    await state.clear()
+    if building_id is not None:
+        await state.update_data(building_id=building_id)
+
 @router.message(Command("admin"))
-async def cmd_admin(message: types.Message):
-    await message.answer("Вы вошли как администратор.\nВыберите действие:", reply_markup=ADMIN_KB)
+async def cmd_admin(
+    message: types.Message,
+    state: FSMContext,
+    command: CommandObject,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
+):
+    if command.args:
+        # /admin <номер дома> - выбор дома, с которым работает администратор
+        if not command.args.strip().isdigit() or int(command.args) not in settings.BUILDINGS:
+            await message.answer(f"Доступные дома: {', '.join(map(str, settings.BUILDINGS))}")
+            return
+        building_id = int(command.args)
+        await state.update_data(building_id=building_id)
+    text = "Вы вошли как администратор.\n"
+    if len(settings.BUILDINGS) > 1:
+        text += f"Выбран дом {building_id} (сменить: /admin <номер дома>).\n"
+    await message.answer(text + "Выберите действие:", reply_markup=ADMIN_KB)
 
 @router.message(F.text == "Получит квартиры\nне подавшие показания")
-async def get_apartments_without_readings(message: types.Message, session: AsyncSession):
-    db = Database(session)
+async def get_apartments_without_readings(
+    message: types.Message,
+    session: AsyncSession,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
+):
+    db = Database(session, building_id)
     apartments = await db.get_apartments_without_readings()
     logger.info("Не подали показания квартиры: %s", apartments)
     for apartment in apartments:
         await message.answer(f"Вот кто не подал показания: {apartment} квартира")
 
+async def export_readings(
+    bot: Bot,
+    chat_id: int,
+    building_id: int,
+    export_format: str = "xlsx",
+    compress: bool = False,
+    invoices: bool = False,
+) -> None:
+    """Задача очереди: выгружает показания (или начисления) за период в файл и отправляет администратору"""
+    export_file = export_invoices_file if invoices else export_readings_file
+    with TemporaryDirectory(prefix="meters-export-") as tmpdir:
+        async with get_session_maker(building_id)() as session:
+            path, rows = await export_file(
+                Database(session, building_id), Path(tmpdir), export_format, compress
+            )
+        if not rows:
+            await bot.send_message(chat_id, "Нет данных за выбранный период.")
+        elif path.stat().st_size > DOCUMENT_SEND_LIMIT:
+            await bot.send_message(chat_id, f"Файл {path.name} больше 50 МБ, выберите формат со сжатием (gz).")
+        else:
+            caption = "Начисления" if invoices else "Показания счетчиков"
+            await bot.send_document(
+                chat_id, FSInputFile(path), caption=f"{caption} за выбранный период ({rows})"
+            )
+
+async def submit_export(
+    message: types.Message,
+    bot: Bot,
+    building_id: int,
+    export_format: str,
+    compress: bool,
+    invoices: bool = False,
+):
+    # Выгрузка выполняется в очереди задач, чтобы не задерживать обновления жильцов
+    if not job_queue.submit(
+        "export",
+        partial(export_readings, bot, message.chat.id, building_id, export_format, compress, invoices),
+    ):
+        await message.answer("Очередь задач заполнена, попробуйте позже.")
+        return
+    await message.answer("Формирую файл, отправлю его, когда он будет готов.")
+
 @router.message(F.text == "Получить показания всех\nсчётчиков за отчётный период")
-async def get_all_readings(message: types.Message, session: AsyncSession):
-    db = Database(session)
-    readings: Sequence[RowMapping] | None = await db.get_all_readings_for_period()
-    logger.info("Показания счетчиков за выбранный период: %s", readings)
-    if readings:
-        excel_file: BytesIO = await create_excel_file(readings)
-
-        file = BufferedInputFile(excel_file.read(), filename="meter_readings.xlsx")
-        await message.answer_document(file, caption="Показания счетчиков за выбранный период")
-    else:
-        await message.answer("Нет данных за выбранный период.")
+async def get_all_readings(
+    message: types.Message,
+    bot: Bot,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
+):
+    await submit_export(message, bot, building_id, "xlsx", False)
+
+@router.message(Command("export"))
+async def cmd_export(
+    message: types.Message,
+    bot: Bot,
+    command: CommandObject,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
+):
+    """Выгрузка показаний или начислений в выбранном формате: /export [xlsx|csv|jsonl] [invoices] [gz]"""
+    args = (command.args or "xlsx").lower().split()
+    options = set(args[1:])
+    if args[0] not in EXPORT_FORMATS or not options <= {"invoices", "gz"} or len(options) < len(args) - 1:
+        await message.answer(f"Формат: /export [{'|'.join(EXPORT_FORMATS)}] [invoices] [gz]")
+        return
+    await submit_export(
+        message, bot, building_id, args[0], "gz" in options, "invoices" in options
+    )
+
+@router.message(Command("estimate"))
+async def cmd_estimate(
+    message: types.Message,
+    session: AsyncSession,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
+):
+    """Расчётные показания за текущий отчётный период для не подавших показания"""
+    added = await estimate_missing_readings(Database(session, building_id))
+    await message.answer(
+        f"Добавлено расчётных показаний: {added}. "
+        "Они заменятся настоящими, когда жильцы подадут показания."
+    )
+
+@router.message(Command("unreachable"))
+async def cmd_unreachable(
+    message: types.Message,
+    command: CommandObject,
+    session: AsyncSession,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
+):
+    """/unreachable - жильцы, не получающие рассылки; /unreachable purge - удалить их"""
+    db = Database(session, building_id)
+    if (command.args or "").strip() == "purge":
+        deleted = await db.purge_unreachable_users()
+        await message.answer(f"Удалено недоступных жильцов: {deleted}. Их показания сохранены.")
+        return
+    users = await db.get_unreachable_users()
+    if not users:
+        await message.answer("Недоступных жильцов нет.")
+        return
+    await message.answer(
+        f"Не получают рассылки ({settings.UNREACHABLE_AFTER}+ ошибок подряд):\n"
+        f"{format_unreachable(users)}\n\nУдалить всех: /unreachable purge"
+    )
+
+@router.message(Command("tariffs"))
+async def cmd_tariffs(
+    message: types.Message,
+    session: AsyncSession,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
+):
+    """Тарифы дома, действующие в текущем отчётном периоде"""
+    tariffs = await Database(session, building_id).get_tariffs(
+        date.today() - relativedelta(months=settings.DELTA_MONTH)
+    )
+    if not tariffs:
+        await message.answer("Тарифы не заданы. Добавить: /tariff <тип> <цена>")
+        return
+    await message.answer("Действующие тарифы:\n" + format_tariffs(tariffs))
+
+@router.message(Command("tariff"))
+async def cmd_tariff(
+    message: types.Message,
+    command: CommandObject,
+    session: AsyncSession,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
+):
+    """Новый тариф: /tariff <тип> <цена> [from=ДД.ММ.ГГГГ] [zone=day|night] [share=0.7] [tier=100]"""
+    db = Database(session, building_id)
+    meter_types = [meter_type["name"] for meter_type in await db.get_meter_types()]
+    try:
+        tariff = parse_tariff(command.args or "", meter_types)
+    except ValueError as e:
+        await message.answer(
+            f"Ошибка: {e}\n"
+            "Формат: /tariff <тип> <цена> [from=ДД.ММ.ГГГГ] [zone=day|night] [share=0.7] [tier=100]"
+        )
+        return
+    if not await db.add_tariff(**tariff):
+        await message.answer("Тип счётчика не найден")
+        return
+    await message.answer(f"Тариф действует с {tariff['valid_from']:%d.%m.%Y}")
+
+async def send_backups(bot: Bot, chat_id: int) -> None:
+    """Задача очереди: снимает копии баз данных и отправляет их администратору"""
+    snapshots = await backup_databases()
+    if not snapshots:
+        await bot.send_message(chat_id, "Нет баз данных SQLite для резервного копирования.")
+    for snapshot in snapshots:
+        if snapshot.stat().st_size > DOCUMENT_SEND_LIMIT:
+            await bot.send_message(chat_id, f"Снимок {snapshot.name} слишком большой, он сохранён на сервере.")
+        else:
+            await bot.send_document(chat_id, FSInputFile(snapshot), caption=f"Снимок базы данных {snapshot.name}")
+
+@router.message(Command("backup"))
+async def cmd_backup(message: types.Message, bot: Bot):
+    """Снимок баз данных по запросу администратора"""
+    if not job_queue.submit("backup", partial(send_backups, bot, message.chat.id)):
+        await message.answer("Очередь задач заполнена, попробуйте позже.")
+        return
+    await message.answer("Снимаю копию базы данных, отправлю её, когда она будет готова.")
+
+def format_import_report(report: ImportReport) -> str:
+    lines = [f"Строк в файле: {report.total}, загружено: {report.imported}, ошибок: {len(report.errors)}"]
+    if report.duplicates:
+        lines.append(f"Уже были в базе данных: {report.duplicates}")
+    if report.resumed_from:
+        lines.append(f"Импорт продолжен после строки {report.resumed_from}")
+    lines += [
+        f"Строка {row_number}: {error}" if row_number else error
+        for row_number, error in report.errors[:IMPORT_ERRORS_SHOWN]
+    ]
+    if len(report.errors) > IMPORT_ERRORS_SHOWN:
+        lines.append(f"... и ещё {len(report.errors) - IMPORT_ERRORS_SHOWN}")
+    return "\n".join(lines)
+
+async def import_meters(bot: Bot, chat_id: int, file_id: str, file_name: str, building_id: int) -> None:
+    """Задача очереди: загружает счетчики квартир из присланного файла"""
+    with TemporaryDirectory(prefix="meters-import-") as tmpdir:
+        path = Path(tmpdir) / Path(file_name).name
+        await bot.download(file_id, destination=path)
+        async with get_session_maker(building_id)() as session:
+            report = await import_meters_file(Database(session, building_id), path)
+    await bot.send_message(chat_id, format_import_report(report))
+
+@router.message(Command("import_meters"))
+async def cmd_import_meters(message: types.Message, state: FSMContext):
+    """Массовая загрузка счетчиков квартир из xlsx или CSV"""
+    await message.answer(
+        "Пришлите файл xlsx или CSV со столбцами: квартира, тип счетчика, "
+        "серийный номер, описание. Одна строка - один счетчик."
+    )
+    await state.set_state(ImportState.meters)
+
+@router.message(ImportState.meters, F.document)
+async def process_import_meters(
+    message: types.Message,
+    state: FSMContext,
+    bot: Bot,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
+):
+    file_name = message.document.file_name or ""
+    if Path(file_name).suffix.lower() not in IMPORT_SUFFIXES:
+        await message.answer("Поддерживаются файлы .xlsx и .csv")
+        return
+    await reset_state(state)
+    if not job_queue.submit(
+        "import_meters",
+        partial(import_meters, bot, message.chat.id, message.document.file_id, file_name, building_id),
+    ):
+        await message.answer("Очередь задач заполнена, попробуйте позже.")
+        return
+    await message.answer("Загружаю счетчики из файла, пришлю отчёт, когда закончу.")
+
+async def import_readings(bot: Bot, chat_id: int, file_id: str, file_name: str, building_id: int) -> None:
+    """Задача очереди: загружает историю показаний, показывая ход импорта в одном сообщении"""
+    status = await bot.send_message(chat_id, "Импорт показаний: начинаю...")
+    last_update = time.monotonic()
+
+    async def progress(processed: int, imported: int) -> None:
+        nonlocal last_update
+        if time.monotonic() - last_update < IMPORT_PROGRESS_INTERVAL:
+            return
+        last_update = time.monotonic()
+        try:
+            await bot.edit_message_text(
+                f"Импорт показаний: обработано строк {processed}, загружено {imported}",
+                chat_id=chat_id,
+                message_id=status.message_id,
+            )
+        except TelegramAPIError as e:
+            # Сообщение о ходе импорта не должно прерывать сам импорт
+            logger.warning("Не удалось обновить ход импорта: %s", e)
+
+    with TemporaryDirectory(prefix="readings-import-") as tmpdir:
+        path = Path(tmpdir) / Path(file_name).name
+        await bot.download(file_id, destination=path)
+        try:
+            async with get_session_maker(building_id)() as session:
+                report = await import_readings_file(Database(session, building_id), path, progress)
+        except SQLAlchemyError:
+            await bot.send_message(
+                chat_id,
+                "Импорт прерван ошибкой базы данных. Загруженные пачки сохранены, "
+                "пришлите тот же файл ещё раз, чтобы продолжить.",
+            )
+            return
+    await bot.send_message(chat_id, format_import_report(report))
+
+@router.message(Command("import_readings"))
+async def cmd_import_readings(message: types.Message, state: FSMContext):
+    """Загрузка истории показаний из xlsx или CSV"""
+    await message.answer(
+        "Пришлите файл xlsx или CSV со столбцами: серийный номер, тип счетчика "
+        "(если номер повторяется у разных типов), показания, дата. "
+        "Прерванный импорт продолжится, если прислать тот же файл."
+    )
+    await state.set_state(ImportState.readings)
+
+@router.message(ImportState.readings, F.document)
+async def process_import_readings(
+    message: types.Message,
+    state: FSMContext,
+    bot: Bot,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
+):
+    file_name = message.document.file_name or ""
+    if Path(file_name).suffix.lower() not in IMPORT_SUFFIXES:
+        await message.answer("Поддерживаются файлы .xlsx и .csv")
+        return
+    await reset_state(state)
+    if not job_queue.submit(
+        "import_readings",
+        partial(import_readings, bot, message.chat.id, message.document.file_id, file_name, building_id),
+    ):
+        await message.answer("Очередь задач заполнена, попробуйте позже.")
+        return
+    await message.answer("Загружаю показания из файла, ход импорта покажу в отдельном сообщении.")
+
+@router.message(Command("stats"))
+async def get_stats(message: types.Message):
+    """Загрузка бота: очередь обновлений и очередь задач администратора"""
+    await message.answer(f"{update_metrics}\n{job_queue.metrics}\n{api_metrics}")
     
 
+@router.message(Command("archive"))
+async def get_archived_readings(
+    message: types.Message,
+    command: CommandObject,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
+):
+    """Показывает архивные показания счётчика: /archive <серийный номер>"""
+    if not command.args:
+        await message.answer("Укажите серийный номер: /archive <серийный номер>")
+        return
+    serial_number = command.args.strip()
+    rows = await read_archive(building_id, serial_number)
+    if not rows:
+        await message.answer(f"В архиве нет показаний счётчика {serial_number}")
+        return
+    lines = [f"{row['reading_date'][:10]}: {row['value']}" for row in rows]
+    await message.answer(
+        f"Архив показаний счётчика {serial_number} "
+        f"(кв. {rows[-1]['apartment_number']}):\n" + "\n".join(lines)
+    )
+
 @router.message(F.text == "Удалить пользователя\nпо номеру квартиры")
 async def delete_user(message: types.Message, state: FSMContext):
     await message.answer("Введите номер квартиры для удаления его жильца:")
     await state.set_state(DeleteUserState.apartment_number)
 
 @router.message(DeleteUserState.apartment_number)
-async def process_delete_user_apartment(message: types.Message, state: FSMContext, session: AsyncSession):
+async def process_delete_user_apartment(
+    message: types.Message,
+    state: FSMContext,
+    session: AsyncSession,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
+):
     try:
         apartment_number = int(message.text)
         await state.update_data(apartment_number=apartment_number)
-        db = Database(session)
+        db = Database(session, building_id)
         users = await db.get_users_by_apartment(apartment_number)
         logger.info("Пользователи с квартирой %s: %s", apartment_number, users)
         if not users:
             await message.answer("Нет пользователей с такой квартирой.")
-            await state.clear()
+            await reset_state(state)
             return
-        btn = {user["first_name"]: f"deleteuser_{user["user_id"]}_{user["first_name"]}" for user in users}
+        btn = {}
+        for user in users:
+            callback_cache.put(("user", user["user_id"]), user["first_name"])
+            btn[user["first_name"]] = UserCallback(user_id=user["user_id"]).pack()
         logger.info("Текст для кнопки %s", btn)
         await message.answer(
             f"Выберете пользователя из {apartment_number} для удаления",
@@ -86,16 +436,27 @@ async def process_delete_user_apartment(message: types.Message, state: FSMContex
     
     except ValueError as e:
         await message.answer("Неверный формат номера квартиры. %s", e)
-        await state.clear()
-
-@router.callback_query(DeleteUserState.user_for_delete, F.data.startswith("deleteuser_"))
-async def process_delete_user_callback(callback: types.CallbackQuery, state: FSMContext):
-    logger.info("Кнопка %s", callback.data)
-    user_data: list[str] = callback.data.split("_")
-    user_id = int(user_data[1])
-    first_name = "".join(user_data[2:])
+        await reset_state(state)
+
+@router.callback_query(DeleteUserState.user_for_delete, UserCallback.filter())
+async def process_delete_user_callback(
+    callback: types.CallbackQuery,
+    callback_data: UserCallback,
+    state: FSMContext,
+    session: AsyncSession,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
+):
+    await callback.answer()
+    user_id = callback_data.user_id
     data = await state.get_data()
     apartment_number = data.get("apartment_number")
+    first_name = callback_cache.get(("user", user_id))
+    if first_name is None:
+        # Кэш кнопок вытеснен или бот перезапущен - имя берётся из БД
+        users = await Database(session, building_id).get_users_by_apartment(apartment_number)
+        first_name = next(
+            (user["first_name"] for user in users if user["user_id"] == user_id), user_id
+        )
     btn = {"Удалить": "confirm_delete", "Отмена":"cancel_delete"}
     await callback.message.answer(
         f"Вы уверены, что хотите удалить пользователя {first_name}\nиз квартиры {apartment_number}?",
@@ -105,32 +466,54 @@ async def process_delete_user_callback(callback: types.CallbackQuery, state: FSM
     await state.set_state(DeleteUserState.confirm_delete)
 
 @router.callback_query(DeleteUserState.confirm_delete, F.data == "confirm_delete")
-async def process_delete_user_confirmation(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
+async def process_delete_user_confirmation(
+    callback: types.CallbackQuery,
+    state: FSMContext,
+    session: AsyncSession,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
+):
     data = await state.get_data()
     apartment_number = data.get("apartment_number")
     user_id = data.get("user_id")
     if apartment_number and user_id:
-        db = Database(session)
+        db = Database(session, building_id)
         await db.delete_user_by_apartment(apartment_number, user_id)
         await callback.message.answer(f"Пользователь с квартирой {apartment_number} удален.")
     else:
         await callback.message.answer("Не удалось получить номер квартиры.")
-    await state.clear()
+    await reset_state(state)
 
 @router.callback_query(DeleteUserState.confirm_delete, F.data == "cancel_delete")
 async def process_delete_user_cancellation(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.answer("Удаление отменено.")
-    await state.clear()
+    await reset_state(state)
+
+async def send_reminders(bot: Bot, chat_id: int, building_id: int) -> None:
+    """Задача очереди: рассылает напоминание о подаче показаний жильцам дома"""
+    report = await broadcast(
+        bot,
+        get_session_maker(building_id),
+        building_id,
+        "Пожалуйста, не забудьте подать показания счетчиков!",
+    )
+    text = (
+        f"Напоминания отправлены: доставлено {report.delivered}, "
+        f"недоступны {report.unreachable}, ошибки {report.failed}, "
+        f"пропущено (недоступны ранее) {report.skipped}."
+    )
+    if report.unreachable or report.skipped:
+        text += "\nНедоступные жильцы: /unreachable"
+    await bot.send_message(chat_id, text)
 
 @router.message(F.text == "Отправить напоминание\nо подаче показаний")
-async def send_reminder(message: types.Message, bot: Bot, session: AsyncSession):
-    db = Database(session)
-    users = await db.get_all_users()
-    logger.info("Получен список пользователей: %s", users)
-    for user in users:
-        try:
-            await bot.send_message(user["user_id"], "Пожалуйста, не забудьте подать показания счетчиков!")
-        except Exception as e:
-            await message.answer("Не удалось отправить сообщение пользователю %s", user["user_id"])
-            logger.exception("Не удалось отправить сообщение пользователю %s: %s", user["user_id"], e)
-    await message.answer("Напоминания отправлены.")
+async def send_reminder(
+    message: types.Message,
+    bot: Bot,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
+):
+    if not job_queue.submit(
+        "reminder", partial(send_reminders, bot, message.chat.id, building_id)
+    ):
+        await message.answer("Очередь задач заполнена, попробуйте позже.")
+        return
+    await message.answer("Рассылка напоминаний запущена.")
@@ -1,13 +1,14 @@
 from logging import Logger, getLogger
-from datetime import datetime
+from typing import NamedTuple
 
 from aiogram import Router, F
-from aiogram.filters import Command
-from aiogram.types import Message, CallbackQuery
+from aiogram.filters import Command, CommandObject
+from aiogram.types import BufferedInputFile, Message, CallbackQuery
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.state import State
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from config import settings
 from database.database import Database
 from states.states import (
     UserRegistration,
@@ -16,8 +17,16 @@ from states.states import (
     EditSerialsStates,
 )
 from kbds.inline import get_btns
+from kbds.callback_data import (
+    BuildingCallback,
+    MeterTypeCallback,
+    SerialCallback,
+    SerialEditCallback,
+    callback_cache,
+)
 from kbds.utils import get_text_for_keyboard, get_period
 from filters.chat_type import ChatTypeFilter
+from utils.history_utils import build_chart, format_history, group_history, history_months
 from utils.schemas import UserRegistrShema
 
 # from handlers.error_handlers import
@@ -27,25 +36,48 @@ logger: Logger = getLogger(__name__)
 router = Router()
 router.message.filter(ChatTypeFilter(chat_types=["private"]))
 
-TEXT_FOR_ANSWER_TYPE: dict[str, str] = {
-    "hot_water": "Горячей воды",
-    "cold_water": "Холодной воды",
-    "electricity": "Электричества",
-    "heat": "Тепла",
-}
-
-
 @router.message(Command("start"))
-async def start_handler(message: Message, session: AsyncSession, state: FSMContext):
-    db = Database(session)
+async def start_handler(
+    message: Message,
+    session: AsyncSession,
+    state: FSMContext,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
+):
+    db = Database(session, building_id)
     user = await db.get_info_for_user(message.from_user.id)
     if user:
         await show_user_info(message, user)
+    elif len(settings.BUILDINGS) > 1:
+        btn = {
+            f"Дом {building}": BuildingCallback(building_id=building).pack()
+            for building in settings.BUILDINGS
+        }
+        await message.answer("Выберите ваш дом:", reply_markup=get_btns(btn=btn))
+        await state.set_state(UserRegistration.building)
     else:
-        await message.answer("Введите номер квартиры (1-100):")
+        await message.answer(
+            f"Введите номер квартиры (1-{settings.BUILDINGS[building_id]}):"
+        )
         await state.set_state(UserRegistration.apartment_number)
 
 
+@router.callback_query(UserRegistration.building, BuildingCallback.filter())
+async def process_building(
+    callback: CallbackQuery, callback_data: BuildingCallback, state: FSMContext
+):
+    building_id = callback_data.building_id
+    if building_id not in settings.BUILDINGS:
+        await callback.message.answer("Такой дом не обслуживается")
+        return
+
+    # Дом сохраняется в состоянии, по нему DbSessionMiddleware выбирает базу данных
+    await state.update_data(building_id=building_id)
+    await callback.message.answer(
+        f"Введите номер квартиры (1-{settings.BUILDINGS[building_id]}):"
+    )
+    await state.set_state(UserRegistration.apartment_number)
+
+
 async def show_user_info(message: Message, user: dict):
     """Показывает информацию о пользователе"""
 
@@ -62,11 +94,45 @@ async def show_user_info(message: Message, user: dict):
 ################################## FSM register #############################################
 
 
+class MeterTypeStep(NamedTuple):
+    """Шаг регистрации: тип счетчика из meter_types и допустимое количество"""
+
+    name: str
+    title: str  # Название в родительном падеже для вопросов
+    min_count: int
+    max_count: int
+
+
+# Шаги регистрации - строки meter_types в порядке position (Database.get_meter_types):
+# новый тип счетчика добавляется строкой таблицы, обработчики и состояния не меняются.
+# Ход регистрации хранится в состоянии компактно:
+#   steps - шаги, прочитанные при вводе квартиры (MeterTypeStep списками),
+#   step - индекс текущего шага,
+#   count - количество счетчиков текущего типа,
+#   meters - {тип: [серийные номера, описания]} для пройденных типов.
+# Каждое сообщение читает состояние один раз и один раз записывает его целиком.
+
+
+def current_step(data: dict) -> MeterTypeStep:
+    return MeterTypeStep(*data["steps"][data["step"]])
+
+
+def registration_to_apartment_info(data: dict) -> dict:
+    """Собирает из хода регистрации данные для Database.add_info_apartment"""
+    return {
+        "apartment_number": data["apartment_number"],
+        "meters": {
+            meter_type: {"serials": serials, "descriptions": descriptions}
+            for meter_type, (serials, descriptions) in data["meters"].items()
+        },
+    }
+
+
 async def process_add_database(
-    message: Message, state: FSMContext, session: AsyncSession
+    message: Message, state: FSMContext, session: AsyncSession, data: dict
 ):
-    db = Database(session)
-    user_data = await state.get_data()
+    db = Database(session, data.get("building_id"))
+    user_data = registration_to_apartment_info(data)
     user_data["user_id"] = message.from_user.id
     user_data["first_name"] = message.from_user.first_name
     user_data["last_name"] = message.from_user.last_name
@@ -76,58 +142,43 @@ async def process_add_database(
     await state.clear()
 
 
-async def process_meter_descriptions(
-    message: Message,
-    state: FSMContext,
-    meter_type: str,
-    next_state: State,
-    next_prompt: str,
-    session: AsyncSession = None,
-):
-    """
-    Обрабатывает ввод описаний счетчиков.
-
-    Args:
-        message (Message): Сообщение от пользователя.
-        state (FSMContext): Контекст состояния.
-        meter_type (str): Тип счетчика.
-        next_state (State): Следующее состояние.
-        next_prompt (str): Следующий запрос.
-        session (AsyncSession): Сессия базы данных.
-
-    Returns:
-        None
-    """
-    data = await state.get_data()
-    descriptions = data[f"{meter_type}_descriptions"]
-    descriptions.append(message.text)
-
-    current_index = data["current_meter_index"] + 1
-    await state.update_data(
-        **{f"{meter_type}_descriptions": descriptions},
-        current_meter_index=current_index,
+async def ask_meter_count(message: Message, state: FSMContext, data: dict) -> None:
+    """Сохраняет ход регистрации и спрашивает количество счетчиков текущего шага"""
+    step = current_step(data)
+    await state.set_data(data)
+    await message.answer(
+        f"Сколько счетчиков {step.title} установлено? ({step.min_count}-{step.max_count})"
     )
+    await state.set_state(UserRegistration.meter_count)
 
-    if current_index < len(data[f"{meter_type}_serials"]):
-        await message.answer(
-            f"Введите описание для счетчика {data[f'{meter_type}_serials'][current_index]}\n(не более 50 символов):"
-        )
+
+async def next_registration_step(
+    message: Message, state: FSMContext, session: AsyncSession, data: dict
+) -> None:
+    """Переходит к следующему типу счетчика или завершает регистрацию"""
+    data["step"] += 1
+    data.pop("count", None)
+    if data["step"] < len(data["steps"]):
+        await ask_meter_count(message, state, data)
     else:
-        if session:
-            await process_add_database(message, state, session)
-        else:
-            await message.answer(next_prompt)
-            await state.set_state(next_state)
+        await process_add_database(message, state, session, data)
 
 
 @router.message(UserRegistration.apartment_number)
-async def process_apartment(message: Message, state: FSMContext, session: AsyncSession):
-    if not message.text.isdigit():
+async def process_apartment(
+    message: Message,
+    state: FSMContext,
+    session: AsyncSession,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
+):
+    # Фото или стикер вместо текста - не число
+    text = message.text or ""
+    if not text.isdigit():
         await message.answer("Пожалуйста, введите число")
         return
 
-    apartment = int(message.text)
-    db = Database(session)
+    apartment = int(text)
+    db = Database(session, building_id)
     meters_in_apartment = await db.get_all_meters_serials_and_descriptions(apartment)
     if meters_in_apartment:
         await show_user_info(
@@ -144,325 +195,282 @@ async def process_apartment(message: Message, state: FSMContext, session: AsyncS
         )
         return
 
-    if not 1 <= apartment <= 173:
-        await message.answer("Номер квартиры должен быть от 1 до 173")
+    apartments_count = settings.BUILDINGS[building_id]
+    if not 1 <= apartment <= apartments_count:
+        await message.answer(f"Номер квартиры должен быть от 1 до {apartments_count}")
         return
 
-    await state.update_data(apartment_number=apartment)
-    await message.answer("Сколько счетчиков горячей воды установлено? (1-3)")
-    await state.set_state(UserRegistration.hot_water_count)
-
-
-@router.message(UserRegistration.hot_water_count, F.text.regexp(r"^[1-3]$"))
-async def process_hot_water(message: Message, state: FSMContext) -> None:
-    await state.update_data(hot_water_count=int(message.text))
-
-    await message.answer("Введите серийные номера горячей воды, разделенные пробелом:")
-    await state.set_state(MeterRegistration.hot_water_serials)
-
-
-@router.message(MeterRegistration.hot_water_serials)
-async def process_hot_water_serials(message: Message, state: FSMContext):
+    steps = [
+        [row["name"], row["title"], row["min_count"], row["max_count"]]
+        for row in await db.get_meter_types()
+    ]
     data = await state.get_data()
-    count = data["hot_water_count"]
-    serials = [s.strip() for s in message.text.split()]
-    if len(serials) != count:
-        await message.answer(f"Нужно ввести {count} номеров через пробел")
-        return
-
-    await state.update_data(
-        hot_water_serials=serials, current_meter_index=0, hot_water_descriptions=[]
-    )
-    await message.answer(
-        f"Введите описание для счетчика {serials[0]}\n(Не более 50 символов):"
-    )
-    await state.set_state(MeterRegistration.hot_water_descriptions)
+    data.update(apartment_number=apartment, steps=steps, step=0, meters={})
+    if steps:
+        await ask_meter_count(message, state, data)
+    else:
+        await process_add_database(message, state, session, data)
 
 
-@router.message(MeterRegistration.hot_water_descriptions)
-async def process_hot_water_descriptions(message: Message, state: FSMContext):
+@router.message(UserRegistration.meter_count)
+async def process_meter_count(
+    message: Message, state: FSMContext, session: AsyncSession
+) -> None:
     data = await state.get_data()
-    descriptions = data["hot_water_descriptions"]
-    descriptions.append(message.text)
-
-    current_index = data["current_meter_index"] + 1
-    await state.update_data(
-        hot_water_descriptions=descriptions, current_meter_index=current_index
-    )
-
-    if current_index < len(data["hot_water_serials"]):
+    step = current_step(data)
+    text = message.text or ""
+    if not (text.isdigit() and step.min_count <= int(text) <= step.max_count):
         await message.answer(
-            f"Введите описание для счетчика {data['hot_water_serials'][current_index]}\n(не более 50 символов):"
+            f"Пожалуйста, введите число от {step.min_count} до {step.max_count}"
         )
-    else:
-        await message.answer("Сколько счетчиков холодной воды установлено? (1-3)")
-        await state.set_state(UserRegistration.cold_water_count)
-
+        return
 
-@router.message(UserRegistration.cold_water_count, F.text.regexp(r"^[1-3]$"))
-async def process_cold_water(message: Message, state: FSMContext) -> None:
-    await state.update_data(cold_water_count=int(message.text))
+    count = int(text)
+    if count == 0:
+        await next_registration_step(message, state, session, data)
+        return
 
-    await message.answer("Введите серийные номера холодной воды, разделенные пробелом:")
-    await state.set_state(MeterRegistration.cold_water_serials)
+    data["count"] = count
+    await state.set_data(data)
+    await message.answer(f"Введите серийные номера {step.title}, разделенные пробелом:")
+    await state.set_state(MeterRegistration.serials)
 
 
-@router.message(MeterRegistration.cold_water_serials)
-async def process_cold_water_serials(message: Message, state: FSMContext):
+@router.message(MeterRegistration.serials)
+async def process_meter_serials(message: Message, state: FSMContext):
     data = await state.get_data()
-    logger.info("Полученные данные о счетчиках холодной воды: %s", data)
-    count = data["cold_water_count"]
-    serials = [s.strip() for s in message.text.split()]
+    count = data["count"]
+    serials = (message.text or "").split()
     if len(serials) != count:
         await message.answer(f"Нужно ввести {count} номеров через пробел")
         return
+    if len(set(serials)) != len(serials):
+        await message.answer("Серийные номера не должны повторяться")
+        return
 
-    await state.update_data(
-        cold_water_serials=serials, current_meter_index=0, cold_water_descriptions=[]
-    )
+    data["meters"][current_step(data).name] = [serials, []]
+    await state.set_data(data)
     await message.answer(
         f"Введите описание для счетчика {serials[0]}\n(Не более 50 символов):"
     )
-    await state.set_state(MeterRegistration.cold_water_descriptions)
+    await state.set_state(MeterRegistration.descriptions)
 
 
-@router.message(MeterRegistration.cold_water_descriptions)
-async def process_cold_water_descriptions(message: Message, state: FSMContext):
-    await process_meter_descriptions(
-        message=message,
-        state=state,
-        meter_type="cold_water",
-        next_state=UserRegistration.electricity_count,
-        next_prompt="Сколько счетчиков электричества установено? (1-3)",
-    )
-
-
-@router.message(UserRegistration.electricity_count, F.text.regexp(r"^[1-3]$"))
-async def process_electricity(message: Message, state: FSMContext) -> None:
-    await state.update_data(electricity_count=int(message.text))
-    await message.answer("Введите серийные номера электричества, разделенные пробелом:")
-    await state.set_state(MeterRegistration.electricity_serials)
-
+@router.message(MeterRegistration.descriptions)
+async def process_meter_description(
+    message: Message, state: FSMContext, session: AsyncSession
+):
+    description = (message.text or "").strip()
+    if not description or len(description) > 50:
+        await message.answer("Описание должно быть от 1 до 50 символов")
+        return
 
-@router.message(MeterRegistration.electricity_serials)
-async def process_electricity_serials(message: Message, state: FSMContext):
     data = await state.get_data()
-    count = data["electricity_count"]
-    serials = [s.strip() for s in message.text.split()]
-    if len(serials) != count:
-        await message.answer(f"Нужно ввести {count} номеров через пробел")
-        return
+    serials, descriptions = data["meters"][current_step(data).name]
+    descriptions.append(description)
+    if len(descriptions) < len(serials):
+        await state.set_data(data)
+        await message.answer(
+            f"Введите описание для счетчика {serials[len(descriptions)]}\n(Не более 50 символов):"
+        )
+    else:
+        await next_registration_step(message, state, session, data)
 
-    await state.update_data(
-        electricity_serials=serials, current_meter_index=0, electricity_descriptions=[]
-    )
-    await message.answer(
-        f"Введите описание для счетчика {serials[0]}\n(Не более 50 символов):"
-    )
-    await state.set_state(MeterRegistration.electricity_descriptions)
 
+##################################### FSM submit #####################################
 
-@router.message(MeterRegistration.electricity_descriptions)
-async def process_electricity_descriptions(message: Message, state: FSMContext):
-    await process_meter_descriptions(
-        message=message,
-        state=state,
-        meter_type="electricity",
-        next_state=UserRegistration.heat_count,
-        next_prompt="Сколько счетчиков тепла установлено? (0-1)",
-    )
+# Бот предлагает подать показания по типам в порядке meter_types: в состоянии
+# types - {тип: [название на кнопке, название в родительном падеже]}.
+# Вся подача показаний идёт в одном сообщении статуса (status_message_id в
+# состоянии): бот правит его текст и клавиатуру вместо отправки новых сообщений,
+# а после ввода показаний сам переходит к следующему неподанному счетчику.
 
 
-@router.message(UserRegistration.heat_count, F.text.regexp(r"^[0-1]$"))
-async def process_heat(
-    message: Message, state: FSMContext, session: AsyncSession
+async def show_status(
+    message: Message, state: FSMContext, data: dict, body: str
 ) -> None:
-    count = int(message.text)
-    await state.update_data(heat_count=count)
-    if count == 0:
-        await process_add_database(message, state, session)
-        return
-
-    await message.answer("Введите серийные номера тепла, разделенные пробелом:")
-    await state.set_state(MeterRegistration.heat_serials)
-
-
-@router.message(MeterRegistration.heat_serials)
-async def process_heat_serials(message: Message, state: FSMContext):
-    data = await state.get_data()
-    count = data["heat_count"]
-    serials = [s.strip() for s in message.text.split()]
-    if len(serials) != count:
-        await message.answer(f"Нужно ввести {count} номеров через пробел")
-        return
-
-    await state.update_data(
-        heat_serials=serials, current_meter_index=0, heat_descriptions=[]
+    """Показывает шаг подачи в сообщении статуса: правит его или отправляет новое"""
+    period_name, period_date = get_period()
+    text = (
+        f"Подать показания за {period_name} {period_date.year}:\n"
+        f"✅ - подано, ❌ - не подано\n\n{body}"
     )
-    await message.answer(
-        f"Введите описание для счетчика {serials[0]}\n(Не более 50 символов):"
+    reply_markup = get_btns(btn=get_text_for_keyboard(data["types"], data["submitted"]))
+    message_id = data.get("status_message_id")
+    if message_id:
+        try:
+            await message.bot.edit_message_text(
+                text=text,
+                chat_id=message.chat.id,
+                message_id=message_id,
+                reply_markup=reply_markup,
+            )
+            return
+        except TelegramBadRequest as e:
+            if "message is not modified" in e.message:
+                return
+            logger.info("Сообщение статуса %s недоступно: %s", message_id, e)
+    status = await message.answer(text, reply_markup=reply_markup)
+    await state.update_data(status_message_id=status.message_id)
+
+
+async def select_meter_type(db: Database, data: dict, meter_type: str) -> bool:
+    """Делает meter_type текущим типом подачи, False - у квартиры нет таких счетчиков"""
+    meters = await db.get_meters_serials_and_descriptions(
+        data["apartment_number"], meter_type
     )
-    await state.set_state(MeterRegistration.heat_descriptions)
-
-
-@router.message(MeterRegistration.heat_descriptions)
-async def process_heat_descriptions(
-    message: Message, state: FSMContext, session: AsyncSession
-):
-    await process_meter_descriptions(
-        message=message,
-        state=state,
-        meter_type="heat",
-        next_state=None,
-        next_prompt="",
-        session=session,
+    if not meters:
+        return False
+    data.update(
+        meter_type=meter_type,
+        meters_serials=[dict(meter) for meter in meters],
+        current_meter_index=0,
     )
+    return True
+
+
+async def next_submit_step(db: Database, data: dict) -> str:
+    """Готовит в data следующий счетчик для ввода и возвращает текст шага"""
+    if data.get("meter_type") is None:
+        for meter_type in data["types"]:
+            if meter_type in data["submitted"] or meter_type in data["absent"]:
+                continue
+            if await select_meter_type(db, data, meter_type):
+                break
+            data["absent"].append(meter_type)
+        else:
+            data["prompt"] = None
+            return "Все показания поданы. Нажмите 'Завершить'"
 
-
-##################################### FSM submit #####################################
+    meter = data["meters_serials"][data["current_meter_index"]]
+    prev_reading = await db.get_previous_reading(
+        data["meter_type"], meter["serial_number"]
+    )
+    data["prev_reading"] = dict(prev_reading) if prev_reading else None
+    prompt = f"Счетчик {meter['serial_number']}\nОписание: {meter['description']}\n"
+    if prev_reading:
+        prompt += f"Предыдущие показания: {prev_reading['value']}\nВведите новые показания:"
+    else:
+        prompt += "Введите показания:"
+    data["prompt"] = prompt
+    return prompt
 
 
 @router.message(Command("submit"))
-async def start_submit(message: Message, state: FSMContext, session: AsyncSession):
-    db = Database(session)
+async def start_submit(
+    message: Message,
+    state: FSMContext,
+    session: AsyncSession,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
+):
+    db = Database(session, building_id)
     user = await db.get_info_for_user(message.from_user.id)
     if not user:
         await message.answer("Сначала зарегистрируйтесь через /start")
         return
 
-    await state.update_data(
-        user_id=message.from_user.id, apartment_number=user["apartment_number"]
-    )
-
-    period_date: tuple[str, datetime] = get_period()
-
     check_readings = await db.get_meter_types_for_period(
-        user["apartment_number"], period_date[1]
+        user["apartment_number"], get_period()[1]
     )
     logger.info("check_readings: %s", check_readings)
-    btn: dict[str, str] = get_text_for_keyboard(check_readings)
-    await message.answer(
-        f"Подать показания за {period_date[0]} {period_date[1].year}:\n \
-        ✅ - подано, ❌ - не подано\n",
-        reply_markup=get_btns(btn=btn),
-    )
+    # Новая подача - новое сообщение статуса
+    data = {
+        "user_id": message.from_user.id,
+        "apartment_number": user["apartment_number"],
+        "building_id": building_id,
+        "types": {row["name"]: [row["label"], row["title"]] for row in await db.get_meter_types()},
+        "submitted": list(check_readings),
+        "absent": [],
+    }
+    body = await next_submit_step(db, data)
+    await state.set_data(data)
+    await state.set_state(MeterSubmission.value if data["prompt"] else None)
+    await show_status(message, state, data, body)
 
 
-@router.callback_query(F.data.startswith("type_"))
+@router.callback_query(MeterTypeCallback.filter())
 async def process_meter_type(
-    callback: CallbackQuery, state: FSMContext, session: AsyncSession
-):
-    meter_type = callback.data.replace("type_", "")
-    # Получаем список доступных счетчиков
-    db = Database(session)
-    user_data = await state.get_data()
-    logger.info("user_data: %s", user_data)
-    meters_serials = await db.get_meters_serials_and_descriptions(
-        user_data["apartment_number"], meter_type
-    )
-    if not meters_serials:
-        await callback.message.answer(f"У вас нет счетчиков {meter_type}")
-        return
-    logger.info("meters_serials: %s", meters_serials)
-    await state.update_data(meter_type=meter_type)
-
-    # Сохраняем список счетчиков в состояние
-    await state.update_data(
-        meter_type=meter_type, meters_serials=meters_serials, current_meter_index=0
-    )
-    # Начинаем ввод показаний для первого счетчика
-    await process_next_meter(callback.message, state, session)
-
-
-async def process_next_meter(
-    message: Message, state: FSMContext, session: AsyncSession
+    callback: CallbackQuery,
+    callback_data: MeterTypeCallback,
+    state: FSMContext,
+    session: AsyncSession,
 ):
+    await callback.answer()
+    meter_type = callback_data.meter_type
     data = await state.get_data()
-    meters = data["meters_serials"]
-    logger.info("meters: %s", meters)
-    current_index = data["current_meter_index"]
-    db = Database(session)
-
-    if current_index >= len(meters):
-        period_date: tuple[str, datetime] = get_period()
-        check_readings = await db.get_meter_types_for_period(
-            data["apartment_number"], period_date[1]
-        )
-        logger.info("check_readings: %s", check_readings)
-        btn: dict[str, str] = get_text_for_keyboard(check_readings)
-        await message.answer(
-            f"""
-            Продолжим ввод показаний за {period_date[0]} {period_date[1].year}\n
-            ✅ - подано, ❌ - не подано
-            Выберите пункт меню, чтобы продолжить 
-            (После завершения ввода нажмите 'Завершить')
-            """,
-            reply_markup=get_btns(btn=btn),
-        )
-        # Не очищаем состояние, чтобы сохранить информацию о пользователе
+    if "apartment_number" not in data:
+        await callback.message.edit_text("Подача показаний завершена, начните заново: /submit")
+        return
+    if meter_type == data.get("meter_type"):
         return
 
-    meter = meters[
-        current_index
-    ]  # Получаем информацию о счетчике по индексу далее индекс увеличиваем
-
-    # Проверяем предыдущие показания
-    prev_reading = await db.get_previous_reading(
-        data["meter_type"], meter["serial_number"]
-    )
-    await state.update_data(prev_reading=prev_reading)
-    if prev_reading:
-        await message.answer(
-            f"Счетчик {meter['serial_number']}\n"
-            f"Описание: {meter['description']}\n"
-            f"Предыдущие показания: {prev_reading['value']}\n"
-            "Введите новые показания:"
-        )
+    db = Database(session, data.get("building_id"))
+    if await select_meter_type(db, data, meter_type):
+        body = await next_submit_step(db, data)
+        await state.set_state(MeterSubmission.value)
     else:
-        await message.answer(
-            f"Счетчик {meter['serial_number']}\n"
-            f"Описание: {meter['description']}\n"
-            "Введите показания:"
-        )
-
-    await state.set_state(MeterSubmission.value)
+        title = data["types"].get(meter_type, [meter_type, meter_type])[1]
+        body = f"У вас нет счетчиков {title}"
+        if data.get("prompt"):
+            body += f"\n\n{data['prompt']}"
+    await state.set_data(data)
+    await show_status(callback.message, state, data, body)
 
 
 @router.message(MeterSubmission.value)
 async def process_value(message: Message, state: FSMContext, session: AsyncSession):
+    data = await state.get_data()
     try:
-        data = await state.get_data()
-
-        value = float(message.text)
-
-        if data["prev_reading"] and value < data["prev_reading"]["value"]:
-            await message.answer("Показания не могут быть меньше предыдущих")
-            return
+        value = float((message.text or "").replace(",", "."))
+    except ValueError as e:
+        logger.error("Ошибка: %s", e)
+        await show_status(message, state, data, f"❗ Пожалуйста, введите число\n\n{data['prompt']}")
+        return
 
-        db = Database(session)
+    if data["prev_reading"] and value < data["prev_reading"]["value"]:
+        await show_status(
+            message,
+            state,
+            data,
+            f"❗ Показания не могут быть меньше предыдущих\n\n{data['prompt']}",
+        )
+        return
 
-        index = data.get("current_meter_index")
-        # Переходим к следующему счетчику
-        data["serial_number"] = data["meters_serials"][index]["serial_number"]
-        data["value"] = value
-        await db.add_reading(data)
-        del data["serial_number"]
+    db = Database(session, data.get("building_id"))
+    meter = data["meters_serials"][data["current_meter_index"]]
+    await db.add_reading(
+        {
+            "user_id": data["user_id"],
+            "apartment_number": data["apartment_number"],
+            "meter_type": data["meter_type"],
+            "serial_number": meter["serial_number"],
+            "value": value,
+        }
+    )
 
-        await state.update_data(current_meter_index=data["current_meter_index"] + 1)
-        await process_next_meter(message, state, session)
-
-    except ValueError as e:
-        logger.error("Ошибка: %s", e)
-        await message.answer("Пожалуйста, введите число")
+    # Переходим к следующему счетчику, а после последнего - к следующему типу
+    data["current_meter_index"] += 1
+    if data["current_meter_index"] >= len(data["meters_serials"]):
+        if data["meter_type"] not in data["submitted"]:
+            data["submitted"].append(data["meter_type"])
+        data["meter_type"] = None
+    body = await next_submit_step(db, data)
+    await state.set_data(data)
+    if not data["prompt"]:
+        await state.set_state(None)
+    await show_status(message, state, data, body)
 
 
 @router.message(Command("edit_serials"))
 async def start_edit_serials(
-    message: Message, state: FSMContext, session: AsyncSession
+    message: Message,
+    state: FSMContext,
+    session: AsyncSession,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
 ):
     """Начало процесса редактирования серийных номеров"""
 
-    db = Database(session)
+    db = Database(session, building_id)
     user = await db.get_info_for_user(message.from_user.id)
 
     if not user:
@@ -470,13 +478,15 @@ async def start_edit_serials(
         return
 
     meters = await db.get_all_meters_serials_and_descriptions(user["apartment_number"])
-    btn = {
-        f"{meter['serial_number']} -> {meter['description']}": f"edit_serial_{meter['serial_number']}"
-        for meter in meters
-    }
     if not meters:
         await message.answer("У вас нет зарегистрированных счетчиков")
         return
+    btn = {}
+    for meter in meters:
+        callback_cache.put(("serial", meter["serial_id"]), meter["serial_number"])
+        btn[f"{meter['serial_number']} -> {meter['description']}"] = SerialCallback(
+            serial_id=meter["serial_id"]
+        ).pack()
 
     await message.answer(
         "Выберите счетчик для изменения серийного номера:",
@@ -485,12 +495,37 @@ async def start_edit_serials(
     await state.set_state(EditSerialsStates.select_meter)
 
 
-@router.callback_query(
-    EditSerialsStates.select_meter, F.data.startswith("edit_serial_")
-)
-async def select_meter_to_edit(callback: CallbackQuery, state: FSMContext):
+async def find_serial_number(db: Database, user_id: int, serial_id: int) -> str | None:
+    """Серийный номер счетчика пользователя по serial_id (при промахе кэша кнопок)"""
+    user = await db.get_info_for_user(user_id)
+    if not user:
+        return None
+    for meter in await db.get_all_meters_serials_and_descriptions(user["apartment_number"]):
+        if meter["serial_id"] == serial_id:
+            return meter["serial_number"]
+    return None
+
+
+@router.callback_query(EditSerialsStates.select_meter, SerialCallback.filter())
+async def select_meter_to_edit(
+    callback: CallbackQuery,
+    callback_data: SerialCallback,
+    state: FSMContext,
+    session: AsyncSession,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
+):
     """Обработка выбора счетчика для редактирования"""
-    serial_number = callback.data.replace("edit_serial_", "")
+    await callback.answer()
+    serial_number = callback_cache.get(("serial", callback_data.serial_id))
+    if serial_number is None:
+        db = Database(session, building_id)
+        serial_number = await find_serial_number(
+            db, callback.from_user.id, callback_data.serial_id
+        )
+    if serial_number is None:
+        await callback.message.answer("Счетчик не найден, начните заново: /edit_serials")
+        await state.clear()
+        return
     await state.update_data(selected_serial=serial_number)
     await callback.message.answer(
         f"Введите новый серийный номер для счетчика {serial_number}:"
@@ -498,29 +533,174 @@ async def select_meter_to_edit(callback: CallbackQuery, state: FSMContext):
     await state.set_state(EditSerialsStates.edit_serial)
 
 
+def serial_exists_text(serial_number: str) -> str:
+    return f"Счетчик с номером {serial_number} уже есть, введите другой серийный номер:"
+
+
 @router.message(EditSerialsStates.edit_serial)
 async def process_new_serial(
-    message: Message, state: FSMContext, session: AsyncSession
+    message: Message,
+    state: FSMContext,
+    session: AsyncSession,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
 ):
     """Обработка ввода нового серийного номера"""
-    new_serial = message.text.strip()
+    new_serial = (message.text or "").strip()
+    if not new_serial:
+        await message.answer("Введите серийный номер текстом:")
+        return
     data = await state.get_data()
 
-    db = Database(session)
-    await db.update_serial_number(
+    db = Database(session, building_id)
+    if await db.get_user_serial(new_serial, message.from_user.id) is not None:
+        await message.answer(serial_exists_text(new_serial))
+        return
+    meter = await db.get_user_serial(data["selected_serial"], message.from_user.id)
+    if meter is None:
+        # Счетчик снят при замене или удалён
+        await message.answer("Счетчик не найден, начните заново: /edit_serials")
+        await state.clear()
+        return
+    if meter["has_readings"]:
+        # По старому номеру уже есть показания: прибор могли заменить
+        await state.update_data(new_serial=new_serial)
+        await message.answer(
+            f"Счетчик {data['selected_serial']} заменён новым или номер был введён с ошибкой?",
+            reply_markup=get_btns(
+                btn={
+                    "Счётчик заменён": SerialEditCallback(action="replaced").pack(),
+                    "Исправить опечатку": SerialEditCallback(action="typo").pack(),
+                }
+            ),
+        )
+        await state.set_state(EditSerialsStates.replace_or_fix)
+        return
+
+    if not await db.update_serial_number(
         data["selected_serial"], new_serial, message.from_user.id
-    )
+    ):
+        await message.answer(serial_exists_text(new_serial))
+        return
 
     await message.answer("Серийный номер успешно изменен!")
     await state.clear()
 
 
+@router.callback_query(
+    EditSerialsStates.replace_or_fix, SerialEditCallback.filter(F.action == "typo")
+)
+async def fix_serial_typo(
+    callback: CallbackQuery,
+    state: FSMContext,
+    session: AsyncSession,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
+):
+    """Опечатка: серийный номер меняется, показания остаются за счетчиком"""
+    await callback.answer()
+    data = await state.get_data()
+    db = Database(session, building_id)
+    if await db.get_user_serial(data["selected_serial"], callback.from_user.id) is None:
+        await callback.message.edit_text("Счетчик не найден, начните заново: /edit_serials")
+        await state.clear()
+        return
+    if not await db.update_serial_number(
+        data["selected_serial"], data["new_serial"], callback.from_user.id
+    ):
+        await callback.message.edit_text(serial_exists_text(data["new_serial"]))
+        await state.set_state(EditSerialsStates.edit_serial)
+        return
+    await callback.message.edit_text("Серийный номер успешно изменен!")
+    await state.clear()
+
+
+@router.callback_query(
+    EditSerialsStates.replace_or_fix, SerialEditCallback.filter(F.action == "replaced")
+)
+async def ask_replace_values(callback: CallbackQuery, state: FSMContext):
+    await callback.answer()
+    data = await state.get_data()
+    await callback.message.edit_text(
+        f"Введите через пробел последнее показание счетчика {data['selected_serial']} "
+        f"и начальное показание счетчика {data['new_serial']}:"
+    )
+    await state.set_state(EditSerialsStates.replace_values)
+
+
+@router.message(EditSerialsStates.replace_values)
+async def process_replace_values(
+    message: Message,
+    state: FSMContext,
+    session: AsyncSession,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
+):
+    """Замена счетчика: расход месяца делится между старым и новым по этим показаниям"""
+    values = (message.text or "").split()
+    if len(values) != 2 or not all(value.isdigit() for value in values):
+        await message.answer("Введите два целых числа через пробел, например: 1250 0")
+        return
+    end_value, start_value = map(int, values)
+    data = await state.get_data()
+
+    db = Database(session, building_id)
+    replaced = await db.replace_serial(
+        data["selected_serial"],
+        data["new_serial"],
+        message.from_user.id,
+        end_value=end_value,
+        start_value=start_value,
+    )
+    if replaced:
+        await message.answer(
+            f"Счетчик {data['selected_serial']} заменён на {data['new_serial']}. "
+            "Показания старого счетчика сохранены в истории."
+        )
+    else:
+        await message.answer(
+            f"Не удалось заменить счетчик {data['selected_serial']}: он не найден "
+            f"или номер {data['new_serial']} уже есть. Начните заново: /edit_serials"
+        )
+    await state.clear()
+
+
 @router.callback_query(F.data == "finish_submit")
 async def finish_submit(callback: CallbackQuery, state: FSMContext):
-    # Очищаем состояние
+    await callback.answer()
     logger.info("Информация из состояния: %s", await state.get_data())
     await state.clear()
-    logger.info("Информация из состояния после очистки: %s", await state.get_data())
-    await callback.message.answer(
-        "Ввод показаний завершен.\n Для начала нового ввода используйте /submit"
+    # Сообщение статуса становится итогом, клавиатура убирается
+    await callback.message.edit_text(
+        "Ввод показаний завершен.\nДля начала нового ввода используйте /submit"
     )
+
+
+@router.message(Command("history"))
+async def show_history(
+    message: Message,
+    command: CommandObject,
+    session: AsyncSession,
+    building_id: int = settings.DEFAULT_BUILDING_ID,
+):
+    """Расход по счетчикам квартиры за последние месяцы: /history [chart]"""
+    db = Database(session, building_id)
+    user = await db.get_info_for_user(message.from_user.id)
+    if not user:
+        await message.answer("Сначала зарегистрируйтесь через /start")
+        return
+
+    rows = await db.get_consumption_history(user["apartment_number"])
+    if not rows:
+        await message.answer("Показаний за последний год нет")
+        return
+    months = history_months(settings.HISTORY_MONTHS, get_period()[1])
+    history = group_history(rows, months)
+
+    if (command.args or "").strip().lower() == "chart":
+        chart = await build_chart(history, months)
+        if chart:
+            await message.answer_photo(
+                BufferedInputFile(chart, "history.png"),
+                caption=f"Расход за {months[0]:%m.%Y} – {months[-1]:%m.%Y}",
+            )
+            return
+        await message.answer("График недоступен, показываю таблицу")
+    await message.answer(format_history(history, months))
@@ -0,0 +1,46 @@
+"""
+Данные кнопок inline-клавиатур.
+
+В callback_data кладутся только короткие идентификаторы (не длиннее 64 байт
+по ограничению Telegram): номер дома, serial_id, user_id. Всё, что нужно
+показать пользователю (серийный номер, имя), хранится на сервере в
+ограниченном кэше callback_cache и при промахе заново читается из БД.
+"""
+from aiogram.filters.callback_data import CallbackData
+
+from config import settings
+from utils.cache import LRUCache
+
+
+class BuildingCallback(CallbackData, prefix="b"):
+    """Выбор дома при регистрации"""
+
+    building_id: int
+
+
+class MeterTypeCallback(CallbackData, prefix="mt"):
+    """Выбор типа счетчика при подаче показаний"""
+
+    meter_type: str
+
+
+class SerialCallback(CallbackData, prefix="s"):
+    """Выбор счетчика для изменения серийного номера"""
+
+    serial_id: int
+
+
+class SerialEditCallback(CallbackData, prefix="se"):
+    """Новый серийный номер: счетчик заменён (replaced) или опечатка (typo)"""
+
+    action: str
+
+
+class UserCallback(CallbackData, prefix="u"):
+    """Выбор жильца для удаления"""
+
+    user_id: int
+
+
+# Данные кнопок: ("serial", serial_id) -> серийный номер, ("user", user_id) -> имя
+callback_cache = LRUCache(settings.CALLBACK_CACHE_SIZE)
@@ -2,23 +2,28 @@ from datetime import datetime
 import locale
 from dateutil.relativedelta import relativedelta
 from config import settings
+from kbds.callback_data import MeterTypeCallback
 
 
 def get_period() -> tuple[str, datetime]:
         # Установка локали (для русского языка)
-        locale.setlocale(locale.LC_TIME, 'ru_RU.UTF-8')
+        try:
+                locale.setlocale(locale.LC_TIME, 'ru_RU.UTF-8')
+        except locale.Error:
+                # Локаль не установлена в системе: название месяца в текущей локали
+                pass
         period_date = datetime.now() - relativedelta(months=settings.DELTA_MONTH)
         month_name = period_date.strftime('%B')
         return month_name, period_date
 
 def get_text_for_keyboard(
-        meter_types: list,         
+        meter_types: dict[str, list[str]],
+        submitted: list,
 ) -> dict:
+        """Кнопки типов счетчиков: meter_types - {тип: [название на кнопке, ...]}"""
         btn: dict[str, str] = {
-        f"{"✅" if "hot_water" in meter_types else "❌"}Горячая вода": "type_hot_water", 
-        f"{"✅" if "cold_water" in meter_types else "❌"}Холодная вода": "type_cold_water", 
-        f"{"✅" if "electricity" in meter_types else "❌"}Электричество": "type_electricity", 
-        f"{"✅" if "heat" in meter_types else "❌"}Тепло": "type_heat",
-        "Завершить": "finish_submit"
+                f"{"✅" if meter_type in submitted else "❌"}{names[0]}": MeterTypeCallback(meter_type=meter_type).pack()
+                for meter_type, names in meter_types.items()
         }
+        btn["Завершить"] = "finish_submit"
         return btn
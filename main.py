@@ -14,7 +14,15 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 
 from database.engine import create_db, drop_db
+from utils.archive_utils import archive_loop
+from utils.backup_utils import backup_loop
+from utils.bot_session import create_bot_session
+from utils.report_utils import report_loop
+from utils.job_queue import job_queue
 from middlewere.db_middleware import DbSessionMiddleware
+from middlewere.idempotency_middleware import IdempotencyMiddleware
+from middlewere.throttling_middleware import ThrottlingMiddleware
+from middlewere.concurrency_middleware import ConcurrencyMiddleware
 from middlewere.error_middleware import GlobalErrorMiddleware
 from config import settings
 from handlers.user_handlers import router as user_routers
@@ -41,19 +49,41 @@ file_handler.setLevel(ERROR)
 basicConfig(level=ERROR, format=FORMAT, handlers=[stream_handler, file_handler])
 
 default = DefaultBotProperties(parse_mode=ParseMode.HTML)
-bot = Bot(token=settings.BOT_TOKEN, default=default)
+bot = Bot(token=settings.BOT_TOKEN, session=create_bot_session(), default=default)
 dp = Dispatcher()
 
+# Дубликаты и антифлуд раньше сессии БД: отброшенные обновления не открывают сессию
+idempotency = IdempotencyMiddleware()
+dp.update.middleware(idempotency)
+dp.update.middleware(ThrottlingMiddleware())
+dp.update.middleware(ConcurrencyMiddleware())
+dp.update.middleware(DbSessionMiddleware())
+dp.update.middleware(GlobalErrorMiddleware())
+
 dp.include_router(user_routers)
 dp.include_router(admin_routers)
 
 
-async def on_startup(bot):
+background_tasks: set[asyncio.Task] = set()
+
+
+async def prepare_db():
     # await drop_db()
     await create_db()
 
 
+async def on_startup(bot):
+    background_tasks.add(asyncio.create_task(archive_loop()))
+    background_tasks.add(asyncio.create_task(backup_loop()))
+    background_tasks.add(asyncio.create_task(report_loop(bot)))
+    job_queue.start()
+
+
 async def on_shutdown(bot):
+    for task in background_tasks:
+        task.cancel()
+    await job_queue.stop()
+    await idempotency.close()
     print("бот лег")
 
 
@@ -61,16 +91,27 @@ async def main():
     dp.startup.register(on_startup)  # запускается при старте бота
     dp.shutdown.register(on_shutdown)  # запускается при остановке бота
 
-    dp.update.middleware(DbSessionMiddleware())
-    dp.update.middleware(GlobalErrorMiddleware())
-
-    await bot.delete_webhook(drop_pending_updates=True)
+    # Запросы к Telegram, подготовка базы данных и чтение обработанных
+    # обновлений не зависят друг от друга и идут одновременно: старт ждёт
+    # самый долгий из них, а не их сумму.
+    # Обновления, пришедшие во время простоя, обрабатываются: уже обработанные
+    # до перезапуска отбросит IdempotencyMiddleware
     # await bot.delete_my_commands(scope=types.BotCommandScopeAllPrivateChats())
-    await bot.set_my_commands(
-        commands=privat, scope=types.BotCommandScopeAllPrivateChats()
+    await asyncio.gather(
+        bot.delete_webhook(drop_pending_updates=settings.DROP_PENDING_UPDATES),
+        bot.set_my_commands(
+            commands=privat, scope=types.BotCommandScopeAllPrivateChats()
+        ),
+        prepare_db(),
+        asyncio.to_thread(idempotency.load),
     )
+    # Каждое обновление - отдельная задача; параллельность ограничивает
+    # ConcurrencyMiddleware, порядок обновлений пользователя - ThrottlingMiddleware
     await dp.start_polling(
-        bot, polling_timeout=3, allowed_updates=dp.resolve_used_update_types()
+        bot,
+        polling_timeout=3,
+        handle_as_tasks=True,
+        allowed_updates=dp.resolve_used_update_types(),
     )
 
 
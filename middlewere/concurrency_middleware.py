@@ -0,0 +1,43 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from config import settings
+from utils.metrics import QueueMetrics
+
+update_metrics = QueueMetrics("Обновления")
+
+
+class ConcurrencyMiddleware(BaseMiddleware):
+    """
+    Ограничивает число одновременно обрабатываемых обновлений.
+
+    Polling запускает каждое обновление отдельной задачей, middleware пускает
+    к базе данных не больше MAX_CONCURRENT_UPDATES из них. Регистрируется после
+    ThrottlingMiddleware: обновления, ждущие очереди своего пользователя,
+    не занимают слоты. Глубина очереди и время ожидания - в metrics.
+    """
+
+    def __init__(self, limit: int | None = None, metrics: QueueMetrics = update_metrics):
+        self.semaphore = asyncio.Semaphore(
+            settings.MAX_CONCURRENT_UPDATES if limit is None else limit
+        )
+        self.metrics = metrics
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        self.metrics.enqueued()
+        queued_at = time.perf_counter()
+        async with self.semaphore:
+            self.metrics.started(time.perf_counter() - queued_at)
+            try:
+                return await handler(event, data)
+            finally:
+                self.metrics.done()
@@ -1,12 +1,72 @@
+import math
+import time
+from logging import Logger, getLogger
 from typing import Any, Awaitable, Callable
 from aiogram import BaseMiddleware
-from aiogram.types import TelegramObject
+from aiogram.fsm.context import FSMContext
+from aiogram.types import TelegramObject, User
+from config import settings
+from database import queries
+from database.database import user_building_cache
+from database.engine import get_session_maker
+
+logger: Logger = getLogger(__name__)
 
-from database.engine import session_maker
 
 class DbSessionMiddleware(BaseMiddleware):
-    def __init__(self):
-        self.session_pool = session_maker
+    """
+    Открывает сессию в базе данных дома, к которому относится пользователь.
+
+    Дом определяется так:
+        1. если бот обслуживает один дом - всегда он;
+        2. по данным FSM (дом выбран при регистрации или админом);
+        3. по кэшу user_building_cache;
+        4. по таблице users в базах данных домов. Найденный дом кэшируется до
+           удаления пользователя, отсутствие пользователя во всех базах -
+           на USER_BUILDING_MISS_SECONDS секунд.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+
+    async def _find_building(self, user_id: int) -> int | None:
+        """Ищет дом пользователя в таблицах users всех баз данных"""
+        checked: set[str] = set()
+        for building_id in settings.BUILDINGS:
+            url = settings.db_url_for(building_id)
+            if url in checked:
+                continue
+            checked.add(url)
+            async with get_session_maker(building_id)() as session:
+                result = await session.execute(
+                    queries.select_user_building, {"user_id": user_id}
+                )
+                found = result.scalar()
+            if found is not None:
+                return found
+        return None
+
+    async def resolve_building(self, user: User | None, data: dict[str, Any]) -> int:
+        """Определяет дом, с которым работает пользователь"""
+        if len(settings.BUILDINGS) == 1 or user is None:
+            return settings.DEFAULT_BUILDING_ID
+        state: FSMContext | None = data.get("state")
+        if state is not None:
+            building_id = (await state.get_data()).get("building_id")
+            if building_id in settings.BUILDINGS:
+                return building_id
+
+        cached = user_building_cache.get(user.id)
+        if cached is not None and cached[1] > self.clock():
+            return settings.DEFAULT_BUILDING_ID if cached[0] is None else cached[0]
+
+        building_id = await self._find_building(user.id)
+        if building_id is None:
+            user_building_cache.put(user.id, (None, self.clock() + settings.USER_BUILDING_MISS_SECONDS))
+            return settings.DEFAULT_BUILDING_ID
+        logger.info("Пользователь %s относится к дому %s", user.id, building_id)
+        user_building_cache.put(user.id, (building_id, math.inf))
+        return building_id
 
     async def __call__(
         self,
@@ -14,6 +74,8 @@ class DbSessionMiddleware(BaseMiddleware):
         event: TelegramObject,
         data: dict[str, Any],
     ) -> Any:
-        async with self.session_pool() as session:
+        building_id = await self.resolve_building(data.get("event_from_user"), data)
+        data["building_id"] = building_id
+        async with get_session_maker(building_id)() as session:
             data["session"] = session
             return await handler(event, data)
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import time
+from collections import Counter, OrderedDict
+from logging import Logger, getLogger
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Hashable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from config import settings
+
+logger: Logger = getLogger(__name__)
+
+
+class IdempotencyMiddleware(BaseMiddleware):
+    """
+    Отбрасывает повторно доставленные обновления и повторные нажатия кнопок.
+
+    Обновление с уже встречавшимся update_id (повтор после сетевой ошибки или
+    перезапуска) не обрабатывается. Нажатие кнопки с тем же
+    (пользователь, сообщение, данные кнопки), что и менее callback_ttl секунд
+    назад, - двойное нажатие: на него только снимается индикатор загрузки.
+    Ключ запоминается до обработки, поэтому отбрасываются и дубликаты, пришедшие
+    во время обработки первого. Помнятся window последних update_id; если задан
+    path, они сохраняются в файл каждые save_every обновлений и при остановке
+    (close) и загружаются при старте - так накопившиеся за время простоя
+    обновления можно обработать, не повторяя уже обработанные. Файл пишется
+    фоновой задачей: обновление передаётся дальше сразу, и порядок обновлений
+    пользователя в ThrottlingMiddleware не нарушается.
+
+    Регистрируется первым, до ThrottlingMiddleware и DbSessionMiddleware:
+    дубликаты не тратят токены пользователя и не открывают сессию БД.
+    Счётчики в stats: passed, duplicate_updates, duplicate_callbacks.
+    """
+
+    def __init__(
+        self,
+        window: int | None = None,
+        callback_ttl: float | None = None,
+        path: Path | None = settings.DEDUP_FILE,
+        save_every: int | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.window = settings.DEDUP_WINDOW if window is None else window
+        self.callback_ttl = settings.DEDUP_CALLBACK_SECONDS if callback_ttl is None else callback_ttl
+        self.path = path
+        self.save_every = settings.DEDUP_SAVE_EVERY if save_every is None else save_every
+        self.clock = clock
+        self.seen_updates: OrderedDict[int, None] = OrderedDict()
+        # (пользователь, чат, сообщение, данные кнопки) -> время нажатия
+        self.seen_callbacks: OrderedDict[Hashable, float] = OrderedDict()
+        self.stats: Counter[str] = Counter()
+        self._unsaved = 0
+        # Фоновые записи файла: не больше одной, close() дожидается их
+        self._saves: set[asyncio.Task] = set()
+
+    def seen_update(self, update_id: int) -> bool:
+        """Запоминает update_id, True - он уже встречался"""
+        if update_id in self.seen_updates:
+            return True
+        self.seen_updates[update_id] = None
+        if len(self.seen_updates) > self.window:
+            self.seen_updates.popitem(last=False)
+        self._unsaved += 1
+        return False
+
+    def seen_callback(self, key: Hashable) -> bool:
+        """Запоминает нажатие кнопки, True - такое же было менее callback_ttl секунд назад"""
+        now = self.clock()
+        # Ключи добавляются по времени: устаревшие всегда в начале
+        while self.seen_callbacks and next(iter(self.seen_callbacks.values())) <= now - self.callback_ttl:
+            self.seen_callbacks.popitem(last=False)
+        if key in self.seen_callbacks:
+            return True
+        self.seen_callbacks[key] = now
+        if len(self.seen_callbacks) > self.window:
+            self.seen_callbacks.popitem(last=False)
+        return False
+
+    def load(self) -> None:
+        """Загружает update_id, обработанные до перезапуска"""
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            update_ids = json.loads(self.path.read_text())
+        except (OSError, ValueError) as e:
+            logger.error("Не удалось прочитать обработанные обновления %s: %s", self.path, e)
+            return
+        for update_id in update_ids[-self.window:]:
+            self.seen_updates[update_id] = None
+        self._unsaved = 0
+        logger.info("Загружено обработанных обновлений: %s", len(self.seen_updates))
+
+    def save(self) -> None:
+        """Сохраняет окно update_id"""
+        if self.path is None:
+            return
+        self._unsaved = 0
+        self._write(list(self.seen_updates))
+
+    def _write(self, update_ids: list[int]) -> None:
+        """Запись во временный файл и замена: файл не остаётся недописанным"""
+        tmp_path = self.path.with_suffix(".tmp")
+        try:
+            tmp_path.write_text(json.dumps(update_ids))
+            tmp_path.replace(self.path)
+        except OSError as e:
+            logger.error("Не удалось сохранить обработанные обновления %s: %s", self.path, e)
+
+    def _save_in_background(self) -> None:
+        """Снимок окна берётся в цикле событий, файл пишется в потоке"""
+        self._unsaved = 0
+        task = asyncio.create_task(asyncio.to_thread(self._write, list(self.seen_updates)))
+        self._saves.add(task)
+        task.add_done_callback(self._saves.discard)
+
+    async def close(self) -> None:
+        """Дожидается фоновых записей и сохраняет окно при остановке"""
+        await asyncio.gather(*self._saves)
+        self.save()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, Update):
+            return await handler(event, data)
+
+        if self.seen_update(event.update_id):
+            self.stats["duplicate_updates"] += 1
+            logger.info("Обновление %s уже обработано", event.update_id)
+            return None
+
+        callback = event.callback_query
+        if callback is not None:
+            message = callback.message
+            key = (
+                callback.from_user.id,
+                message.chat.id if message else callback.inline_message_id,
+                message.message_id if message else None,
+                callback.data,
+            )
+            if self.seen_callback(key):
+                self.stats["duplicate_callbacks"] += 1
+                await callback.answer()
+                return None
+
+        if self.path is not None and self._unsaved >= self.save_every and not self._saves:
+            self._save_in_background()
+        self.stats["passed"] += 1
+        return await handler(event, data)
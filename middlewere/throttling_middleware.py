@@ -0,0 +1,109 @@
+import asyncio
+import time
+from collections import Counter
+from logging import Logger, getLogger
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject, Update, User
+
+from config import settings
+
+logger: Logger = getLogger(__name__)
+
+THROTTLED_TEXT = "Слишком много запросов, подождите немного"
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Ограничивает частоту обновлений от пользователя и обрабатывает их по очереди.
+
+    Частота ограничивается ведром токенов: у пользователя до burst токенов,
+    они пополняются со скоростью rate в секунду, каждое обновление забирает
+    один токен. Обновление без токена отбрасывается до открытия сессии БД,
+    пользователь предупреждается один раз. Обновления одного пользователя
+    выполняются под его замком (нет гонок за данные FSM), обновления разных
+    пользователей - параллельно.
+
+    Регистрируется до DbSessionMiddleware. Счётчики в stats:
+    passed - обработано, dropped - отброшено, delayed - ждали замок.
+    """
+
+    def __init__(
+        self,
+        rate: float | None = None,
+        burst: int | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = settings.THROTTLE_RATE if rate is None else rate
+        self.burst = settings.THROTTLE_BURST if burst is None else burst
+        self.clock = clock
+        # user_id -> (токены, время последнего пополнения)
+        self.buckets: dict[int, tuple[float, float]] = {}
+        # user_id -> [замок, число обновлений, ждущих или держащих замок]
+        self.locks: dict[int, list] = {}
+        self.warned: set[int] = set()
+        self.stats: Counter[str] = Counter()
+        self._prune_at = 1024
+
+    def allow(self, user_id: int) -> bool:
+        """Забирает токен пользователя, если он есть"""
+        now = self.clock()
+        tokens, last = self.buckets.get(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        allowed = tokens >= 1
+        self.buckets[user_id] = (tokens - 1 if allowed else tokens, now)
+        if len(self.buckets) >= self._prune_at:
+            self._prune(now)
+        return allowed
+
+    def _prune(self, now: float) -> None:
+        """Удаляет полностью пополненные вёдра - они равны отсутствующим"""
+        full_after = self.burst / self.rate if self.rate > 0 else float("inf")
+        self.buckets = {
+            user_id: (tokens, last)
+            for user_id, (tokens, last) in self.buckets.items()
+            if now - last < full_after
+        }
+        self.warned &= self.buckets.keys()
+        self._prune_at = max(1024, 2 * len(self.buckets))
+
+    async def _notify(self, event: TelegramObject) -> None:
+        """Предупреждает пользователя о том, что обновление отброшено"""
+        if isinstance(event, Update):
+            event = event.event
+        # Для кнопки это всплывающее уведомление, для сообщения - ответ в чат
+        if isinstance(event, (Message, CallbackQuery)):
+            await event.answer(THROTTLED_TEXT)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        user: User | None = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        if not self.allow(user.id):
+            self.stats["dropped"] += 1
+            if user.id not in self.warned:
+                self.warned.add(user.id)
+                logger.info("Пользователь %s превысил частоту запросов", user.id)
+                await self._notify(event)
+            return None
+        self.warned.discard(user.id)
+
+        entry = self.locks.setdefault(user.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            if entry[0].locked():
+                self.stats["delayed"] += 1
+            async with entry[0]:
+                self.stats["passed"] += 1
+                return await handler(event, data)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.locks[user.id]
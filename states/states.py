@@ -1,21 +1,13 @@
 from aiogram.fsm.state import StatesGroup, State
 
 class UserRegistration(StatesGroup):
+    building = State()
     apartment_number = State()
-    hot_water_count = State()
-    cold_water_count = State()
-    electricity_count = State()
-    heat_count = State()
+    meter_count = State()  # Количество счетчиков текущего типа (шаги - строки meter_types)
 
 class MeterRegistration(StatesGroup):
-    hot_water_serials = State()
-    hot_water_descriptions = State()
-    cold_water_serials = State()
-    cold_water_descriptions = State()
-    electricity_serials = State()
-    electricity_descriptions = State()
-    heat_serials = State()
-    heat_descriptions = State()
+    serials = State()       # Серийные номера счетчиков текущего типа
+    descriptions = State()  # Описание очередного счетчика
 
 class MeterSubmission(StatesGroup):
     value = State()       # Значение показаний
@@ -23,8 +15,14 @@ class MeterSubmission(StatesGroup):
 class EditSerialsStates(StatesGroup):
     select_meter = State()  # Выбор счетчика для редактирования
     edit_serial = State()   # Ввод нового серийного номера
+    replace_or_fix = State()  # Счётчик заменён или исправляется опечатка
+    replace_values = State()  # Показания при снятии старого и установке нового
 
 class DeleteUserState(StatesGroup):
     apartment_number = State()
     user_for_delete = State()
     confirm_delete = State()
+
+class ImportState(StatesGroup):
+    meters = State()    # Ожидание файла со счетчиками квартир
+    readings = State()  # Ожидание файла с историей показаний
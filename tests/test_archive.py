@@ -0,0 +1,58 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert, select
+
+from database.database import Database
+from database.models import readings, serials
+from tests.test_database import apartment_info
+from utils.archive_utils import archive_readings, read_archive
+
+
+async def add_history(session, serial_number: str, rows: list[tuple[datetime, int]]):
+    serial = (
+        await session.execute(
+            select(serials.c.serial_id, serials.c.meter_id).where(
+                serials.c.serial_number == serial_number
+            )
+        )
+    ).one()
+    await session.execute(
+        insert(readings),
+        [
+            {
+                "building_id": 1,
+                "meter_id": serial.meter_id,
+                "serial_id": serial.serial_id,
+                "user_id": 100,
+                "value": value,
+                "reading_date": reading_date,
+            }
+            for reading_date, value in rows
+        ],
+    )
+    await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_archive_keeps_last_reading(session, tmp_path):
+    db = Database(session)
+    await db.add_info_apartment(apartment_info(100, 7, "a7"))
+    hot_water = [(datetime(2020, month, 1), month * 10) for month in range(1, 13)]
+    await add_history(session, "a7-hw", hot_water + [(datetime(2021, 1, 1), 200)])
+    await add_history(session, "a7-el", [(datetime(2020, 5, 1), 1000)])
+
+    archived = await archive_readings(db, before=datetime(2021, 6, 1), archive_dir=tmp_path)
+
+    # Последние показания каждого счётчика остаются в БД
+    assert archived == 12
+    remaining = (await session.execute(select(readings.c.value).order_by(readings.c.value))).scalars().all()
+    assert remaining == [200, 1000]
+    assert (await db.get_previous_reading("hot_water", "a7-hw"))["value"] == 200
+
+    history = await read_archive(1, "a7-hw", archive_dir=tmp_path)
+    assert [int(row["value"]) for row in history] == [value for _, value in hot_water]
+    assert await read_archive(1, "a7-el", archive_dir=tmp_path) == []
+
+    # Повторный запуск ничего не переносит
+    assert await archive_readings(db, before=datetime(2021, 6, 1), archive_dir=tmp_path) == 0
@@ -0,0 +1,106 @@
+import gzip
+import sqlite3
+import threading
+from contextlib import closing
+
+import pytest
+from sqlalchemy import create_engine
+
+from config import settings
+from database.models import metadata
+from utils import backup_utils
+from utils.backup_utils import restore_snapshot, snapshot_file, verify_snapshot
+
+
+@pytest.fixture
+def database_file(tmp_path):
+    path = tmp_path / "meters.db"
+    engine = create_engine(f"sqlite:///{path}")
+    metadata.create_all(engine)
+    engine.dispose()
+    with closing(sqlite3.connect(path)) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executemany(
+            "INSERT INTO meter_types (name, unit) VALUES (?, ?)",
+            [(f"type-{i}", "m3") for i in range(5000)],
+        )
+        conn.commit()
+    return path
+
+
+def test_snapshot_verify_and_restore(database_file, tmp_path):
+    snapshot = snapshot_file(database_file, tmp_path / "backups")
+
+    assert snapshot.name.startswith("meters_") and snapshot.suffixes[-2:] == [".db", ".gz"]
+    assert verify_snapshot(snapshot)["meter_types"] == 5000
+
+    restored = tmp_path / "restored.db"
+    restore_snapshot(snapshot, restored)
+    with closing(sqlite3.connect(restored)) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM meter_types").fetchone()[0] == 5000
+    with pytest.raises(FileExistsError):
+        restore_snapshot(snapshot, restored)
+
+
+def test_old_snapshots_rotated(database_file, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "BACKUP_KEEP", 2)
+    snapshots = [snapshot_file(database_file, tmp_path / "backups") for _ in range(3)]
+
+    assert sorted((tmp_path / "backups").glob("*.db.gz")) == snapshots[1:]
+
+
+def test_broken_snapshot_rejected(tmp_path):
+    snapshot = tmp_path / "broken.db.gz"
+    snapshot.write_bytes(gzip.compress(b"not a database" * 100))
+
+    with pytest.raises(ValueError):
+        verify_snapshot(snapshot)
+
+
+# Копирование пачками страниц не мешает записи и даёт целостный снимок
+def test_snapshot_while_writing(database_file, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "BACKUP_PAGES_PER_STEP", 1)
+    monkeypatch.setattr(settings, "BACKUP_STEP_SLEEP", 0)
+    stop = threading.Event()
+    written = []
+
+    def writer():
+        with closing(sqlite3.connect(database_file, timeout=1)) as conn:
+            while not stop.is_set():
+                conn.execute("INSERT INTO meter_types (name, unit) VALUES ('w', 'm3')")
+                conn.commit()
+                written.append(1)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        snapshot = snapshot_file(database_file, tmp_path / "backups")
+    finally:
+        stop.set()
+        thread.join()
+
+    assert written
+    assert verify_snapshot(snapshot)["meter_types"] >= 5000
+
+
+# Между пачками страниц копирование делает паузу; если каждая пауза
+# заканчивается записью в базу, копирование перезапускается и после
+# BACKUP_MAX_RESTARTS перезапусков идёт за один шаг
+def test_backup_pauses_and_stops_restarting(database_file, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "BACKUP_PAGES_PER_STEP", 5)
+    monkeypatch.setattr(settings, "BACKUP_MAX_RESTARTS", 2)
+    pauses = []
+
+    def write_during_pause(seconds):
+        pauses.append(seconds)
+        with closing(sqlite3.connect(database_file)) as conn:
+            conn.execute("INSERT INTO meter_types (name, unit) VALUES ('w', 'm3')")
+            conn.commit()
+
+    monkeypatch.setattr(backup_utils.time, "sleep", write_during_pause)
+    copy = tmp_path / "copy.db"
+
+    assert backup_utils._copy_online(database_file, copy) == 3
+    assert len(pauses) == 3 and set(pauses) == {settings.BACKUP_STEP_SLEEP}
+    with closing(sqlite3.connect(copy)) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM meter_types").fetchone()[0] == 5003
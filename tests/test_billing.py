@@ -0,0 +1,129 @@
+from datetime import date, datetime
+from decimal import Decimal
+from pathlib import Path
+
+import openpyxl
+import pytest
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import insert
+
+from config import settings
+from database.database import Database
+from database.models import DEFAULT_METER_TYPES, meter_types, readings
+from tests.test_export import add_apartments
+from utils.billing_utils import build_invoices, compute_invoices, format_tariffs, parse_tariff, tier_charges
+from utils.export_utils import export_invoices_file, export_readings_file
+
+
+def current_period() -> datetime:
+    period = date.today() - relativedelta(months=settings.DELTA_MONTH)
+    return datetime(period.year, period.month, 1)
+
+
+def tariff(zone: str = "", share: float = 1.0, tier_from: float = 0.0, price: float = 5.0) -> dict:
+    return {
+        "type_id": 1, "meter_type": "electricity", "label": "Электричество", "zone": zone,
+        "zone_share": share, "tier_from": tier_from, "price": price,
+    }
+
+
+# Ступенчатый тариф с дневной и ночной зонами
+def test_build_invoices_tiers_and_zones():
+    assert tier_charges(150, [(0, 5.0), (100, 7.0)]) == [(0, 100, 5.0), (100, 50, 7.0)]
+    assert tier_charges(80, [(0, 5.0), (100, 7.0)]) == [(0, 80, 5.0)]
+
+    consumption = [
+        {"apartment_number": 2, "type_id": 1, "meter_type": "electricity", "label": "Электричество", "unit": "kWh", "consumption": 150},
+        {"apartment_number": 1, "type_id": 1, "meter_type": "electricity", "label": "Электричество", "unit": "kWh", "consumption": 10},
+        # Первое показание счетчика и тип без тарифа не начисляются
+        {"apartment_number": 3, "type_id": 1, "meter_type": "electricity", "label": "Электричество", "unit": "kWh", "consumption": None},
+        {"apartment_number": 1, "type_id": 3, "meter_type": "hot_water", "label": "Горячая вода", "unit": "m3", "consumption": 4},
+    ]
+    tariffs = [
+        tariff("day", 0.7, 0, 5.0),
+        tariff("day", 0.7, 100, 7.15),
+        tariff("night", 0.3, 0, 2.5),
+    ]
+
+    invoices = build_invoices(consumption, tariffs)
+
+    assert [invoice.apartment_number for invoice in invoices] == [1, 2]
+    assert [(line.service, line.consumption, line.amount) for line in invoices[1].lines] == [
+        ("Электричество, день", 100, Decimal("500.00")),
+        ("Электричество, день, свыше 100 kWh", 5, Decimal("35.75")),
+        ("Электричество, ночь", 45, Decimal("112.50")),
+    ]
+    assert invoices[1].total == Decimal("648.25")
+    assert invoices[0].total == Decimal("42.50")
+
+
+def test_parse_tariff():
+    names = [meter_type["name"] for meter_type in DEFAULT_METER_TYPES]
+    parsed = parse_tariff("electricity 6,5 from=01.01.2026 zone=night share=0.3 tier=100", names)
+    assert parsed == {
+        "meter_type": "electricity", "price": 6.5, "valid_from": datetime(2026, 1, 1),
+        "zone": "night", "zone_share": 0.3, "tier_from": 100.0,
+    }
+    assert parse_tariff("heat 2000", names)["valid_from"] == current_period()
+    for text in ("gas 5", "heat abc", "heat 5 share=2", "heat 5 color=red", "heat"):
+        with pytest.raises(ValueError):
+            parse_tariff(text, names)
+    # Тип, добавленный строкой meter_types, принимается
+    assert parse_tariff("gas 5", [*names, "gas"])["meter_type"] == "gas"
+
+
+# Новый тариф закрывает прежний, счета попадают в выгрузку xlsx и в отдельный файл
+@pytest.mark.asyncio
+async def test_invoices_from_readings(session, tmp_path: Path):
+    db = Database(session, building_id=1)
+    await add_apartments(db, 3)
+    period = current_period()
+    # Показания прошлого месяца: расход каждой квартиры - 4 m3
+    await session.execute(
+        insert(readings),
+        [
+            {
+                "building_id": 1, "meter_id": apartment, "user_id": apartment, "serial_id": apartment,
+                "value": apartment * 10 - 4, "reading_date": period - relativedelta(months=1),
+            }
+            for apartment in (1, 2)
+        ],
+    )
+    await session.commit()
+
+    assert await compute_invoices(db) == []
+    assert await db.add_tariff("hot_water", 200.0, period - relativedelta(months=2))
+    assert await db.add_tariff("hot_water", 250.0, period)
+    assert not await db.add_tariff("gas", 1.0, period)
+    # Тариф нового типа подписывается его названием из meter_types
+    await session.execute(insert(meter_types).values(name="gas", unit="m3", label="Газ"))
+    await session.commit()
+    assert await db.add_tariff("gas", 1.0, period)
+
+    previous = await db.get_tariffs(period - relativedelta(months=1))
+    assert [row["price"] for row in previous] == [200.0]
+    current = await db.get_tariffs(period)
+    assert [row["price"] for row in current] == [250.0, 1.0]
+    assert format_tariffs(current).splitlines()[1] == f"Газ: 1 руб. с {period:%d.%m.%Y}"
+
+    consumption = await db.get_period_consumption(period)
+    assert [(row["apartment_number"], row["consumption"]) for row in consumption] == [
+        (1, 4), (2, 4), (3, None)
+    ]
+    invoices = await compute_invoices(db)
+    assert [(invoice.apartment_number, invoice.total) for invoice in invoices] == [
+        (1, Decimal("1000.00")), (2, Decimal("1000.00"))
+    ]
+
+    path, _ = await export_readings_file(db, tmp_path, "xlsx")
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    assert workbook.sheetnames == ["Показания счетчиков", "Начисления"]
+    rows = list(workbook["Начисления"].values)
+    assert rows[1] == (1, "Горячая вода", 4, 250, 1000)
+    assert rows[2] == (1, "Итого", None, None, 1000)
+
+    path, count = await export_invoices_file(db, tmp_path, "csv")
+    assert count == 2
+    lines = path.read_text(encoding="utf-8-sig").splitlines()
+    assert lines[0] == "Квартира;Услуга;Расход;Тариф;Сумма"
+    assert lines[-1] == "2;Итого;;;1000.00"
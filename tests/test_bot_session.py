@@ -0,0 +1,93 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+import pytest_asyncio
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError
+from aiogram.types import BufferedInputFile
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from config import settings
+from utils.bot_session import api_metrics, create_bot_session
+
+TOKEN = "42:TEST"
+
+
+def message(chat_id: int, **fields) -> dict:
+    return {
+        "message_id": 1,
+        "date": int(datetime.now().timestamp()),
+        "chat": {"id": chat_id, "type": "private"},
+        **fields,
+    }
+
+
+@pytest_asyncio.fixture(loop_scope="function")
+async def bot_api():
+    """Локальный сервер Bot API: отвечает как Telegram и записывает вызовы"""
+    calls: list[tuple[str, int]] = []
+
+    async def handle(request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        calls.append((method, request.transport.get_extra_info("peername")[1]))
+        form = await request.post()
+        chat_id = int(form["chat_id"])
+        if method == "sendMessage" and chat_id == 403:
+            return web.json_response(
+                {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"},
+                status=403,
+            )
+        if method == "sendMessage" and chat_id == 408:
+            await asyncio.sleep(2)
+        if method == "sendDocument":
+            # Файл приходит отдельным полем, в document - ссылка attach://
+            upload = next(value for value in form.values() if isinstance(value, web.FileField))
+            document = {"file_id": "F1", "file_unique_id": "U1", "file_name": upload.filename}
+            return web.json_response({"ok": True, "result": message(chat_id, document=document)})
+        return web.json_response({"ok": True, "result": message(chat_id, text=form.get("text"))})
+
+    app = web.Application()
+    app.router.add_post(f"/bot{TOKEN}/{{method}}", handle)
+    server = TestServer(app)
+    await server.start_server()
+    yield str(server.make_url("")).rstrip("/"), calls
+    await server.close()
+
+
+# Сообщения и файлы идут через разные пулы соединений, таймаут метода
+# и ошибки API попадают в метрики
+@pytest.mark.asyncio
+async def test_bot_session_against_fake_api(bot_api, monkeypatch):
+    url, calls = bot_api
+    monkeypatch.setitem(settings.BOT_METHOD_TIMEOUTS, "sendMessage", 0.5)
+    monkeypatch.setattr(settings, "BOT_CONNECTION_LIMIT", 7)
+    api_metrics.methods.clear()
+    api_metrics.errors.clear()
+    session = create_bot_session(url)
+    bot = Bot(TOKEN, session=session)
+    try:
+        sent = await bot.send_message(1, "Показания приняты")
+        assert sent.text == "Показания приняты"
+        await bot.send_message(1, "Ещё одно")
+        document = await bot.send_document(1, BufferedInputFile(b"1;2;3", "readings.csv"))
+        assert document.document.file_name == "readings.csv"
+        with pytest.raises(TelegramForbiddenError):
+            await bot.send_message(403, "Жилец заблокировал бота")
+        with pytest.raises(TelegramNetworkError):
+            await bot.send_message(408, "Медленный ответ")
+
+        # Пул проверяется через публичные create_session и ClientSession.connector
+        assert (await session.create_session()).connector.limit == 7
+        assert (await session.upload_session.create_session()).connector.limit == settings.BOT_UPLOAD_CONNECTIONS
+        # Соединение для сообщений переиспользуется, файл ушёл через другое
+        ports = {method: {port for name, port in calls if name == method} for method, _ in calls}
+        assert ports["sendDocument"].isdisjoint(ports["sendMessage"])
+    finally:
+        await session.close()
+
+    assert api_metrics.methods["sendMessage"][:2] == [4, 2]
+    assert api_metrics.methods["sendDocument"][:2] == [1, 0]
+    assert api_metrics.errors == {"TelegramForbiddenError": 1, "TelegramNetworkError": 1}
+    assert "ошибок 2 (40.0%)" in str(api_metrics)
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock
+
+import pytest
+from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError
+from aiogram.methods import SendMessage
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from config import settings
+from database.database import Database
+from database.models import readings, user_deliveries
+from tests.test_export import add_apartments
+from utils.broadcast_utils import broadcast
+
+TEXT = "Пожалуйста, не забудьте подать показания счетчиков!"
+
+
+def fake_bot(blocked: set[int], offline: set[int] = frozenset()) -> AsyncMock:
+    async def send_message(chat_id: int, text: str):
+        method = SendMessage(chat_id=chat_id, text=text)
+        if chat_id in blocked:
+            raise TelegramForbiddenError(method, "Forbidden: bot was blocked by the user")
+        if chat_id in offline:
+            raise TelegramNetworkError(method, "timeout")
+
+    bot = AsyncMock()
+    bot.send_message = AsyncMock(side_effect=send_message)
+    return bot
+
+
+# Заблокировавший бота жилец пропускается с отсрочкой и после
+# UNREACHABLE_AFTER ошибок удаляется вместе с состоянием доставки
+@pytest.mark.asyncio
+async def test_unreachable_users_backoff_and_purge(session, monkeypatch):
+    monkeypatch.setattr(settings, "UNREACHABLE_AFTER", 2)
+    db = Database(session, building_id=1)
+    await add_apartments(db, 3)
+    session_maker = async_sessionmaker(session.bind, class_=AsyncSession, expire_on_commit=False)
+
+    report = await broadcast(fake_bot(blocked={2}, offline={3}), session_maker, 1, TEXT)
+    assert tuple(report) == (1, 1, 1, 0)
+
+    # Во время отсрочки жилец 2 не получает рассылку
+    bot = fake_bot(blocked={2})
+    report = await broadcast(bot, session_maker, 1, TEXT)
+    assert tuple(report) == (2, 0, 0, 1)
+    assert sorted(call.args[0] for call in bot.send_message.await_args_list) == [1, 3]
+    assert await db.get_unreachable_users() == []
+
+    # После отсрочки - вторая ошибка подряд, отсрочка удваивается
+    rows = await db.get_broadcast_users(datetime.now() + timedelta(hours=settings.DELIVERY_BACKOFF_HOURS + 1))
+    assert sorted(row["user_id"] for row in rows) == [1, 2, 3]
+    await session.execute(update(user_deliveries).values(retry_after=datetime.now()))
+    await session.commit()
+    started = datetime.now()
+    await broadcast(fake_bot(blocked={2}), session_maker, 1, TEXT)
+    state = (await session.execute(select(user_deliveries).where(user_deliveries.c.user_id == 2))).one()
+    assert state.failures == 2 and state.delivered_at is None
+    assert state.retry_after >= started + timedelta(hours=2 * settings.DELIVERY_BACKOFF_HOURS)
+
+    unreachable = await db.get_unreachable_users()
+    assert [(row["user_id"], row["failures"]) for row in unreachable] == [(2, 2)]
+
+    assert await db.purge_unreachable_users() == 1
+    assert [row["user_id"] for row in await db.get_all_users()] == [1, 3]
+    # Показания удалённого жильца остаются за квартирой
+    assert (await session.execute(select(readings.c.user_id).where(readings.c.meter_id == 2))).scalars().all() == [None]
+    deliveries = (await session.execute(select(user_deliveries.c.user_id, user_deliveries.c.failures))).all()
+    assert sorted(deliveries) == [(1, 0), (3, 0)]
+
+    await db.delete_user_by_apartment(3, 3)
+    assert (await session.execute(select(user_deliveries.c.user_id))).scalars().all() == [1]
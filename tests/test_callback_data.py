@@ -0,0 +1,71 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from aiogram import F
+from aiogram.types import CallbackQuery, User
+
+from handlers import user_handlers
+from kbds.callback_data import SerialCallback, SerialEditCallback, UserCallback
+from states.states import EditSerialsStates
+from utils.cache import LRUCache
+
+
+# В callback_data только числовой id: имя с "_" и длинные строки не мешают разбору
+def test_callback_data_is_short_and_round_trips():
+    packed = UserCallback(user_id=9_000_000_000).pack()
+    assert len(packed.encode()) <= 64
+    assert UserCallback.unpack(packed).user_id == 9_000_000_000
+    assert SerialCallback.unpack(SerialCallback(serial_id=42).pack()).serial_id == 42
+
+
+# Кнопки «Счётчик заменён» и «Исправить опечатку» различаются действием
+@pytest.mark.asyncio
+async def test_serial_edit_buttons_match_actions():
+    user = User(id=7, is_bot=False, first_name="Resident")
+    typo = CallbackQuery(id="1", from_user=user, chat_instance="c", data=SerialEditCallback(action="typo").pack())
+
+    assert await SerialEditCallback.filter(F.action == "typo")(typo)
+    assert not await SerialEditCallback.filter(F.action == "replaced")(typo)
+
+
+def test_callback_cache_is_bounded():
+    cache = LRUCache(2)
+    cache.put(("serial", 1), "A")
+    cache.put(("serial", 2), "B")
+    cache.get(("serial", 1))  # 1 использовался недавно, вытесняется 2
+    cache.put(("serial", 3), "C")
+
+    assert len(cache) == 2
+    assert cache.get(("serial", 1)) == "A"
+    assert cache.get(("serial", 2)) is None
+
+
+# Серийный номер берётся из кэша, а при промахе - из базы данных
+@pytest.mark.asyncio
+@pytest.mark.parametrize("cached", [True, False])
+async def test_select_meter_to_edit_resolves_serial(cached: bool):
+    callback = AsyncMock()
+    callback.from_user.id = 7
+    state = AsyncMock()
+    cache = LRUCache(10)
+    if cached:
+        cache.put(("serial", 5), "SN_WITH_UNDERSCORE_1234567890")
+    db_mock = MagicMock()
+    db_mock.get_info_for_user = AsyncMock(return_value={"apartment_number": 7})
+    db_mock.get_all_meters_serials_and_descriptions = AsyncMock(
+        return_value=[
+            {"serial_id": 4, "serial_number": "other", "description": ""},
+            {"serial_id": 5, "serial_number": "SN_WITH_UNDERSCORE_1234567890", "description": ""},
+        ]
+    )
+
+    with (
+        patch("handlers.user_handlers.callback_cache", cache),
+        patch("handlers.user_handlers.Database", return_value=db_mock),
+    ):
+        await user_handlers.select_meter_to_edit(
+            callback, SerialCallback(serial_id=5), state, AsyncMock()
+        )
+
+    state.update_data.assert_called_with(selected_serial="SN_WITH_UNDERSCORE_1234567890")
+    state.set_state.assert_called_with(EditSerialsStates.edit_serial)
+    assert db_mock.get_info_for_user.await_count == (0 if cached else 1)
@@ -0,0 +1,94 @@
+import asyncio
+import time
+from datetime import datetime
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from handlers import admin_handlers
+from middlewere.concurrency_middleware import ConcurrencyMiddleware
+from utils.job_queue import JobQueue
+from utils.metrics import QueueMetrics
+
+
+# Не больше limit обновлений одновременно, остальные ждут в очереди
+@pytest.mark.asyncio
+async def test_concurrency_limit_and_metrics():
+    metrics = QueueMetrics("test")
+    middleware = ConcurrencyMiddleware(limit=2, metrics=metrics)
+    running = {"now": 0, "max": 0}
+
+    async def handler(event, data):
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        await asyncio.sleep(0.01)
+        running["now"] -= 1
+
+    await asyncio.gather(*(middleware(handler, MagicMock(), {}) for _ in range(6)))
+
+    assert running["max"] == 2
+    assert metrics.processed == 6
+    assert metrics.max_waiting == 4
+    assert metrics.waiting == 0 and metrics.running == 0
+    assert metrics.wait_max >= 0.01
+
+
+# Пока администратор выгружает большой Excel, подача показаний жильцом не замедляется
+@pytest.mark.asyncio
+async def test_resident_not_delayed_by_export():
+    readings = [
+        {
+            "apartment_number": i % 173,
+            "name": "hot_water",
+            "serial_number": f"SN-{i}",
+            "value": i,
+            "reading_date": datetime(2025, 5, 1),
+            "estimated": False,
+        }
+        for i in range(30000)
+    ]
+    db_mock = MagicMock()
+
+    async def stream_readings_for_period(period=None):
+        for start in range(0, len(readings), 1000):
+            yield readings[start:start + 1000]
+
+    db_mock.stream_readings_for_period = stream_readings_for_period
+    # Тарифов нет - лист начислений не строится
+    db_mock.get_tariffs = AsyncMock(return_value=[])
+    bot = MagicMock()
+    bot.send_document = AsyncMock()
+    message = AsyncMock()
+    queue = JobQueue(workers=1, maxsize=2)
+    queue.start()
+
+    async def submit_reading(event, data):
+        await asyncio.sleep(0.001)  # запрос к базе данных
+
+    middleware = ConcurrencyMiddleware(limit=2, metrics=QueueMetrics("test"))
+    with (
+        patch("handlers.admin_handlers.job_queue", queue),
+        patch("handlers.admin_handlers.Database", return_value=db_mock),
+        patch("handlers.admin_handlers.get_session_maker"),
+    ):
+        await admin_handlers.get_all_readings(message, bot, building_id=1)
+        await asyncio.sleep(0.05)  # выгрузка началась
+        assert queue.metrics.running == 1
+
+        latencies = []
+        for _ in range(20):
+            started = time.perf_counter()
+            await middleware(submit_reading, MagicMock(), {})
+            latencies.append(time.perf_counter() - started)
+        export_running = queue.metrics.running == 1
+
+        await queue.queue.join()
+    await queue.stop()
+
+    assert export_running, "выгрузка закончилась раньше замера"
+    # Поток выгрузки иногда удерживает GIL, поэтому проверяется p95, а не максимум;
+    # без очереди задач и потока жилец ждал бы всю выгрузку (секунды)
+    assert sorted(latencies)[18] < 0.05
+    assert max(latencies) < 0.5
+    bot.send_document.assert_awaited_once()
+    assert queue.metrics.processed == 1
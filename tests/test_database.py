@@ -0,0 +1,95 @@
+from datetime import date
+
+import pytest
+from dateutil.relativedelta import relativedelta
+
+from config import settings
+from database.database import Database
+
+
+def apartment_info(user_id: int, apartment_number: int, serial_prefix: str) -> dict:
+    return {
+        "user_id": user_id,
+        "first_name": f"User{user_id}",
+        "last_name": None,
+        "apartment_number": apartment_number,
+        "meters": {
+            "hot_water": {"serials": [f"{serial_prefix}-hw"], "descriptions": ["Кухня"]},
+            "cold_water": {"serials": [f"{serial_prefix}-cw"], "descriptions": ["Кухня"]},
+            "electricity": {"serials": [f"{serial_prefix}-el"], "descriptions": ["Щиток"]},
+        },
+    }
+
+
+# Одинаковые номера квартир в разных домах не должны пересекаться
+@pytest.mark.asyncio
+async def test_buildings_are_isolated(session):
+    first = Database(session, building_id=1)
+    second = Database(session, building_id=2)
+    await first.add_info_apartment(apartment_info(100, 5, "b1"))
+    await second.add_info_apartment(apartment_info(200, 5, "b2"))
+
+    first_serials = await first.get_all_meters_serials_and_descriptions(5)
+    second_serials = await second.get_all_meters_serials_and_descriptions(5)
+    assert {row["serial_number"] for row in first_serials} == {"b1-hw", "b1-cw", "b1-el"}
+    assert {row["serial_number"] for row in second_serials} == {"b2-hw", "b2-cw", "b2-el"}
+
+    assert (await second.get_info_for_user(200))["building_id"] == 2
+    assert [row["user_id"] for row in await first.get_all_users()] == [100]
+    assert [row["user_id"] for row in await second.get_users_by_apartment(5)] == [200]
+
+
+@pytest.mark.asyncio
+async def test_readings_are_scoped_to_building(session):
+    first = Database(session, building_id=1)
+    second = Database(session, building_id=2)
+    await first.add_info_apartment(apartment_info(100, 5, "b1"))
+    await second.add_info_apartment(apartment_info(200, 5, "b2"))
+
+    await first.add_reading(
+        {
+            "apartment_number": 5,
+            "meter_type": "hot_water",
+            "serial_number": "b1-hw",
+            "user_id": 100,
+            "value": 10,
+        }
+    )
+
+    readings = await first.get_all_readings_for_period()
+    assert [(row["serial_number"], row["value"]) for row in readings] == [("b1-hw", 10)]
+    assert await second.get_all_readings_for_period() == []
+    assert await first.get_apartments_without_readings() == []
+    assert await second.get_apartments_without_readings() == [5]
+
+    period = date.today() - relativedelta(months=settings.DELTA_MONTH)
+    assert await first.get_meter_types_for_period(5, period) == ["hot_water"]
+    assert await second.get_meter_types_for_period(5, period) == []
+
+
+@pytest.mark.asyncio
+async def test_previous_reading_serial_update_and_delete(session):
+    db = Database(session)
+    await db.add_info_apartment(apartment_info(100, 7, "a7"))
+    await db.add_reading(
+        {
+            "apartment_number": 7,
+            "meter_type": "electricity",
+            "serial_number": "a7-el",
+            "user_id": 100,
+            "value": 1500,
+        }
+    )
+
+    previous = await db.get_previous_reading("electricity", "a7-el")
+    assert previous["value"] == 1500
+    assert await db.get_previous_reading("hot_water", "a7-el") is None
+
+    await db.update_serial_number("a7-el", "a7-el-new", 100)
+    serials = await db.get_meters_serials_and_descriptions(7, "electricity")
+    assert [(row["serial_number"], row["description"]) for row in serials] == [
+        ("a7-el-new", "Щиток")
+    ]
+
+    await db.delete_user_by_apartment(7, 100)
+    assert await db.get_info_for_user(100) is None
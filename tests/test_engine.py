@@ -0,0 +1,154 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.types import User
+from sqlalchemy import insert, select
+
+from config import settings
+from database import engine as db_engine
+from database.database import Database, user_building_cache
+from database.models import meter_types, metadata
+from middlewere.db_middleware import DbSessionMiddleware
+from tests.test_throttling import FakeClock
+from utils.schemas import UserRegistrShema
+
+
+@pytest.fixture
+def file_building(tmp_path, monkeypatch):
+    """Дом 99 в отдельном файле SQLite с разделением чтения и записи"""
+    url = f"sqlite+aiosqlite:///{tmp_path / 'split.db'}"
+    monkeypatch.setitem(settings.BUILDING_DB_URLS, 99, url)
+    yield 99
+    db_engine._engines.pop(url, None)
+    db_engine._read_engines.pop(url, None)
+    db_engine._session_makers.pop(url, None)
+
+
+@pytest.mark.asyncio
+async def test_reads_and_writes_routed_to_separate_engines(file_building):
+    write_engine = db_engine.get_engine(file_building)
+    read_engine = db_engine.get_read_engine(file_building)
+    assert read_engine is not write_engine
+    assert read_engine.url.query["mode"] == "ro"
+    assert write_engine.pool.size() == 1
+
+    async with write_engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+    async with db_engine.get_session_maker(file_building)() as session:
+        assert session.get_bind(clause=select(meter_types)) is read_engine.sync_engine
+        assert session.get_bind(clause=insert(meter_types)) is write_engine.sync_engine
+        await session.execute(insert(meter_types).values(name="gas", unit="m3"))
+        await session.commit()
+        assert (await session.execute(select(meter_types.c.name))).scalars().all() == ["gas"]
+
+    await read_engine.dispose()
+    await write_engine.dispose()
+
+
+# После записи в транзакции SELECT идёт через engine записи и видит её,
+# после фиксации - снова через engine чтения
+@pytest.mark.asyncio
+async def test_select_after_write_sees_uncommitted_rows(file_building):
+    write_engine = db_engine.get_engine(file_building)
+    read_engine = db_engine.get_read_engine(file_building)
+    async with write_engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+
+    async with db_engine.get_session_maker(file_building)() as session:
+        assert (await session.execute(select(meter_types.c.name))).scalars().all() == []
+        await session.execute(insert(meter_types).values(name="gas", unit="m3"))
+        assert session.get_bind(clause=select(meter_types)) is write_engine.sync_engine
+        assert (await session.execute(select(meter_types.c.name))).scalars().all() == ["gas"]
+        await session.commit()
+        assert session.get_bind(clause=select(meter_types)) is read_engine.sync_engine
+
+        await session.execute(insert(meter_types).values(name="oil", unit="m3"))
+        await session.rollback()
+        assert session.get_bind(clause=select(meter_types)) is read_engine.sync_engine
+        assert (await session.execute(select(meter_types.c.name))).scalars().all() == ["gas"]
+
+    await asyncio.gather(read_engine.dispose(), write_engine.dispose())
+
+
+# Пока отчёт читает показания курсором, запись фиксируется без ожидания блокировки
+@pytest.mark.asyncio
+async def test_writer_not_blocked_by_open_report(file_building):
+    write_engine = db_engine.get_engine(file_building)
+    read_engine = db_engine.get_read_engine(file_building)
+    async with write_engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+        await conn.execute(
+            insert(meter_types), [{"name": f"type-{i}", "unit": "m3"} for i in range(2000)]
+        )
+
+    session_maker = db_engine.get_session_maker(file_building)
+    async with session_maker() as report:
+        result = await report.stream(select(meter_types))
+        await result.fetchmany(10)  # курсор отчёта открыт
+
+        started = time.perf_counter()
+        async with session_maker() as writer:
+            await writer.execute(insert(meter_types).values(name="new", unit="m3"))
+            await writer.commit()
+        write_time = time.perf_counter() - started
+
+        # Отчёт видит свой снимок и дочитывает его до конца
+        rest = await result.fetchall()
+        await result.close()
+
+    assert write_time < 0.5
+    assert len(rest) == 1990
+    await asyncio.gather(read_engine.dispose(), write_engine.dispose())
+
+
+# Дом пользователя берётся из кэша; после удаления и регистрации в другом доме
+# обновления идут в новый дом, незарегистрированный ищется не чаще раза в
+# USER_BUILDING_MISS_SECONDS
+@pytest.mark.asyncio
+async def test_user_building_cache(tmp_path, monkeypatch):
+    urls = {building_id: f"sqlite+aiosqlite:///{tmp_path / f'{building_id}.db'}" for building_id in (97, 98)}
+    monkeypatch.setattr(settings, "BUILDING_DB_URLS", urls)
+    monkeypatch.setattr(settings, "BUILDINGS", {97: 10, 98: 10})
+    monkeypatch.setattr(settings, "DB_SPLIT_READS", False)
+    user_building_cache.clear()
+    for building_id in urls:
+        async with db_engine.get_engine(building_id).begin() as conn:
+            await conn.run_sync(metadata.create_all)
+
+    clock = FakeClock()
+    middleware = DbSessionMiddleware(clock=clock)
+    lookups = []
+    find_building = middleware._find_building
+
+    async def counting_find_building(user_id):
+        lookups.append(user_id)
+        return await find_building(user_id)
+
+    monkeypatch.setattr(middleware, "_find_building", counting_find_building)
+    user = User(id=5, is_bot=False, first_name="Resident")
+
+    async with db_engine.get_session_maker(97)() as session:
+        await Database(session, 97).add_user_info(UserRegistrShema(user_id=5, first_name="R", apartment_number=3))
+    user_building_cache.clear()  # как после перезапуска
+    assert [await middleware.resolve_building(user, {}) for _ in range(2)] == [97, 97]
+    assert lookups == [5]
+
+    async with db_engine.get_session_maker(97)() as session:
+        await Database(session, 97).delete_user_by_apartment(3, 5)
+    assert [await middleware.resolve_building(user, {}) for _ in range(2)] == [settings.DEFAULT_BUILDING_ID] * 2
+    assert lookups == [5, 5]
+    clock.now = settings.USER_BUILDING_MISS_SECONDS + 1
+    await middleware.resolve_building(user, {})
+    assert lookups == [5, 5, 5]
+
+    async with db_engine.get_session_maker(98)() as session:
+        await Database(session, 98).add_user_info(UserRegistrShema(user_id=5, first_name="R", apartment_number=4))
+    assert await middleware.resolve_building(user, {}) == 98
+    assert lookups == [5, 5, 5]
+
+    user_building_cache.clear()
+    for url in urls.values():
+        await db_engine._engines.pop(url).dispose()
+        db_engine._read_engines.pop(url, None)
+        db_engine._session_makers.pop(url, None)
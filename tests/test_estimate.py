@@ -0,0 +1,92 @@
+from datetime import date, datetime
+
+import pytest
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import delete, insert
+
+from config import settings
+from database.database import Database
+from database.models import readings
+from tests.test_export import add_apartments
+from utils.estimate_utils import estimate_missing_readings, estimate_readings
+
+
+def current_period() -> datetime:
+    period = date.today() - relativedelta(months=settings.DELTA_MONTH)
+    return datetime(period.year, period.month, 1)
+
+
+def test_estimate_readings_average_daily():
+    history = [
+        # 60 единиц за 60 дней: к 11 марта ещё 10 дней по 1 в день
+        {"serial_id": 1, "meter_id": 1, "first_value": 100, "first_date": datetime(2024, 1, 1),
+         "last_value": 160, "last_date": datetime(2024, 3, 1)},
+        # Одно показание за всю историю: расход не оценить
+        {"serial_id": 2, "meter_id": 2, "first_value": 5, "first_date": datetime(2024, 1, 1),
+         "last_value": 5, "last_date": datetime(2024, 1, 1)},
+    ]
+
+    estimates = estimate_readings(history, datetime(2024, 4, 1))
+
+    assert estimates == [
+        {"meter_id": 1, "serial_id": 1, "user_id": None, "value": 191, "reading_date": datetime(2024, 4, 1)}
+    ]
+
+
+# Квартира 3 не подала показания: в отчёт попадает расчётное, которое
+# заменяется настоящим при подаче или импорте
+@pytest.mark.asyncio
+async def test_estimated_readings_replaced_by_real(session):
+    db = Database(session, building_id=1)
+    await add_apartments(db, 3)
+    period = current_period()
+    await session.execute(delete(readings).where(readings.c.serial_id == 3))
+    await session.execute(
+        insert(readings),
+        [
+            {"building_id": 1, "meter_id": 3, "user_id": 3, "serial_id": 3,
+             "value": value, "reading_date": period - relativedelta(months=months)}
+            for months, value in ((3, 100), (1, 160))
+        ],
+    )
+    await session.commit()
+
+    assert await estimate_missing_readings(db) == 1
+    # Повторный запуск не добавляет второе расчётное показание
+    assert await estimate_missing_readings(db) == 0
+
+    report = await db.get_all_readings_for_period()
+    assert [(row["apartment_number"], row["estimated"]) for row in report] == [
+        (1, False), (2, False), (3, True)
+    ]
+    estimated = report[2]
+    assert estimated["reading_date"] == period
+    assert 185 <= estimated["value"] <= 192
+    # Расчётное показание не считается поданным
+    assert list(await db.get_apartments_without_readings()) == [3]
+    assert await db.get_meter_types_for_period(3, period) == []
+
+    await db.add_reading(
+        {
+            "apartment_number": 3,
+            "meter_type": "hot_water",
+            "serial_number": "HW-3",
+            "user_id": 3,
+            "value": 175,
+        }
+    )
+    report = await db.get_all_readings_for_period()
+    assert [(row["apartment_number"], row["value"], row["estimated"]) for row in report][2] == (3, 175, False)
+
+    # Импорт показания за месяц с расчётным показанием тоже заменяет его
+    await session.execute(
+        delete(readings).where(readings.c.serial_id == 3, readings.c.reading_date >= period)
+    )
+    await session.commit()
+    assert await estimate_missing_readings(db) == 1
+    inserted = await db.import_readings(
+        [{"serial_id": 3, "meter_id": 3, "value": 170, "reading_date": period}], "hash", 1, new_file=True
+    )
+    assert inserted == 1
+    report = await db.get_all_readings_for_period()
+    assert [(row["value"], row["estimated"]) for row in report][2] == (170, False)
@@ -0,0 +1,79 @@
+import csv
+import gzip
+import json
+from pathlib import Path
+
+import openpyxl
+import pytest
+
+from database.database import Database
+from utils.export_utils import EXPORT_COLUMNS, export_readings_file
+
+
+async def add_apartments(db: Database, count: int) -> None:
+    for apartment in range(1, count + 1):
+        await db.add_info_apartment(
+            {
+                "user_id": apartment,
+                "first_name": f"User{apartment}",
+                "apartment_number": apartment,
+                "meters": {"hot_water": {"serials": [f"HW-{apartment}"], "descriptions": ["Кухня"]}},
+            }
+        )
+        await db.add_reading(
+            {
+                "apartment_number": apartment,
+                "meter_type": "hot_water",
+                "serial_number": f"HW-{apartment}",
+                "user_id": apartment,
+                "value": apartment * 10,
+            }
+        )
+
+
+# Курсор отдаёт показания пачками, а не одним списком
+@pytest.mark.asyncio
+async def test_stream_readings_in_chunks(session):
+    db = Database(session, building_id=1)
+    await add_apartments(db, 5)
+
+    chunks = [chunk async for chunk in db.stream_readings_for_period(chunk_size=2)]
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert [row["value"] for chunk in chunks for row in chunk] == [10, 20, 30, 40, 50]
+
+
+# Все форматы содержат одни и те же строки, что и get_all_readings_for_period
+@pytest.mark.asyncio
+async def test_export_formats(session, tmp_path: Path):
+    db = Database(session, building_id=1)
+    await add_apartments(db, 3)
+    expected = [
+        [row[field] for field in EXPORT_COLUMNS] for row in await db.get_all_readings_for_period()
+    ]
+    assert len(expected) == 3
+
+    path, rows = await export_readings_file(db, tmp_path, "csv", compress=True)
+    assert (path.name, rows) == ("meter_readings.csv.gz", 3)
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        lines = list(csv.reader(file, delimiter=";"))
+    assert lines[0] == list(EXPORT_COLUMNS.values())
+    assert [line[2:4] for line in lines[1:]] == [[row[2], str(row[3])] for row in expected]
+
+    path, rows = await export_readings_file(db, tmp_path, "jsonl")
+    objects = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [obj["serial_number"] for obj in objects] == [row[2] for row in expected]
+    assert objects[0]["reading_date"] == str(expected[0][4])
+
+    # xlsx не сжимается gzip повторно
+    path, rows = await export_readings_file(db, tmp_path, "xlsx", compress=True)
+    assert path.name == "meter_readings.xlsx"
+    sheet = openpyxl.load_workbook(path, read_only=True).active
+    assert [list(row) for row in sheet.iter_rows(min_row=2, values_only=True)] == expected
+
+
+@pytest.mark.asyncio
+async def test_export_without_readings(session, tmp_path: Path):
+    path, rows = await export_readings_file(Database(session, building_id=1), tmp_path, "csv")
+    assert rows == 0
+    assert path.read_text(encoding="utf-8-sig").splitlines() == [";".join(EXPORT_COLUMNS.values())]
@@ -1,11 +1,22 @@
-from contextlib import nullcontext
 from datetime import datetime
 import pytest
 from unittest.mock import AsyncMock, MagicMock, patch
 from aiogram import Bot, Dispatcher
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import insert
 
+from database.database import Database
+
+from database.models import DEFAULT_METER_TYPES, meter_types
 from handlers import user_handlers
-from states.states import EditSerialsStates, MeterRegistration, UserRegistration
+from states.states import EditSerialsStates, MeterRegistration, MeterSubmission, UserRegistration
+
+# Строки meter_types в порядке опроса и шаги регистрации из них
+METER_TYPES = sorted(DEFAULT_METER_TYPES, key=lambda row: row["position"])
+STEPS = [[row["name"], row["title"], row["min_count"], row["max_count"]] for row in METER_TYPES]
+TYPES = {row["name"]: [row["label"], row["title"]] for row in METER_TYPES}
 
 
 # Тесты для команды /start
@@ -53,6 +64,7 @@ async def test_start_command(bot: Bot, dp: Dispatcher, user_data: dict):
         ("0", False, "Номер квартиры должен быть от 1 до 173"),
         ("175", False, "Номер квартиры должен быть от 1 до 173"),
         ("abc", False, "Пожалуйста, введите число"),
+        (None, False, "Пожалуйста, введите число"),  # фото или стикер
     ],
 )
 async def test_process_apartment(
@@ -61,6 +73,7 @@ async def test_process_apartment(
     message = AsyncMock()
     message.text = input_text
     state = AsyncMock()
+    state.get_data.return_value = {}
 
     # Создаем асинхронный мок для сессии
     mock_session = AsyncMock()
@@ -68,70 +81,60 @@ async def test_process_apartment(
     db_mock = MagicMock()
 
     db_mock.get_all_meters_serials_and_descriptions = AsyncMock(return_value=None)
+    db_mock.get_meter_types = AsyncMock(return_value=METER_TYPES)
 
     with patch("handlers.user_handlers.Database", return_value=db_mock):
         await user_handlers.process_apartment(message, state, mock_session)
 
     if is_valid:
-        state.update_data.assert_called_with(apartment_number=int(input_text))
-        state.set_state.assert_called_with(UserRegistration.hot_water_count)
+        state.set_data.assert_called_with(
+            {"apartment_number": int(input_text), "steps": STEPS, "step": 0, "meters": {}}
+        )
+        state.set_state.assert_called_with(UserRegistration.meter_count)
     message.answer.assert_called_with(expected_response)
 
 
-# Тесты для обработки счетчиков горячей воды
+# Тесты для ввода количества счетчиков
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
-    "input_text, is_valid, expected_response, expectation",
+    "step, input_text, is_valid, expected_response",
     [
-        (
-            "1",
-            True,
-            "Введите серийные номера горячей воды, разделенные пробелом:",
-            nullcontext(),
-        ),
-        (
-            "2",
-            True,
-            "Введите серийные номера горячей воды, разделенные пробелом:",
-            nullcontext(),
-        ),
-        (
-            "3",
-            True,
-            "Введите серийные номера горячей воды, разделенные пробелом:",
-            nullcontext(),
-        ),
-        (
-            "abc",
-            False,
-            "Пожалуйста, введите число от 1 до 3",
-            pytest.raises(ValueError),
-        ),
+        (0, "1", True, "Введите серийные номера горячей воды, разделенные пробелом:"),
+        (0, "2", True, "Введите серийные номера горячей воды, разделенные пробелом:"),
+        (0, "3", True, "Введите серийные номера горячей воды, разделенные пробелом:"),
+        (1, "2", True, "Введите серийные номера холодной воды, разделенные пробелом:"),
+        (3, "1", True, "Введите серийные номера тепла, разделенные пробелом:"),
+        (0, "abc", False, "Пожалуйста, введите число от 1 до 3"),
+        (0, "0", False, "Пожалуйста, введите число от 1 до 3"),
+        (3, "2", False, "Пожалуйста, введите число от 0 до 1"),
+        (0, None, False, "Пожалуйста, введите число от 1 до 3"),
     ],
 )
-async def test_process_hot_water_count(
+async def test_process_meter_count(
     bot: Bot,
     dp: Dispatcher,
+    step: int,
     input_text: str,
     is_valid: bool,
     expected_response: str,
-    expectation,
 ):
     message = AsyncMock()
     message.text = input_text
     state = AsyncMock()
+    state.get_data.return_value = {"steps": STEPS, "step": step, "meters": {}}
 
-    with expectation:
-        await user_handlers.process_hot_water(message, state)
+    await user_handlers.process_meter_count(message, state, AsyncMock())
 
-        if is_valid:
-            state.update_data.assert_called_with(hot_water_count=int(input_text))
-            state.set_state.assert_called_with(MeterRegistration.hot_water_serials)
-        else:
-            state.update_data.assert_not_called()
-            state.set_state.assert_not_called()
+    if is_valid:
+        state.set_data.assert_called_with(
+            {"steps": STEPS, "step": step, "meters": {}, "count": int(input_text)}
+        )
+        state.set_state.assert_called_with(MeterRegistration.serials)
+    else:
+        state.set_data.assert_not_called()
+        state.set_state.assert_not_called()
 
-        message.answer.assert_called_with(expected_response)
+    message.answer.assert_called_with(expected_response)
 
 
 # Тесты для обработки серийных номеров
@@ -145,39 +148,162 @@ async def test_process_hot_water_count(
         (2, "123", False),
         (3, "123 456", False),
         (1, "", False),
+        (1, None, False),
     ],
 )
-async def test_process_hot_water_serials(
+async def test_process_meter_serials(
     bot: Bot, dp: Dispatcher, count: int, input_text: str, is_valid: bool
 ):
     message = AsyncMock()
     message.text = input_text
     state = AsyncMock()
-    state.get_data.return_value = {"hot_water_count": count}
+    state.get_data.return_value = {"steps": STEPS, "step": 0, "count": count, "meters": {}}
 
-    await user_handlers.process_hot_water_serials(message, state)
+    await user_handlers.process_meter_serials(message, state)
 
     if is_valid:
-        state.update_data.assert_called()
-        state.set_state.assert_called_with(MeterRegistration.hot_water_descriptions)
+        state.set_data.assert_called()
+        state.set_state.assert_called_with(MeterRegistration.descriptions)
         message.answer.assert_called()
     else:
         message.answer.assert_called_with(f"Нужно ввести {count} номеров через пробел")
 
 
+# Фото или стикер вместо описания получает ответ, а не ошибку
+@pytest.mark.asyncio
+@pytest.mark.parametrize("input_text", [None, "", "x" * 51])
+async def test_process_meter_description_invalid(input_text):
+    message = AsyncMock()
+    message.text = input_text
+    state = AsyncMock()
+
+    await user_handlers.process_meter_description(message, state, AsyncMock())
+
+    message.answer.assert_called_with("Описание должно быть от 1 до 50 символов")
+    state.set_data.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_registration_steps_build_apartment_info(bot: Bot):
+    """Все шаги регистрации проходят через общие обработчики и одно состояние"""
+    state = FSMContext(
+        storage=MemoryStorage(), key=StorageKey(bot_id=1, chat_id=7, user_id=7)
+    )
+    await state.set_data({"building_id": 1})
+    db_mock = MagicMock()
+    db_mock.get_all_meters_serials_and_descriptions = AsyncMock(return_value=None)
+    db_mock.get_meter_types = AsyncMock(return_value=METER_TYPES)
+    db_mock.add_info_apartment = AsyncMock()
+
+    steps = [
+        (user_handlers.process_apartment, "7"),
+        (user_handlers.process_meter_count, "2"),
+        (user_handlers.process_meter_serials, "hw1 hw2"),
+        (user_handlers.process_meter_description, "Кухня"),
+        (user_handlers.process_meter_description, "Ванная"),
+        (user_handlers.process_meter_count, "1"),
+        (user_handlers.process_meter_serials, "cw1"),
+        (user_handlers.process_meter_description, "Кухня"),
+        (user_handlers.process_meter_count, "1"),
+        (user_handlers.process_meter_serials, "el1"),
+        (user_handlers.process_meter_description, "Щиток"),
+        (user_handlers.process_meter_count, "0"),
+    ]
+    with patch("handlers.user_handlers.Database", return_value=db_mock):
+        for handler, text in steps:
+            message = AsyncMock()
+            message.text = text
+            message.from_user.id = 7
+            message.from_user.first_name = "Resident"
+            message.from_user.last_name = None
+            if handler is user_handlers.process_meter_serials:
+                await handler(message, state)
+            else:
+                await handler(message, state, AsyncMock())
+
+    db_mock.add_info_apartment.assert_awaited_once()
+    apartment_info = db_mock.add_info_apartment.call_args[0][0]
+    assert apartment_info["apartment_number"] == 7
+    assert apartment_info["meters"] == {
+        "hot_water": {"serials": ["hw1", "hw2"], "descriptions": ["Кухня", "Ванная"]},
+        "cold_water": {"serials": ["cw1"], "descriptions": ["Кухня"]},
+        "electricity": {"serials": ["el1"], "descriptions": ["Щиток"]},
+    }
+    assert await state.get_state() is None
+
+
+# Новый тип счетчика - строка meter_types: регистрация спрашивает о нём,
+# счетчики сохраняются, а подача показывает кнопку типа
+@pytest.mark.asyncio
+async def test_meter_type_row_drives_registration_and_submit(bot: Bot, session):
+    await session.execute(
+        insert(meter_types),
+        [
+            {"name": "hot_water", "unit": "m3", "label": "Горячая вода", "title": "горячей воды",
+             "min_count": 1, "max_count": 3, "position": 1},
+            {"name": "gas", "unit": "m3", "label": "Газ", "title": "газа",
+             "min_count": 0, "max_count": 1, "position": 2},
+        ],
+    )
+    await session.commit()
+    state = FSMContext(
+        storage=MemoryStorage(), key=StorageKey(bot_id=1, chat_id=7, user_id=7)
+    )
+    questions = []
+    steps = [
+        (user_handlers.process_apartment, "7"),
+        (user_handlers.process_meter_count, "1"),
+        (user_handlers.process_meter_serials, "hw1"),
+        (user_handlers.process_meter_description, "Кухня"),
+        (user_handlers.process_meter_count, "1"),
+        (user_handlers.process_meter_serials, "g1"),
+        (user_handlers.process_meter_description, "Плита"),
+    ]
+    for handler, text in steps:
+        message = AsyncMock()
+        message.text = text
+        message.from_user.id = 7
+        message.from_user.first_name = "Resident"
+        message.from_user.last_name = None
+        if handler is user_handlers.process_meter_serials:
+            await handler(message, state)
+        else:
+            await handler(message, state, session)
+        questions.append(message.answer.call_args[0][0])
+
+    assert questions[0] == "Сколько счетчиков горячей воды установлено? (1-3)"
+    assert questions[3] == "Сколько счетчиков газа установлено? (0-1)"
+    assert await state.get_state() is None
+    meters = await Database(session).get_all_meters_serials_and_descriptions(7)
+    assert {(row["serial_number"], row["description"]) for row in meters} == {("hw1", "Кухня"), ("g1", "Плита")}
+
+    message = AsyncMock()
+    message.from_user.id = 7
+    with patch("handlers.user_handlers.get_period", return_value=("Май", datetime(2025, 5, 1))):
+        await user_handlers.start_submit(message, state, session)
+    keyboard = message.answer.call_args.kwargs["reply_markup"].inline_keyboard
+    assert [button.text for row in keyboard for button in row] == ["❌Горячая вода", "❌Газ", "Завершить"]
+
+
 # Тесты для команды /submit
 @pytest.mark.asyncio
 async def test_start_submit(bot: Bot, dp: Dispatcher):
     message = AsyncMock()
+    message.answer.return_value.message_id = 10
     state = AsyncMock()
     session = AsyncMock()
 
     # Мок для пользователя
     db_mock = MagicMock()
     db_mock.get_info_for_user = AsyncMock(return_value={"apartment_number": 42})
+    db_mock.get_meter_types = AsyncMock(return_value=METER_TYPES)
     db_mock.get_meter_types_for_period = AsyncMock(
         return_value=["hot_water", "cold_water"]
     )
+    db_mock.get_meters_serials_and_descriptions = AsyncMock(
+        return_value=[{"serial_number": "EL-1", "description": "Щиток"}]
+    )
+    db_mock.get_previous_reading = AsyncMock(return_value={"value": 120})
 
     with (
         patch("handlers.user_handlers.Database", return_value=db_mock),
@@ -191,8 +317,71 @@ async def test_start_submit(bot: Bot, dp: Dispatcher):
     # Проверяем, что методы были вызваны
     db_mock.get_info_for_user.assert_awaited_once_with(message.from_user.id)
     db_mock.get_meter_types_for_period.assert_awaited_once()
+    # Сразу предлагается первый неподанный тип
+    db_mock.get_meters_serials_and_descriptions.assert_awaited_once_with(42, "electricity")
 
-    # Проверяем ответ
+    # Одно сообщение статуса, его id сохранён для правки
     message.answer.assert_called_once()
-    print(f"{message.answer.call_args=}")
-    assert "Подать показания за Май 2025" in message.answer.call_args[0][0]
+    text = message.answer.call_args[0][0]
+    assert "Подать показания за Май 2025" in text
+    assert "Счетчик EL-1" in text and "Предыдущие показания: 120" in text
+    state.set_state.assert_called_with(MeterSubmission.value)
+    state.update_data.assert_called_with(status_message_id=10)
+
+
+# Ввод показаний правит сообщение статуса, а не отправляет новое
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "input_text, saved, expected",
+    [
+        ("130", True, "Все показания поданы"),
+        ("100", False, "Показания не могут быть меньше предыдущих"),
+        ("abc", False, "Пожалуйста, введите число"),
+    ],
+)
+async def test_process_value_edits_status(input_text: str, saved: bool, expected: str):
+    message = AsyncMock()
+    message.text = input_text
+    message.bot.edit_message_text = AsyncMock()
+    state = AsyncMock()
+    state.get_data.return_value = {
+        "user_id": 1,
+        "apartment_number": 42,
+        "building_id": 1,
+        "types": TYPES,
+        "submitted": ["hot_water", "cold_water", "heat"],
+        "absent": [],
+        "meter_type": "electricity",
+        "meters_serials": [{"serial_number": "EL-1", "description": "Щиток"}],
+        "current_meter_index": 0,
+        "prev_reading": {"value": 120},
+        "prompt": "Счетчик EL-1",
+        "status_message_id": 10,
+    }
+    db_mock = MagicMock()
+    db_mock.add_reading = AsyncMock()
+
+    with patch("handlers.user_handlers.Database", return_value=db_mock):
+        await user_handlers.process_value(message, state, AsyncMock())
+
+    message.answer.assert_not_called()
+    message.bot.edit_message_text.assert_awaited_once()
+    call = message.bot.edit_message_text.call_args.kwargs
+    assert call["message_id"] == 10
+    assert expected in call["text"]
+    assert db_mock.add_reading.await_count == int(saved)
+    if saved:
+        state.set_state.assert_called_with(None)
+
+
+@pytest.mark.asyncio
+async def test_callbacks_answered_immediately():
+    callback = AsyncMock()
+    callback.data = "finish_submit"
+    state = AsyncMock()
+
+    await user_handlers.finish_submit(callback, state)
+
+    callback.answer.assert_awaited_once()
+    callback.message.answer.assert_not_called()
+    callback.message.edit_text.assert_awaited_once()
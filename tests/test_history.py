@@ -0,0 +1,140 @@
+from datetime import date, datetime
+
+import pytest
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import delete, insert
+
+from config import settings
+from database.database import Database, history_cache
+from database.models import meter_types, meters, readings, serials
+from tests.test_export import add_apartments
+from utils.history_utils import format_history, group_history, history_months
+
+
+def current_period() -> datetime:
+    period = date.today() - relativedelta(months=settings.DELTA_MONTH)
+    return datetime(period.year, period.month, 1)
+
+
+@pytest.fixture(autouse=True)
+def clear_history_cache():
+    history_cache.clear()
+    yield
+    history_cache.clear()
+
+
+# Три года ежемесячных показаний: в истории 12 месяцев, расход первого
+# месяца окна считается от показания перед окном
+@pytest.mark.asyncio
+async def test_consumption_history_window(session):
+    db = Database(session, building_id=1)
+    await add_apartments(db, 1)
+    period = current_period()
+    # Показание текущего периода (10) уже подано add_apartments
+    await session.execute(
+        insert(readings),
+        [
+            {
+                "building_id": 1, "meter_id": 1, "user_id": 1, "serial_id": 1,
+                "value": 10 - shift, "reading_date": period - relativedelta(months=shift),
+            }
+            for shift in range(1, 36)
+        ],
+    )
+    await session.commit()
+
+    rows = await db.get_consumption_history(1)
+    months = history_months(settings.HISTORY_MONTHS, period)
+    assert [row["reading_date"].replace(day=1) for row in rows] == months
+    assert [row["consumption"] for row in rows] == [1] * 12
+
+    history = group_history(rows, months)
+    assert len(history) == 1
+    assert history[0].title == "Горячая вода №HW-1, m3"
+    assert history[0].consumption == [1] * 12
+
+
+# История кэшируется до новых показаний квартиры
+@pytest.mark.asyncio
+async def test_consumption_history_cache(session):
+    db = Database(session, building_id=1)
+    await add_apartments(db, 2)
+
+    rows = await db.get_consumption_history(1)
+    assert await db.get_consumption_history(1) is rows
+    await db.get_consumption_history(2)
+    assert len(history_cache) == 2
+
+    # Квартира 1 подаёт показания заново: старая история в кэше устаревает
+    await session.execute(delete(readings).where(readings.c.serial_id == 1))
+    await session.commit()
+    await db.add_reading(
+        {
+            "apartment_number": 1,
+            "meter_type": "hot_water",
+            "serial_number": "HW-1",
+            "user_id": 1,
+            "value": 15,
+        }
+    )
+    assert len(history_cache) == 1
+    rows = await db.get_consumption_history(1)
+    assert [row["value"] for row in rows] == [15]
+
+
+def test_format_history_missing_months():
+    months = history_months(3, datetime(2024, 3, 15))
+    rows = [
+        {"meter_type": "cold_water", "label": "Холодная вода", "unit": "m3", "serial_number": "<CW>",
+         "reading_date": datetime(2024, 1, 1), "consumption": None},
+        {"meter_type": "cold_water", "label": "Холодная вода", "unit": "m3", "serial_number": "<CW>",
+         "reading_date": datetime(2024, 3, 1), "consumption": 2.5},
+    ]
+
+    text = format_history(group_history(rows, months), months)
+
+    assert text.startswith("<b>Расход за 01.2024 – 03.2024</b>\n<pre>")
+    assert "Холодная вода №&lt;CW&gt;, m3" in text
+    assert "01.2024          —" in text
+    assert "03.2024        2.5" in text
+    assert "Итого          2.5" in text
+
+
+# Название счетчика в истории берётся из meter_types.label: новый тип
+# показывается своим названием, а не именем
+@pytest.mark.asyncio
+async def test_history_uses_meter_type_label(session):
+    db = Database(session, building_id=1)
+    await add_apartments(db, 1)
+    period = current_period()
+    type_id = (
+        await session.execute(
+            insert(meter_types).values(name="gas", unit="m3", label="Газ").returning(meter_types.c.type_id)
+        )
+    ).scalar_one()
+    meter_id = (
+        await session.execute(
+            insert(meters)
+            .values(building_id=1, apartment_number=1, type_id=type_id, count_meter=1)
+            .returning(meters.c.meter_id)
+        )
+    ).scalar_one()
+    serial_id = (
+        await session.execute(
+            insert(serials).values(meter_id=meter_id, serial_number="G-1").returning(serials.c.serial_id)
+        )
+    ).scalar_one()
+    await session.execute(
+        insert(readings),
+        [
+            {"building_id": 1, "meter_id": meter_id, "user_id": 1, "serial_id": serial_id,
+             "value": value, "reading_date": period - relativedelta(months=shift)}
+            for shift, value in ((1, 5), (0, 8))
+        ],
+    )
+    await session.commit()
+
+    rows = await db.get_consumption_history(1)
+    months = history_months(settings.HISTORY_MONTHS, period)
+    titles = [meter.title for meter in group_history(rows, months)]
+    assert titles == ["Газ №G-1, m3", "Горячая вода №HW-1, m3"]
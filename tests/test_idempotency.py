@@ -0,0 +1,100 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from aiogram.types import Update
+
+from middlewere.idempotency_middleware import IdempotencyMiddleware
+from middlewere.throttling_middleware import ThrottlingMiddleware
+from tests.test_throttling import FakeClock, user_data
+
+
+def update(update_id: int, data: str | None = None, message_id: int = 10) -> MagicMock:
+    event = MagicMock(spec=Update)
+    event.update_id = update_id
+    event.callback_query = None
+    if data is not None:
+        callback = MagicMock()
+        callback.from_user.id = 1
+        callback.message.chat.id = 1
+        callback.message.message_id = message_id
+        callback.data = data
+        callback.answer = AsyncMock()
+        event.callback_query = callback
+    return event
+
+
+# Повторно доставленное обновление не обрабатывается, окно update_id ограничено
+@pytest.mark.asyncio
+async def test_duplicate_update_ids_skipped():
+    middleware = IdempotencyMiddleware(window=2, path=None)
+    handler = AsyncMock(return_value="ok")
+
+    results = [await middleware(handler, update(update_id), {}) for update_id in (1, 2, 1, 3, 1)]
+
+    assert results == ["ok", "ok", None, "ok", "ok"]
+    assert middleware.stats["duplicate_updates"] == 1
+    assert list(middleware.seen_updates) == [3, 1]
+
+
+# Двойное нажатие кнопки отбрасывается, то же нажатие позже или на другом
+# сообщении обрабатывается
+@pytest.mark.asyncio
+async def test_double_tap_on_button_skipped():
+    clock = FakeClock()
+    middleware = IdempotencyMiddleware(callback_ttl=3, path=None, clock=clock)
+    handler = AsyncMock(return_value="ok")
+
+    first = await middleware(handler, update(1, "finish_submit"), {})
+    double_tap = update(2, "finish_submit")
+    second = await middleware(handler, double_tap, {})
+    other_message = await middleware(handler, update(3, "finish_submit", message_id=11), {})
+    clock.now = 3.5
+    later = await middleware(handler, update(4, "finish_submit"), {})
+
+    assert (first, second, other_message, later) == ("ok", None, "ok", "ok")
+    double_tap.callback_query.answer.assert_awaited_once_with()
+    assert middleware.stats["duplicate_callbacks"] == 1
+
+
+# Обработанные до перезапуска обновления не повторяются после него
+@pytest.mark.asyncio
+async def test_seen_updates_persist_across_restart(tmp_path):
+    path = tmp_path / "seen_updates.json"
+    before = IdempotencyMiddleware(path=path, save_every=2)
+    handler = AsyncMock(return_value="ok")
+    for update_id in (1, 2, 3):
+        await before(handler, update(update_id), {})
+    await before.close()
+    assert path.exists()
+
+    after = IdempotencyMiddleware(path=path)
+    after.load()
+
+    assert [await after(handler, update(update_id), {}) for update_id in (2, 3, 4)] == [None, None, "ok"]
+
+
+# Запись файла не задерживает обновление: обновления пользователя,
+# пришедшие во время записи, обрабатываются после него
+@pytest.mark.asyncio
+async def test_save_keeps_user_order(tmp_path):
+    idempotency = IdempotencyMiddleware(path=tmp_path / "seen_updates.json", save_every=1)
+    throttling = ThrottlingMiddleware(rate=100, burst=100)
+    write = idempotency._write
+    idempotency._write = lambda update_ids: (time.sleep(0.05), write(update_ids))
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event.update_id)
+
+    async def process(event, data):
+        return await throttling(handler, event, data)
+
+    # handle_as_tasks: каждое обновление - отдельная задача
+    await asyncio.gather(
+        *(idempotency(process, update(update_id), user_data(1)) for update_id in (1, 2))
+    )
+    await idempotency.close()
+
+    assert handled == [1, 2]
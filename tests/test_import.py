@@ -0,0 +1,203 @@
+from datetime import datetime
+from pathlib import Path
+
+import openpyxl
+import pytest
+from sqlalchemy import func, insert, select
+
+from config import settings
+from database import queries
+from database.database import Database
+from database.models import meter_types, readings
+from utils.import_utils import (
+    METER_COLUMNS,
+    import_meters_file,
+    import_readings_file,
+    read_table,
+)
+
+CSV_ROWS = """Квартира;Тип счётчика;Серийный номер;Описание
+1;Горячая вода;HW-1;Кухня
+1;хвс;CW-1;Кухня
+1;cold_water;CW-2;Ванная
+2;electricity;EL-2;
+;;;
+3;газ;G-3;Кухня
+4;heat;HW-1;Стояк
+500;heat;H-500;
+abc;heat;H-6;
+2;electricity;EL-2;Дубликат
+2;electricity;ОЧЕНЬ-ДЛИННЫЙ-СЕРИЙНЫЙ-НОМЕР;
+"""
+
+
+# Правильные строки загружаются, по остальным - ошибка с номером строки файла
+@pytest.mark.asyncio
+async def test_import_meters_csv(session, tmp_path: Path):
+    path = tmp_path / "meters.csv"
+    path.write_text(CSV_ROWS, encoding="utf-8-sig")
+    db = Database(session, building_id=1)
+
+    report = await import_meters_file(db, path)
+
+    assert (report.total, report.imported) == (10, 5)
+    assert [row_number for row_number, _ in report.errors] == [7, 9, 10, 11, 12]
+    assert "тип счетчика" in report.errors[0][1]
+    assert "от 1 до 173" in report.errors[1][1]
+    assert "квартира" in report.errors[2][1]
+    assert "уже есть" in report.errors[3][1]
+    assert "серийный номер" in report.errors[4][1]
+
+    meters = await db.get_all_meters_serials_and_descriptions(1)
+    assert {(row["serial_number"], row["description"]) for row in meters} == {
+        ("HW-1", "Кухня"), ("CW-1", "Кухня"), ("CW-2", "Ванная")
+    }
+    cold_water = await db.get_meters_serials_and_descriptions(1, "cold_water")
+    assert [row["serial_number"] for row in cold_water] == ["CW-1", "CW-2"]
+    # Серийный номер другого типа (HW-1 у тепла) не считается дубликатом
+    assert [row["serial_number"] for row in await db.get_all_meters_serials_and_descriptions(4)] == ["HW-1"]
+
+
+# Тип счетчика, добавленный строкой meter_types, узнаётся по названию из label
+@pytest.mark.asyncio
+async def test_import_meters_type_from_database(session, tmp_path: Path):
+    db = Database(session, building_id=1)
+    await db._ensure_meter_types_exist()
+    await session.execute(insert(meter_types).values(name="gas", unit="m3", label="Газ"))
+    await session.commit()
+    path = tmp_path / "meters.csv"
+    path.write_text("квартира;тип;серийный номер\n3;газ;G-3\n3;ГВС;HW-3\n", encoding="utf-8")
+
+    report = await import_meters_file(db, path)
+
+    assert (report.imported, report.errors) == (2, [])
+    assert [row["serial_number"] for row in await db.get_meters_serials_and_descriptions(3, "gas")] == ["G-3"]
+
+
+# Повторный импорт дополняет счетчик квартиры и не дублирует серийные номера
+@pytest.mark.asyncio
+async def test_import_meters_xlsx_appends(session, tmp_path: Path):
+    db = Database(session, building_id=1)
+    first = tmp_path / "first.csv"
+    first.write_text("apartment,type,serial\n7,hot_water,A\n", encoding="utf-8")
+    assert (await import_meters_file(db, first)).imported == 1
+
+    path = tmp_path / "meters.xlsx"
+    workbook = openpyxl.Workbook()
+    workbook.active.append(["Номер квартиры", "Тип", "Номер счетчика", "Лишний столбец"])
+    workbook.active.append([7.0, "гвс", 12345.0, "x"])
+    workbook.active.append([7, "hot_water", "A", None])
+    workbook.save(path)
+
+    report = await import_meters_file(db, path)
+
+    assert (report.total, report.imported) == (2, 1)
+    assert report.errors[0][0] == 3
+    serials = await db.get_meters_serials_and_descriptions(7, "hot_water")
+    assert sorted(row["serial_number"] for row in serials) == ["12345", "A"]
+    meters = await session.execute(
+        queries.select_building_meters, {"building_id": 1}
+    )
+    assert [row.count_meter for row in meters] == [2]
+
+
+# CSV из Excel в cp1251: столбцы без серийного номера не загружаются
+@pytest.mark.asyncio
+async def test_import_meters_missing_columns(session, tmp_path: Path):
+    path = tmp_path / "meters.csv"
+    path.write_text("квартира,тип,описание\n1,хвс,Кухня\n", encoding="cp1251")
+    assert list(read_table(path, METER_COLUMNS)) == [
+        (2, {"apartment_number": "1", "meter_type": "хвс", "description": "Кухня"})
+    ]
+
+    report = await import_meters_file(Database(session, building_id=1), path)
+
+    assert report.imported == 0
+    assert report.errors == [(1, "нет столбцов: серийный номер")]
+
+
+READINGS_CSV = """Серийный номер;Тип;Показания;Дата
+HW-1;;100;01.01.2020
+HW-1;;110,4;2020-02-01
+CW-1;хвс;50;01.01.2020
+NOPE;;1;01.01.2020
+HW-1;;abc;01.03.2020
+X-1;;5;01.01.2020
+X-1;heat;7;01.01.2020
+"""
+
+
+async def import_two_apartments(db: Database, tmp_path: Path) -> None:
+    path = tmp_path / "meters.csv"
+    path.write_text(
+        "квартира,тип,серийный номер\n1,hot_water,HW-1\n1,cold_water,CW-1\n"
+        "2,cold_water,X-1\n2,heat,X-1\n",
+        encoding="utf-8",
+    )
+    assert (await import_meters_file(db, path)).imported == 4
+
+
+# Серийные номера переводятся в serial_id, повторная загрузка не дублирует показания
+@pytest.mark.asyncio
+async def test_import_readings(session, tmp_path: Path):
+    db = Database(session, building_id=1)
+    await import_two_apartments(db, tmp_path)
+    path = tmp_path / "readings.csv"
+    path.write_text(READINGS_CSV, encoding="utf-8")
+
+    report = await import_readings_file(db, path)
+
+    assert (report.total, report.imported, report.duplicates) == (7, 4, 0)
+    assert [row_number for row_number, _ in report.errors] == [5, 6, 7]
+    assert "не найден" in report.errors[0][1]
+    assert "показания" in report.errors[1][1]
+    assert "укажите тип" in report.errors[2][1]
+    rows = (await session.execute(select(readings.c.value, readings.c.reading_date))).all()
+    assert sorted(rows) == [
+        (7, datetime(2020, 1, 1)),
+        (50, datetime(2020, 1, 1)),
+        (100, datetime(2020, 1, 1)),
+        (110, datetime(2020, 2, 1)),
+    ]
+    assert await db.get_previous_reading("hot_water", "HW-1") == {
+        "value": 110, "reading_date": datetime(2020, 2, 1)
+    }
+
+    # Тот же файл уже загружен целиком: ничего не читается заново
+    again = await import_readings_file(db, path)
+    assert (again.total, again.imported, again.resumed_from) == (7, 4, 8)
+
+    # Другой файл с теми же показаниями: ON CONFLICT пропускает дубликаты
+    copy = tmp_path / "copy.csv"
+    copy.write_text(READINGS_CSV.replace("NOPE", "NOPE2"), encoding="utf-8")
+    report = await import_readings_file(db, copy)
+    assert (report.imported, report.duplicates) == (0, 4)
+
+
+# Прерванный импорт продолжается с первой незагруженной пачки
+@pytest.mark.asyncio
+async def test_import_readings_resumes(session, tmp_path: Path, monkeypatch):
+    db = Database(session, building_id=1)
+    await import_two_apartments(db, tmp_path)
+    monkeypatch.setattr(settings, "IMPORT_BATCH_SIZE", 2)
+    path = tmp_path / "readings.csv"
+    path.write_text(
+        "serial,value,date\n" + "".join(f"HW-1,{month},2019-{month:02}-01\n" for month in range(1, 8)),
+        encoding="utf-8",
+    )
+    calls = []
+
+    async def fail_after_two_batches(processed: int, imported: int) -> None:
+        calls.append((processed, imported))
+        if len(calls) == 2:
+            raise ConnectionError("прервано")
+
+    with pytest.raises(ConnectionError):
+        await import_readings_file(db, path, fail_after_two_batches)
+
+    report = await import_readings_file(db, path, fail_after_two_batches)
+
+    assert calls == [(2, 2), (4, 4), (6, 6), (7, 7)]
+    assert (report.total, report.imported, report.resumed_from) == (7, 7, 5)
+    count = (await session.execute(select(func.count()).select_from(readings))).scalar()
+    assert count == 7
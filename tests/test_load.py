@@ -0,0 +1,19 @@
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+
+# Короткий нагрузочный прогон через main.dp: все обновления обработаны без ошибок,
+# а показания каждой квартиры сохранены
+def test_load_dispatcher_smoke():
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.load_dispatcher", "--apartments", "5"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "stored readings: 15/15" in result.stdout
@@ -0,0 +1,210 @@
+import pytest
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from config import settings
+from database import engine as db_engine
+from database.database import Database
+from database.migrations import MIGRATIONS, migrate
+from database.models import metadata
+
+# Схема базы данных до появления миграций
+BASELINE_SCHEMA = [
+    """
+    CREATE TABLE meter_types (
+        type_id INTEGER NOT NULL, name VARCHAR NOT NULL, unit VARCHAR NOT NULL,
+        PRIMARY KEY (type_id)
+    )
+    """,
+    """
+    CREATE TABLE users (
+        user_id INTEGER NOT NULL, apartment_number INTEGER NOT NULL,
+        first_name VARCHAR, last_name VARCHAR,
+        PRIMARY KEY (user_id)
+    )
+    """,
+    """
+    CREATE TABLE meters (
+        meter_id INTEGER NOT NULL, apartment_number INTEGER, type_id INTEGER NOT NULL,
+        count_meter INTEGER NOT NULL,
+        PRIMARY KEY (meter_id),
+        FOREIGN KEY(apartment_number) REFERENCES users (apartment_number),
+        FOREIGN KEY(type_id) REFERENCES meter_types (type_id)
+    )
+    """,
+    """
+    CREATE TABLE readings (
+        reading_id INTEGER NOT NULL, meter_id INTEGER, user_id INTEGER, serial_id INTEGER,
+        value INTEGER NOT NULL, reading_date DATETIME NOT NULL,
+        PRIMARY KEY (reading_id),
+        CONSTRAINT uix_meter_reading_date UNIQUE (meter_id, reading_date, serial_id),
+        FOREIGN KEY(meter_id) REFERENCES meters (meter_id),
+        FOREIGN KEY(user_id) REFERENCES users (user_id)
+    )
+    """,
+    """
+    CREATE TABLE serials (
+        serial_id INTEGER NOT NULL, meter_id INTEGER, serial_number VARCHAR(20) NOT NULL,
+        PRIMARY KEY (serial_id),
+        FOREIGN KEY(meter_id) REFERENCES meters (meter_id)
+    )
+    """,
+    """
+    CREATE TABLE meter_descriptions (
+        desc_id INTEGER NOT NULL, serial_id INTEGER, description VARCHAR(50) NOT NULL,
+        PRIMARY KEY (desc_id),
+        FOREIGN KEY(serial_id) REFERENCES serials (serial_id)
+    )
+    """,
+]
+
+BASELINE_DATA = [
+    "INSERT INTO meter_types VALUES (1, 'electricity', 'kWh'), (2, 'heat', 'Gcal'), "
+    "(3, 'hot_water', 'm3'), (4, 'cold_water', 'm3')",
+    "INSERT INTO users VALUES (100, 7, 'Иван', NULL)",
+    "INSERT INTO meters VALUES (1, 7, 3, 2)",
+    # Серийный номер 'hw-1' введён дважды
+    "INSERT INTO serials VALUES (1, 1, 'hw-1'), (2, 1, 'hw-1'), (3, 1, 'hw-2')",
+    "INSERT INTO meter_descriptions VALUES (1, 1, 'Кухня'), (2, 2, 'Кухня'), (3, 3, 'Ванная')",
+    "INSERT INTO readings VALUES "
+    "(1, 1, 100, 1, 10, '2025-01-01 00:00:00.000000'), "
+    "(2, 1, 100, 2, 10, '2025-01-01 00:00:00.000000'), "
+    "(3, 1, 100, 2, 12, '2025-02-01 00:00:00.000000'), "
+    "(4, 1, 100, 3, 5, '2025-02-01 00:00:00.000000')",
+]
+
+
+@pytest.mark.asyncio
+async def test_upgrade_baseline_database(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'baseline.db'}")
+    async with engine.begin() as conn:
+        for statement in BASELINE_SCHEMA + BASELINE_DATA:
+            await conn.execute(text(statement))
+
+    # Как при старте бота: create_all, затем миграции
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+    assert await migrate(engine) == [step.version for step in sorted(MIGRATIONS)]
+    assert await migrate(engine) == []
+
+    async with engine.connect() as conn:
+        def schema(sync_conn):
+            inspector = inspect(sync_conn)
+            return {
+                "columns": {c["name"] for c in inspector.get_columns("readings")},
+                "indexes": {
+                    index["name"]
+                    for table in ("users", "meters", "readings", "serials")
+                    for index in inspector.get_indexes(table)
+                },
+                "readings_fks": inspector.get_foreign_keys("readings"),
+                "meters_fks": inspector.get_foreign_keys("meters"),
+            }
+
+        result = await conn.run_sync(schema)
+        serials = (await conn.execute(text("SELECT serial_id, serial_number FROM serials ORDER BY 1"))).all()
+        readings = (
+            await conn.execute(text("SELECT reading_id, serial_id, value, building_id FROM readings ORDER BY 1"))
+        ).all()
+        descriptions = (await conn.execute(text("SELECT serial_id FROM meter_descriptions ORDER BY 1"))).all()
+        meter_type_steps = (
+            await conn.execute(text("SELECT name, title, min_count, max_count FROM meter_types ORDER BY position"))
+        ).all()
+
+    assert "building_id" in result["columns"]
+    assert {
+        "ix_users_building_apartment",
+        "ix_meters_building_apartment_type",
+        "ix_readings_building_date",
+        "ux_serials_meter_serial",
+    } <= result["indexes"]
+    user_fk = next(fk for fk in result["readings_fks"] if fk["constrained_columns"] == ["user_id"])
+    assert user_fk["options"].get("ondelete") == "SET NULL"
+    assert all(fk["constrained_columns"] != ["apartment_number"] for fk in result["meters_fks"])
+
+    # Дубликат серийного номера слит с первым, совпадающие показания удалены
+    assert serials == [(1, "hw-1"), (3, "hw-2")]
+    assert readings == [(1, 1, 10, 1), (3, 1, 12, 1), (4, 3, 5, 1)]
+    assert descriptions == [(1,), (3,)]
+    # Стандартные типы получили вопросы регистрации и порядок опроса
+    assert meter_type_steps == [
+        ("hot_water", "горячей воды", 1, 3),
+        ("cold_water", "холодной воды", 1, 3),
+        ("electricity", "электричества", 1, 3),
+        ("heat", "тепла", 0, 1),
+    ]
+
+    async with engine.connect() as conn:
+        from sqlalchemy.ext.asyncio import AsyncSession
+
+        async with AsyncSession(bind=conn) as session:
+            user = await Database(session).get_info_for_user(100)
+    assert user["building_id"] == 1
+    await engine.dispose()
+
+
+# Серийный номер введён трижды: остаётся строка с наименьшим serial_id,
+# показания и описание дубликатов переносятся на неё без повторов
+@pytest.mark.asyncio
+async def test_upgrade_triple_duplicate_serials(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'triple.db'}")
+    async with engine.begin() as conn:
+        for statement in BASELINE_SCHEMA + BASELINE_DATA[:3] + [
+            "INSERT INTO serials VALUES (1, 1, 'hw-1'), (2, 1, 'hw-1'), (3, 1, 'hw-1')",
+            "INSERT INTO meter_descriptions VALUES (1, 3, 'Кухня')",
+            "INSERT INTO readings VALUES "
+            "(1, 1, 100, 1, 10, '2025-01-01 00:00:00.000000'), "
+            "(2, 1, 100, 3, 10, '2025-01-01 00:00:00.000000'), "
+            "(3, 1, 100, 2, 12, '2025-02-01 00:00:00.000000'), "
+            "(4, 1, 100, 3, 12, '2025-02-01 00:00:00.000000'), "
+            "(5, 1, 100, 3, 15, '2025-03-01 00:00:00.000000')",
+        ]:
+            await conn.execute(text(statement))
+        await conn.run_sync(metadata.create_all)
+
+    assert await migrate(engine) == [step.version for step in sorted(MIGRATIONS)]
+
+    async with engine.connect() as conn:
+        serials = (await conn.execute(text("SELECT serial_id, serial_number FROM serials"))).all()
+        readings = (await conn.execute(text("SELECT reading_id, serial_id, value FROM readings ORDER BY 1"))).all()
+        descriptions = (await conn.execute(text("SELECT serial_id, description FROM meter_descriptions"))).all()
+    assert serials == [(1, "hw-1")]
+    assert readings == [(1, 1, 10), (3, 1, 12), (5, 1, 15)]
+    assert descriptions == [(1, "Кухня")]
+    await engine.dispose()
+
+
+# На новой базе, созданной create_all, миграции только отмечаются
+@pytest.mark.asyncio
+async def test_fresh_database_is_only_stamped(session):
+    assert await migrate(session.bind) == [step.version for step in sorted(MIGRATIONS)]
+    assert await migrate(session.bind) == []
+
+
+# Старт бота на базе до миграций с пустым справочником типов: столбцы
+# meter_types добавляются миграцией до заполнения справочника
+@pytest.mark.asyncio
+async def test_create_db_on_baseline_with_empty_meter_types(tmp_path, monkeypatch):
+    url = f"sqlite+aiosqlite:///{tmp_path / 'baseline.db'}"
+    monkeypatch.setattr(settings, "BUILDING_DB_URLS", {96: url})
+    monkeypatch.setattr(settings, "BUILDINGS", {96: 10})
+    monkeypatch.setattr(settings, "DB_SPLIT_READS", False)
+    async with db_engine.get_engine(96).begin() as conn:
+        for statement in BASELINE_SCHEMA:
+            await conn.execute(text(statement))
+
+    await db_engine.create_db()
+    await db_engine.create_db()
+
+    async with db_engine.get_engine(96).connect() as conn:
+        meter_type_steps = (
+            await conn.execute(text("SELECT name, title, min_count, max_count FROM meter_types ORDER BY position"))
+        ).all()
+    assert meter_type_steps == [
+        ("hot_water", "горячей воды", 1, 3),
+        ("cold_water", "холодной воды", 1, 3),
+        ("electricity", "электричества", 1, 3),
+        ("heat", "тепла", 0, 1),
+    ]
+    await db_engine._engines.pop(url).dispose()
+    db_engine._session_makers.pop(url, None)
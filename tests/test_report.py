@@ -0,0 +1,89 @@
+from datetime import date, datetime
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.methods import SendDocument
+from aiogram.types import FSInputFile
+
+from config import settings
+from database.database import Database
+from utils.report_utils import due_periods, send_due_reports
+
+
+def test_due_periods(monkeypatch):
+    monkeypatch.setattr(settings, "REPORT_DAY", 25)
+    monkeypatch.setattr(settings, "DELTA_MONTH", 1)
+
+    # Период закрывается REPORT_DAY числа следующего месяца
+    assert due_periods(date(2025, 6, 24), None) == []
+    assert due_periods(date(2025, 6, 25), None) == [datetime(2025, 5, 1)]
+    # Последний отчёт досылается, пропущенные за время простоя периоды добавляются
+    assert due_periods(date(2025, 6, 10), datetime(2025, 4, 1)) == [datetime(2025, 4, 1)]
+    assert due_periods(date(2025, 9, 26), datetime(2025, 5, 1)) == [
+        datetime(2025, 5, 1),
+        datetime(2025, 6, 1),
+        datetime(2025, 7, 1),
+        datetime(2025, 8, 1),
+    ]
+
+
+# Отчёт загружается один раз, остальным администраторам уходит file_id;
+# недоставленный отчёт досылается при следующей проверке, повторов нет
+@pytest.mark.asyncio
+async def test_send_due_reports(session, monkeypatch):
+    monkeypatch.setattr(settings, "ADMIN_IDS", [1, 2, 3])
+    db = Database(session, building_id=1)
+    await db.add_info_apartment(
+        {
+            "user_id": 100,
+            "first_name": "User",
+            "apartment_number": 5,
+            "meters": {"hot_water": {"serials": ["HW-5"], "descriptions": ["Кухня"]}},
+        }
+    )
+    await db.add_reading(
+        {"apartment_number": 5, "meter_type": "hot_water", "serial_number": "HW-5", "user_id": 100, "value": 7}
+    )
+    # Отчётный период текущих показаний уже закрыт
+    monkeypatch.setattr(settings, "REPORT_DAY", 1)
+
+    bot = MagicMock()
+    uploaded = MagicMock()
+    uploaded.document.file_id = "FILE_ID"
+    blocked = TelegramForbiddenError(method=SendDocument(chat_id=2, document="FILE_ID"), message="blocked")
+    bot.send_document = AsyncMock(side_effect=[uploaded, blocked, None])
+
+    await send_due_reports(bot, db)
+
+    calls = bot.send_document.await_args_list
+    assert [call.args[0] for call in calls] == [1, 2, 3]
+    assert isinstance(calls[0].args[1], FSInputFile)
+    assert [call.args[1] for call in calls[1:]] == ["FILE_ID", "FILE_ID"]
+
+    bot.send_document = AsyncMock()
+    await send_due_reports(bot, db)
+    bot.send_document.assert_awaited_once()
+    assert bot.send_document.await_args.args[:2] == (2, "FILE_ID")
+
+    bot.send_document = AsyncMock()
+    await send_due_reports(bot, db)
+    bot.send_document.assert_not_awaited()
+
+
+# За период без показаний администраторы получают сообщение, а не пустой файл
+@pytest.mark.asyncio
+async def test_report_without_readings(session, monkeypatch):
+    monkeypatch.setattr(settings, "ADMIN_IDS", [1])
+    monkeypatch.setattr(settings, "REPORT_DAY", 1)
+    db = Database(session, building_id=1)
+    bot = MagicMock()
+    bot.send_document = AsyncMock()
+    bot.send_message = AsyncMock()
+
+    await send_due_reports(bot, db)
+    await send_due_reports(bot, db)
+
+    bot.send_document.assert_not_awaited()
+    bot.send_message.assert_awaited_once()
+    assert "показаний нет" in bot.send_message.await_args.args[1]
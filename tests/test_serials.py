@@ -0,0 +1,205 @@
+from datetime import date, datetime
+from unittest.mock import AsyncMock
+
+import pytest
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import create_engine, delete, insert, select
+
+from config import settings
+from database import queries
+from database.database import Database, get_reading_date
+from database.models import metadata, readings, serials
+from handlers import user_handlers
+from states.states import EditSerialsStates
+from tests.test_export import add_apartments
+
+
+def current_period() -> datetime:
+    period = date.today() - relativedelta(months=settings.DELTA_MONTH)
+    return datetime(period.year, period.month, 1)
+
+
+def query_plan(statement, **params) -> list[str]:
+    engine = create_engine("sqlite://")
+    metadata.create_all(engine)
+    compiled = statement.compile(dialect=engine.dialect)
+    values = compiled.construct_params(params)
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(
+            f"EXPLAIN QUERY PLAN {compiled}",
+            tuple(values[name] for name in compiled.positiontup),
+        ).all()
+    engine.dispose()
+    return [row[3] for row in rows]
+
+
+# Поиск по серийному номеру идёт по индексам, а не перебором таблиц
+@pytest.mark.parametrize(
+    "statement, params",
+    [
+        (queries.select_previous_reading, {"serial_number": "HW-1", "meter_type": "hot_water", "current_period": "2024-01-01"}),
+        (queries.update_serial_number, {"old_serial": "HW-1", "new_serial": "HW-2", "user_id": 1}),
+        (queries.insert_description, {"apartment_number": 1, "meter_type": "hot_water", "serial": "HW-1", "description": "Кухня"}),
+        (queries.select_serials_and_descriptions_by_type, {"apartment_number": 1, "meter_type": "hot_water"}),
+        (queries.insert_reading, {"apartment_number": 1, "meter_type": "hot_water", "serial_number": "HW-1", "user_id": 1, "value": 1, "reading_date": "2024-01-01"}),
+    ],
+)
+def test_serial_lookups_use_indexes(statement, params):
+    plan = query_plan(statement, building_id=1, **params)
+
+    assert any("ux_serials_meter_serial" in step or "SEARCH serials USING INTEGER PRIMARY KEY" in step for step in plan)
+    for table in ("serials", "meter_descriptions", "serial_history"):
+        assert not any(step.startswith(f"SCAN {table}") for step in plan), plan
+
+
+# Замена счетчика посреди месяца: расход делится между старым и новым
+@pytest.mark.asyncio
+async def test_replace_serial_splits_consumption(session):
+    db = Database(session, building_id=1)
+    await add_apartments(db, 1)
+    period = current_period()
+    await session.execute(delete(readings))
+    await session.execute(
+        insert(readings),
+        {"building_id": 1, "meter_id": 1, "user_id": 1, "serial_id": 1,
+         "value": 100, "reading_date": period - relativedelta(months=1)},
+    )
+    await session.commit()
+
+    assert (await db.get_user_serial("HW-1", 1))["has_readings"]
+    assert await db.replace_serial("HW-1", "HW-1N", 1, period + relativedelta(days=5), 130, 0)
+    assert not await db.replace_serial("HW-1", "HW-2N", 1, period + relativedelta(days=6), 130, 0)
+
+    # Снятый счетчик не показывается жильцу и не принимает показания
+    meters = await db.get_all_meters_serials_and_descriptions(1)
+    assert [(meter["serial_number"], meter["description"]) for meter in meters] == [("HW-1N", "Кухня")]
+    new_serial = await db.get_user_serial("HW-1N", 1)
+    assert not new_serial["has_readings"]
+
+    await session.execute(
+        insert(readings),
+        {"building_id": 1, "meter_id": 1, "user_id": 1, "serial_id": new_serial["serial_id"],
+         "value": 20, "reading_date": period + relativedelta(days=10)},
+    )
+    await session.commit()
+
+    # 130 - 100 по старому счетчику и 20 - 0 по новому
+    consumption = await db.get_period_consumption(period)
+    assert [(row["apartment_number"], row["consumption"]) for row in consumption] == [(1, 50)]
+
+
+# Замена через /edit_serials датируется так же, как показания периода:
+# расход замены попадает в текущий период, а следующий не уходит в минус
+@pytest.mark.asyncio
+async def test_replace_serial_from_handler_uses_reading_period(session):
+    db = Database(session, building_id=1)
+    await add_apartments(db, 1)
+    period = current_period()
+    await session.execute(delete(readings))
+    await session.execute(
+        insert(readings),
+        {"building_id": 1, "meter_id": 1, "user_id": 1, "serial_id": 1,
+         "value": 100, "reading_date": get_reading_date() - relativedelta(months=1)},
+    )
+    await session.commit()
+
+    state = FSMContext(
+        storage=MemoryStorage(), key=StorageKey(bot_id=1, chat_id=1, user_id=1)
+    )
+    await state.set_data({"selected_serial": "HW-1"})
+    for handler, text in [
+        (user_handlers.process_new_serial, "HW-1N"),
+        (user_handlers.ask_replace_values, None),
+        (user_handlers.process_replace_values, "130 0"),
+    ]:
+        update = AsyncMock()
+        update.text = text
+        update.from_user.id = 1
+        if handler is user_handlers.ask_replace_values:
+            await handler(update, state)
+        else:
+            await handler(update, state, session, 1)
+    assert await state.get_state() is None
+
+    await db.add_reading(
+        {"apartment_number": 1, "meter_type": "hot_water", "serial_number": "HW-1N",
+         "user_id": 1, "value": 20}
+    )
+    consumption = await db.get_period_consumption(period)
+    assert [(row["apartment_number"], row["consumption"]) for row in consumption] == [(1, 50)]
+
+    new_serial = await db.get_user_serial("HW-1N", 1)
+    await session.execute(
+        insert(readings),
+        {"building_id": 1, "meter_id": 1, "user_id": 1, "serial_id": new_serial["serial_id"],
+         "value": 35, "reading_date": get_reading_date() + relativedelta(months=1)},
+    )
+    await session.commit()
+    consumption = await db.get_period_consumption(period + relativedelta(months=1))
+    assert [(row["apartment_number"], row["consumption"]) for row in consumption] == [(1, 15)]
+
+    history = await db.get_consumption_history(1)
+    assert all(row["consumption"] is None or row["consumption"] >= 0 for row in history)
+
+
+# Номер, который уже есть у счетчика, не меняется и не заменяется:
+# жилец получает ответ и может ввести другой номер
+@pytest.mark.asyncio
+async def test_duplicate_serial_is_rejected(session):
+    db = Database(session, building_id=1)
+    await db.add_info_apartment(
+        {
+            "user_id": 1,
+            "first_name": "User1",
+            "apartment_number": 1,
+            "meters": {"hot_water": {"serials": ["HW-1", "HW-2"], "descriptions": ["Кухня", "Ванная"]}},
+        }
+    )
+    state = FSMContext(
+        storage=MemoryStorage(), key=StorageKey(bot_id=1, chat_id=1, user_id=1)
+    )
+    await state.set_state(EditSerialsStates.edit_serial)
+    await state.set_data({"selected_serial": "HW-1"})
+    message = AsyncMock()
+    message.text = "HW-2"
+    message.from_user.id = 1
+    await user_handlers.process_new_serial(message, state, session, 1)
+
+    message.answer.assert_called_once_with(user_handlers.serial_exists_text("HW-2"))
+    assert await state.get_state() == EditSerialsStates.edit_serial
+    assert not await db.update_serial_number("HW-1", "HW-2", 1)
+    assert not await db.replace_serial("HW-1", "HW-2", 1)
+
+    # Снятый номер не виден среди установленных, его ловит уникальный индекс
+    assert await db.replace_serial("HW-1", "HW-3", 1)
+    assert not await db.update_serial_number("HW-2", "HW-1", 1)
+    meters = await db.get_all_meters_serials_and_descriptions(1)
+    assert sorted(meter["serial_number"] for meter in meters) == ["HW-2", "HW-3"]
+
+
+# Снятый при замене номер не исправляется как опечатка: связь с историей
+# замен сохраняется
+@pytest.mark.asyncio
+async def test_replaced_serial_not_typo_fixed(session):
+    db = Database(session, building_id=1)
+    await add_apartments(db, 1)
+    assert await db.replace_serial("HW-1", "HW-1N", 1, end_value=130, start_value=0)
+
+    assert not await db.update_serial_number("HW-1", "HW-1X", 1)
+    serial_numbers = (await session.execute(select(serials.c.serial_number).order_by(serials.c.serial_id))).scalars()
+    assert list(serial_numbers) == ["HW-1", "HW-1N"]
+
+    state = FSMContext(
+        storage=MemoryStorage(), key=StorageKey(bot_id=1, chat_id=1, user_id=1)
+    )
+    await state.set_state(EditSerialsStates.replace_or_fix)
+    await state.set_data({"selected_serial": "HW-1", "new_serial": "HW-1X"})
+    callback = AsyncMock()
+    callback.from_user.id = 1
+    await user_handlers.fix_serial_typo(callback, state, session, 1)
+
+    callback.message.edit_text.assert_awaited_once_with("Счетчик не найден, начните заново: /edit_serials")
+    assert await state.get_state() is None
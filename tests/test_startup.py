@@ -0,0 +1,19 @@
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+
+# Импорт main не загружает модули, которые нужны только редким командам
+# администратора (openpyxl, диалект postgresql на SQLite)
+def test_bench_startup_smoke():
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_startup", "--runs", "1", "--budget-ms", "60000"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "lazy modules imported at startup: none" in result.stdout
@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from middlewere.throttling_middleware import THROTTLED_TEXT, ThrottlingMiddleware
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def user_data(user_id: int) -> dict:
+    user = MagicMock()
+    user.id = user_id
+    return {"event_from_user": user}
+
+
+# Сверх запаса обновления отбрасываются, а через 1/rate секунд проходят снова
+@pytest.mark.asyncio
+async def test_token_bucket_drops_and_refills():
+    clock = FakeClock()
+    middleware = ThrottlingMiddleware(rate=1, burst=3, clock=clock)
+    handler = AsyncMock(return_value="ok")
+
+    results = [await middleware(handler, MagicMock(), user_data(1)) for _ in range(5)]
+    assert results == ["ok", "ok", "ok", None, None]
+    assert middleware.stats["dropped"] == 2
+
+    # Другой пользователь не затронут
+    assert await middleware(handler, MagicMock(), user_data(2)) == "ok"
+
+    clock.now = 1.0
+    assert await middleware(handler, MagicMock(), user_data(1)) == "ok"
+    assert await middleware(handler, MagicMock(), user_data(1)) is None
+    assert middleware.stats["passed"] == 5
+
+
+@pytest.mark.asyncio
+async def test_throttled_user_is_warned_once():
+    from aiogram.types import Message
+
+    middleware = ThrottlingMiddleware(rate=1, burst=1, clock=FakeClock())
+    event = MagicMock(spec=Message)
+    event.answer = AsyncMock()
+
+    for _ in range(4):
+        await middleware(AsyncMock(), event, user_data(1))
+
+    event.answer.assert_awaited_once_with(THROTTLED_TEXT)
+
+
+# Обновления одного пользователя идут по очереди, разных - параллельно
+@pytest.mark.asyncio
+async def test_updates_serialized_per_user():
+    middleware = ThrottlingMiddleware(rate=100, burst=100)
+    running: dict[int, int] = {}
+    overlap = {"same_user": 0, "users": 0}
+
+    async def handler(event, data):
+        user_id = data["event_from_user"].id
+        running[user_id] = running.get(user_id, 0) + 1
+        overlap["same_user"] = max(overlap["same_user"], running[user_id])
+        overlap["users"] = max(overlap["users"], sum(1 for n in running.values() if n))
+        await asyncio.sleep(0.01)
+        running[user_id] -= 1
+
+    await asyncio.gather(
+        *(middleware(handler, MagicMock(), user_data(user_id)) for user_id in (1, 1, 1, 2, 3))
+    )
+
+    assert overlap["same_user"] == 1
+    assert overlap["users"] == 3
+    assert middleware.stats["delayed"] == 2
+    assert middleware.locks == {}
@@ -0,0 +1,109 @@
+import asyncio
+import csv
+import gzip
+import os
+from datetime import datetime
+from io import StringIO
+from logging import Logger, getLogger
+from pathlib import Path
+
+from dateutil.relativedelta import relativedelta
+
+from config import settings
+from database.database import Database
+
+logger: Logger = getLogger(__name__)
+
+ARCHIVE_FIELDS = [
+    "reading_id",
+    "building_id",
+    "apartment_number",
+    "meter_type",
+    "serial_number",
+    "user_id",
+    "value",
+    "reading_date",
+]
+
+
+def get_archive_path(building_id: int, archive_dir: Path | None = None) -> Path:
+    """Путь к архиву показаний дома"""
+    return (archive_dir or settings.ARCHIVE_DIR) / f"readings_{building_id}.csv.gz"
+
+
+def _append_rows(path: Path, rows: list[dict]) -> None:
+    """
+    Дописывает строки в архив.
+
+    Каждая пачка записывается отдельным членом gzip: файл только дополняется,
+    а при чтении члены распаковываются подряд как один поток.
+    """
+    buffer = StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=ARCHIVE_FIELDS)
+    for row in rows:
+        writer.writerow({**row, "reading_date": row["reading_date"].isoformat()})
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "ab") as file:
+        file.write(gzip.compress(buffer.getvalue().encode("utf-8")))
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def _read_rows(path: Path, serial_number: str) -> list[dict]:
+    if not path.exists():
+        return []
+    rows: dict[int, dict] = {}
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as file:
+        for row in csv.DictReader(file, fieldnames=ARCHIVE_FIELDS):
+            if row["serial_number"] == serial_number:
+                # Пачка могла быть записана повторно, если удаление из БД не завершилось
+                rows[int(row["reading_id"])] = row
+    return sorted(rows.values(), key=lambda row: row["reading_date"])
+
+
+async def archive_readings(
+    db: Database, before: datetime | None = None, archive_dir: Path | None = None
+) -> int:
+    """
+    Переносит показания старше before в архив дома и удаляет их из БД.
+
+    Последние показания каждого счётчика остаются в БД, чтобы
+    get_previous_reading продолжал работать. Возвращает число перенесённых строк.
+    """
+    if before is None:
+        before = datetime.now() - relativedelta(months=settings.ARCHIVE_AFTER_MONTHS)
+    path = get_archive_path(db.building_id, archive_dir)
+    archived = 0
+    while True:
+        rows = await db.get_readings_to_archive(before, settings.ARCHIVE_BATCH_SIZE)
+        if not rows:
+            break
+        # Сначала архив сохраняется на диск, потом строки удаляются из БД
+        await asyncio.to_thread(_append_rows, path, [dict(row) for row in rows])
+        await db.delete_readings([row["reading_id"] for row in rows])
+        archived += len(rows)
+    if archived:
+        logger.info("Дом %s: в архив перенесено показаний: %s", db.building_id, archived)
+    return archived
+
+
+async def read_archive(
+    building_id: int, serial_number: str, archive_dir: Path | None = None
+) -> list[dict]:
+    """Читает из архива дома показания счётчика по серийному номеру"""
+    path = get_archive_path(building_id, archive_dir)
+    return await asyncio.to_thread(_read_rows, path, serial_number)
+
+
+async def archive_loop() -> None:
+    """Периодически архивирует показания всех домов"""
+    from database.engine import get_session_maker
+
+    while True:
+        for building_id in settings.BUILDINGS:
+            try:
+                async with get_session_maker(building_id)() as session:
+                    await archive_readings(Database(session, building_id))
+            except Exception as e:
+                logger.error("Ошибка архивации показаний дома %s: %s", building_id, e)
+        await asyncio.sleep(settings.ARCHIVE_INTERVAL_HOURS * 3600)
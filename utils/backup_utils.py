@@ -0,0 +1,211 @@
+"""
+Резервные копии баз данных SQLite.
+
+Копия снимается онлайн через backup API SQLite: страницы копируются пачками
+по BACKUP_PAGES_PER_STEP с паузой BACKUP_STEP_SLEEP между ними, поэтому бот
+продолжает писать в базу во время копирования. Запись в базу другим
+соединением начинает копирование заново; после BACKUP_MAX_RESTARTS
+перезапусков база копируется за один шаг (в режиме WAL чтение снимка не
+блокирует запись). Снимок сжимается в BACKUP_DIR, хранятся BACKUP_KEEP
+последних снимков каждой базы.
+
+Запуск вручную:
+    python -m utils.backup_utils                   # снимки всех баз
+    python -m utils.backup_utils --verify FILE     # проверить снимок
+    python -m utils.backup_utils --restore FILE --to PATH
+"""
+import argparse
+import asyncio
+import gzip
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+from datetime import datetime
+from logging import Logger, getLogger
+from pathlib import Path
+
+from sqlalchemy import make_url
+
+from config import settings
+
+logger: Logger = getLogger(__name__)
+
+
+def sqlite_path(url: str) -> Path | None:
+    """Файл базы данных SQLite из URL, None - не файл SQLite"""
+    database_url = make_url(url)
+    if database_url.get_backend_name() != "sqlite":
+        return None
+    if database_url.database in (None, "", ":memory:"):
+        return None
+    return Path(database_url.database)
+
+
+def database_files() -> list[Path]:
+    """Файлы SQLite всех домов (общая база и отдельные файлы)"""
+    paths = []
+    for building_id in settings.BUILDINGS:
+        path = sqlite_path(settings.db_url_for(building_id))
+        if path is not None and path not in paths:
+            paths.append(path)
+    return paths
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _copy_online(source: Path, target: Path) -> int:
+    """
+    Копирует базу через backup API пачками страниц, возвращает число
+    перезапусков копирования.
+
+    Параметр sleep у backup() действует только при занятой базе, поэтому
+    пауза между пачками делается в progress.
+    """
+    restarts = 0
+    copied = 0
+
+    def pause(status: int, remaining: int, total: int) -> None:
+        nonlocal restarts, copied
+        # Скопировано не больше, чем на прошлом шаге: база изменилась,
+        # копия началась заново
+        if total - remaining <= copied:
+            restarts += 1
+            if restarts > settings.BACKUP_MAX_RESTARTS:
+                raise _TooManyRestarts
+        copied = total - remaining
+        if remaining:
+            time.sleep(settings.BACKUP_STEP_SLEEP)
+
+    with closing(sqlite3.connect(source)) as src, closing(sqlite3.connect(target)) as dst:
+        try:
+            src.backup(dst, pages=settings.BACKUP_PAGES_PER_STEP, progress=pause)
+        except _TooManyRestarts:
+            logger.warning("Копирование %s перезапускалось %s раз, копия за один шаг", source, restarts)
+            src.backup(dst)
+    return restarts
+
+
+def _compress(source: Path, target: Path) -> None:
+    partial = target.with_suffix(target.suffix + ".part")
+    with open(source, "rb") as raw, gzip.open(partial, "wb") as packed:
+        shutil.copyfileobj(raw, packed)
+    # Снимок появляется под своим именем только целиком
+    partial.replace(target)
+
+
+def _rotate(backup_dir: Path, stem: str, keep: int) -> None:
+    """Удаляет старые снимки базы stem, оставляя keep последних"""
+    snapshots = sorted(backup_dir.glob(f"{stem}_*.db.gz"))
+    for snapshot in snapshots[:-keep] if keep > 0 else snapshots:
+        snapshot.unlink()
+        logger.info("Удалён старый снимок %s", snapshot.name)
+
+
+def snapshot_file(source: Path, backup_dir: Path | None = None) -> Path:
+    """Снимает сжатую копию файла базы данных и удаляет старые снимки"""
+    if not source.exists():
+        raise FileNotFoundError(f"Нет файла базы данных {source}")
+    backup_dir = backup_dir or settings.BACKUP_DIR
+    backup_dir.mkdir(parents=True, exist_ok=True)
+    target = backup_dir / f"{source.stem}_{datetime.now():%Y%m%d_%H%M%S_%f}.db.gz"
+    with tempfile.TemporaryDirectory(dir=backup_dir) as tmp:
+        copy = Path(tmp) / source.name
+        _copy_online(source, copy)
+        _compress(copy, target)
+    _rotate(backup_dir, source.stem, settings.BACKUP_KEEP)
+    logger.info("Снимок %s сохранён в %s", source, target)
+    return target
+
+
+def _check_database(path: Path) -> dict[str, int]:
+    from database.models import metadata
+
+    with closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as conn:
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        if result != "ok":
+            raise ValueError(f"Снимок повреждён: {result}")
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        missing = set(metadata.tables) - tables
+        if missing:
+            raise ValueError(f"В снимке нет таблиц: {', '.join(sorted(missing))}")
+        counts = {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in sorted(metadata.tables)
+        }
+    return counts
+
+
+def verify_snapshot(snapshot: Path) -> dict[str, int]:
+    """
+    Проверяет, что из снимка восстанавливается рабочая база.
+
+    Снимок распаковывается во временный файл, проверяются целостность и
+    наличие всех таблиц. Возвращает число строк в таблицах, при ошибке -
+    ValueError.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        restored = Path(tmp) / "restored.db"
+        try:
+            with gzip.open(snapshot, "rb") as packed, open(restored, "wb") as raw:
+                shutil.copyfileobj(packed, raw)
+        except (OSError, EOFError) as e:
+            raise ValueError(f"Снимок не распаковывается: {e}") from e
+        try:
+            return _check_database(restored)
+        except sqlite3.DatabaseError as e:
+            raise ValueError(f"Снимок повреждён: {e}") from e
+
+
+def restore_snapshot(snapshot: Path, target: Path) -> dict[str, int]:
+    """Восстанавливает базу из проверенного снимка в новый файл target"""
+    if target.exists():
+        raise FileExistsError(f"{target} уже существует")
+    counts = verify_snapshot(snapshot)
+    with gzip.open(snapshot, "rb") as packed, open(target, "wb") as raw:
+        shutil.copyfileobj(packed, raw)
+    return counts
+
+
+async def backup_databases(backup_dir: Path | None = None) -> list[Path]:
+    """Снимает копии всех баз данных SQLite, не блокируя цикл событий"""
+    snapshots = []
+    for path in database_files():
+        snapshots.append(await asyncio.to_thread(snapshot_file, path, backup_dir))
+    return snapshots
+
+
+async def backup_loop() -> None:
+    """Периодически снимает копии баз данных"""
+    while True:
+        try:
+            await backup_databases()
+        except Exception as e:
+            logger.error("Ошибка резервного копирования: %s", e)
+        await asyncio.sleep(settings.BACKUP_INTERVAL_HOURS * 3600)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Резервные копии баз данных SQLite")
+    parser.add_argument("--verify", type=Path, help="проверить снимок")
+    parser.add_argument("--restore", type=Path, help="восстановить базу из снимка")
+    parser.add_argument("--to", type=Path, help="файл восстановленной базы")
+    args = parser.parse_args()
+
+    if args.restore:
+        if not args.to:
+            parser.error("--restore требует --to")
+        counts = restore_snapshot(args.restore, args.to)
+        print(f"База восстановлена в {args.to}: {counts}")
+    elif args.verify:
+        print(f"Снимок в порядке: {verify_snapshot(args.verify)}")
+    else:
+        for snapshot in asyncio.run(backup_databases()):
+            print(snapshot)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Начисления по показаниям счетчиков.
+
+Расход квартир дома за период считает база одним запросом
+(Database.get_period_consumption), здесь к нему за один проход
+применяются тарифы дома, действующие на начало периода (Database.get_tariffs):
+
+- у типа счетчика может быть несколько зон: "" - весь расход, "day"/"night" -
+  дневной и ночной. Показания однотарифные, поэтому зона получает долю
+  расхода zone_share;
+- ступенчатый тариф зоны - несколько строк с разными tier_from: цена строки
+  действует для расхода свыше tier_from до следующей ступени.
+
+Суммы считаются в Decimal и округляются до копеек.
+"""
+from datetime import date, datetime
+from decimal import ROUND_HALF_UP, Decimal
+from logging import Logger, getLogger
+from typing import Iterator, Mapping, NamedTuple, Sequence
+
+from dateutil.relativedelta import relativedelta
+
+from config import settings
+from database.database import Database
+
+logger: Logger = getLogger(__name__)
+
+KOPECK = Decimal("0.01")
+
+ZONE_TITLES: dict[str, str] = {"": "", "day": "день", "night": "ночь"}
+
+# Столбцы выгрузки начислений: поле строки -> заголовок
+INVOICE_COLUMNS = {
+    "apartment_number": "Квартира",
+    "service": "Услуга",
+    "consumption": "Расход",
+    "price": "Тариф",
+    "amount": "Сумма",
+}
+
+
+class InvoiceLine(NamedTuple):
+    service: str  # Тип счетчика, зона и ступень тарифа
+    consumption: float
+    price: float
+    amount: Decimal
+
+
+class Invoice(NamedTuple):
+    apartment_number: int
+    lines: list[InvoiceLine]
+    total: Decimal
+
+
+# Ступень тарифа: (расход, с которого действует цена, цена)
+Tier = tuple[float, float]
+
+
+def tier_charges(consumption: float, tiers: list[Tier]) -> list[tuple[float, float, float]]:
+    """Раскладывает расход по ступеням: (начало ступени, расход на ступени, цена)"""
+    charges = []
+    for position, (tier_from, price) in enumerate(tiers):
+        upper = tiers[position + 1][0] if position + 1 < len(tiers) else consumption
+        part = round(min(consumption, upper) - tier_from, 3)
+        if part > 0:
+            charges.append((tier_from, part, price))
+    return charges
+
+
+def group_tariffs(tariffs: Sequence[Mapping]) -> dict[int, dict[str, tuple[float, list[Tier]]]]:
+    """Тарифы по типам счетчиков и зонам: type_id -> зона -> (доля расхода, ступени)"""
+    plans: dict[int, dict[str, tuple[float, list[Tier]]]] = {}
+    for tariff in tariffs:
+        zones = plans.setdefault(tariff["type_id"], {})
+        share, tiers = zones.setdefault(tariff["zone"], (tariff["zone_share"], []))
+        tiers.append((tariff["tier_from"], tariff["price"]))
+    for zones in plans.values():
+        for _, tiers in zones.values():
+            tiers.sort()
+    return plans
+
+
+def service_title(label: str, unit: str, zone: str, tier_from: float) -> str:
+    parts = [label, ZONE_TITLES.get(zone, zone)]
+    if tier_from:
+        parts.append(f"свыше {tier_from:g} {unit}")
+    return ", ".join(part for part in parts if part)
+
+
+def build_invoices(consumption: Sequence[Mapping], tariffs: Sequence[Mapping]) -> list[Invoice]:
+    """
+    Счета квартир по расходу за период.
+
+    Расход без тарифа и расход счетчиков без предыдущего показания
+    (None) не начисляется.
+    """
+    plans = group_tariffs(tariffs)
+    lines: dict[int, list[InvoiceLine]] = {}
+    for row in consumption:
+        zones = plans.get(row["type_id"])
+        if not zones or row["consumption"] is None:
+            continue
+        apartment_lines = lines.setdefault(row["apartment_number"], [])
+        for zone, (share, tiers) in zones.items():
+            for tier_from, part, price in tier_charges(row["consumption"] * share, tiers):
+                amount = (Decimal(str(part)) * Decimal(str(price))).quantize(KOPECK, ROUND_HALF_UP)
+                apartment_lines.append(
+                    InvoiceLine(service_title(row["label"], row["unit"], zone, tier_from), part, price, amount)
+                )
+    return [
+        Invoice(apartment, apartment_lines, sum((line.amount for line in apartment_lines), Decimal(0)))
+        for apartment, apartment_lines in sorted(lines.items())
+        if apartment_lines
+    ]
+
+
+def invoice_rows(invoices: list[Invoice]) -> Iterator[dict]:
+    """Строки выгрузки: строки счёта квартиры и итог"""
+    for invoice in invoices:
+        for line in invoice.lines:
+            yield {"apartment_number": invoice.apartment_number, **line._asdict()}
+        yield {
+            "apartment_number": invoice.apartment_number,
+            "service": "Итого",
+            "consumption": None,
+            "price": None,
+            "amount": invoice.total,
+        }
+
+
+async def compute_invoices(db: Database, period: date | None = None) -> list[Invoice]:
+    """Счета квартир дома за период (по умолчанию текущий отчётный)"""
+    if period is None:
+        period = date.today() - relativedelta(months=settings.DELTA_MONTH)
+    tariffs = await db.get_tariffs(period)
+    if not tariffs:
+        return []
+    invoices = build_invoices(await db.get_period_consumption(period), tariffs)
+    logger.info("Начисления дома %s за %s: %s квартир", db.building_id, f"{period:%m.%Y}", len(invoices))
+    return invoices
+
+
+def parse_number(value: str) -> float:
+    try:
+        return float(value.replace(",", "."))
+    except ValueError:
+        raise ValueError(f"не число: {value}") from None
+
+
+def parse_tariff(text: str, meter_types: Sequence[str]) -> dict:
+    """
+    Разбирает аргументы /tariff: <тип> <цена> [from=ДД.ММ.ГГГГ] [zone=day|night]
+    [share=0.7] [tier=100]. Тип - одно из имён meter_types из базы. Без from
+    тариф действует с начала текущего отчётного периода. ValueError - текст
+    ошибки для администратора.
+    """
+    args = text.split()
+    if len(args) < 2:
+        raise ValueError("укажите тип счётчика и цену")
+    meter_type, price, *options = args
+    if meter_type not in meter_types:
+        raise ValueError(f"тип счётчика: {', '.join(meter_types)}")
+    period = date.today() - relativedelta(months=settings.DELTA_MONTH)
+    tariff = {
+        "meter_type": meter_type,
+        "price": parse_number(price),
+        "valid_from": datetime(period.year, period.month, 1),
+        "zone": "",
+        "zone_share": 1.0,
+        "tier_from": 0.0,
+    }
+    for option in options:
+        key, _, value = option.partition("=")
+        if key == "from":
+            try:
+                tariff["valid_from"] = datetime.strptime(value, "%d.%m.%Y")
+            except ValueError:
+                raise ValueError(f"дата в формате ДД.ММ.ГГГГ: {value}") from None
+        elif key == "zone" and value in ("day", "night"):
+            tariff["zone"] = value
+        elif key == "share":
+            tariff["zone_share"] = parse_number(value)
+        elif key == "tier":
+            tariff["tier_from"] = parse_number(value)
+        else:
+            raise ValueError(f"неизвестный параметр {option}")
+    if tariff["price"] < 0 or tariff["tier_from"] < 0 or not 0 < tariff["zone_share"] <= 1:
+        raise ValueError("цена и ступень не могут быть отрицательными, доля - от 0 до 1")
+    return tariff
+
+
+def format_tariffs(tariffs: Sequence[Mapping]) -> str:
+    lines = []
+    for tariff in tariffs:
+        service = service_title(tariff["label"], "", tariff["zone"], 0)
+        if tariff["zone"]:
+            service += f" ({tariff['zone_share']:.0%})"
+        if tariff["tier_from"]:
+            service += f", свыше {tariff['tier_from']:g}"
+        lines.append(f"{service}: {tariff['price']:g} руб. с {tariff['valid_from']:%d.%m.%Y}")
+    return "\n".join(lines)
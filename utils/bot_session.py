@@ -0,0 +1,124 @@
+"""
+HTTP-сессия Bot API.
+
+Ответы жильцам, рассылки и загрузка файлов идут через разные пулы
+соединений: отправка выгрузки или резервной копии (минуты на медленном
+канале) занимает соединения отдельной сессии и не задерживает короткие
+запросы. Таймауты задаются по методам (BOT_METHOD_TIMEOUTS): ответ на
+нажатие кнопки не ждёт минуту, как загрузка документа. Время и ошибки
+каждого вызова собираются в api_metrics (/stats).
+"""
+import time
+from typing import Any
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import InputFile
+
+from config import settings
+from utils.metrics import ApiMetrics
+
+api_metrics = ApiMetrics("Telegram API")
+
+
+def has_upload(method: TelegramMethod[Any]) -> bool:
+    """Метод загружает файл (а не пересылает file_id)"""
+    return any(isinstance(value, InputFile) for value in vars(method).values())
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Записывает время и результат каждого вызова Bot API"""
+
+    def __init__(self, metrics: ApiMetrics = api_metrics):
+        self.metrics = metrics
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        started = time.perf_counter()
+        try:
+            response = await make_request(bot, method)
+        except Exception as e:
+            self.metrics.observe(method.__api_method__, time.perf_counter() - started, type(e).__name__)
+            raise
+        self.metrics.observe(method.__api_method__, time.perf_counter() - started)
+        return response
+
+
+class TunedAiohttpSession(AiohttpSession):
+    """
+    AiohttpSession с настраиваемым пулом соединений и таймаутами по методам.
+
+    Запросы с файлами передаются в upload_session, если она задана.
+    Таймаут, явно переданный вызову (getUpdates при polling), важнее
+    таймаута метода. Размер пула передаётся в конструктор AiohttpSession,
+    keepalive и кэш DNS - через _connector_init, поэтому версия aiogram
+    закреплена в pyproject.toml.
+    """
+
+    def __init__(
+        self,
+        limit: int,
+        keepalive_timeout: float,
+        dns_cache_ttl: int,
+        timeout: float,
+        method_timeouts: dict[str, float] | None = None,
+        upload_session: AiohttpSession | None = None,
+        api: TelegramAPIServer = PRODUCTION,
+    ):
+        super().__init__(limit=limit, timeout=timeout, api=api)
+        self._connector_init.update(
+            keepalive_timeout=keepalive_timeout,
+            use_dns_cache=True,
+            ttl_dns_cache=dns_cache_ttl,
+        )
+        self.method_timeouts = method_timeouts or {}
+        self.upload_session = upload_session
+
+    async def make_request(
+        self, bot: Bot, method: TelegramMethod[TelegramType], timeout: int | None = None
+    ) -> TelegramType:
+        if self.upload_session is not None and has_upload(method):
+            return await self.upload_session.make_request(bot, method, timeout)
+        if timeout is None:
+            timeout = self.method_timeouts.get(method.__api_method__)
+        return await super().make_request(bot, method, timeout)
+
+    async def close(self) -> None:
+        await super().close()
+        if self.upload_session is not None:
+            await self.upload_session.close()
+
+
+def create_bot_session(api_url: str | None = None) -> TunedAiohttpSession:
+    """Сессия Bot API по настройкам BOT_* с отдельной сессией для загрузки файлов"""
+    api_url = api_url or settings.BOT_API_URL
+    api = TelegramAPIServer.from_base(api_url) if api_url else PRODUCTION
+    upload_session = TunedAiohttpSession(
+        limit=settings.BOT_UPLOAD_CONNECTIONS,
+        keepalive_timeout=settings.BOT_KEEPALIVE_SECONDS,
+        dns_cache_ttl=settings.BOT_DNS_CACHE_SECONDS,
+        timeout=settings.BOT_UPLOAD_TIMEOUT,
+        api=api,
+    )
+    session = TunedAiohttpSession(
+        limit=settings.BOT_CONNECTION_LIMIT,
+        keepalive_timeout=settings.BOT_KEEPALIVE_SECONDS,
+        dns_cache_ttl=settings.BOT_DNS_CACHE_SECONDS,
+        timeout=settings.BOT_TIMEOUT,
+        method_timeouts=settings.BOT_METHOD_TIMEOUTS,
+        upload_session=upload_session,
+        api=api,
+    )
+    session.middleware(ApiMetricsMiddleware())
+    return session
@@ -0,0 +1,132 @@
+"""
+Рассылки жильцам с учётом недоступных получателей.
+
+Результат доставки каждому жильцу сохраняется в user_deliveries одним
+пакетным запросом после рассылки. Жилец, заблокировавший бота или удаливший
+аккаунт (TelegramForbiddenError, "chat not found"), пропускается в следующих
+рассылках с экспоненциальной отсрочкой, а после UNREACHABLE_AFTER ошибок
+подряд попадает в отчёт /unreachable, откуда администратор удаляет всех таких
+жильцов одним запросом. Успешная доставка сбрасывает счётчик ошибок. Прочие
+ошибки (сеть, сервер Telegram) считаются временными и отсрочки не дают.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from html import escape
+from logging import Logger, getLogger
+from typing import Mapping, NamedTuple, Sequence
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramRetryAfter,
+)
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from config import settings
+from database.database import Database
+
+logger: Logger = getLogger(__name__)
+
+# Сколько символов ошибки хранить в user_deliveries.last_error
+ERROR_LENGTH = 200
+
+
+class BroadcastReport(NamedTuple):
+    delivered: int
+    unreachable: int  # Бот заблокирован или аккаунт удалён
+    failed: int  # Временные ошибки
+    skipped: int  # Пропущены до окончания отсрочки
+
+
+def is_unreachable(error: TelegramAPIError) -> bool:
+    """Ошибка означает, что жилец больше не получает сообщения бота"""
+    return isinstance(error, TelegramForbiddenError) or (
+        isinstance(error, TelegramBadRequest) and "chat not found" in error.message.lower()
+    )
+
+
+def next_attempt(failures: int, now: datetime) -> datetime:
+    """Время, до которого жилец пропускается после failures ошибок подряд"""
+    hours = min(
+        settings.DELIVERY_BACKOFF_HOURS * 2 ** (failures - 1),
+        settings.DELIVERY_BACKOFF_MAX_DAYS * 24,
+    )
+    return now + timedelta(hours=hours)
+
+
+async def send_with_retry(bot: Bot, chat_id: int, text: str) -> None:
+    """Отправляет сообщение, один раз повторяя его после ограничения частоты"""
+    try:
+        await bot.send_message(chat_id, text)
+    except TelegramRetryAfter as e:
+        await asyncio.sleep(e.retry_after)
+        await bot.send_message(chat_id, text)
+
+
+async def deliver(
+    bot: Bot, users: Sequence[Mapping], text: str, now: datetime
+) -> tuple[list[dict], BroadcastReport]:
+    """Рассылает text, возвращает строки user_deliveries и итоги рассылки"""
+    outcomes = []
+    delivered = unreachable = failed = 0
+    for user in users:
+        failures = user["failures"] or 0
+        outcome = {
+            "user_id": user["user_id"],
+            "failures": 0,
+            "last_error": None,
+            "last_attempt_at": now,
+            "delivered_at": now,
+            "retry_after": None,
+        }
+        try:
+            await send_with_retry(bot, user["user_id"], text)
+            delivered += 1
+        except TelegramAPIError as e:
+            outcome["last_error"] = str(e)[:ERROR_LENGTH]
+            outcome["delivered_at"] = user["delivered_at"]
+            if is_unreachable(e):
+                unreachable += 1
+                outcome["failures"] = failures + 1
+                outcome["retry_after"] = next_attempt(failures + 1, now)
+            else:
+                failed += 1
+                outcome["failures"] = failures
+            logger.warning("Не удалось отправить сообщение пользователю %s: %s", user["user_id"], e)
+        outcomes.append(outcome)
+    return outcomes, BroadcastReport(delivered, unreachable, failed, 0)
+
+
+async def broadcast(
+    bot: Bot, session_maker: async_sessionmaker, building_id: int, text: str
+) -> BroadcastReport:
+    """
+    Рассылает text жильцам дома, кроме пропускаемых до окончания отсрочки.
+
+    Сессия не удерживается на время отправки: жильцы читаются до рассылки,
+    результаты записываются после неё.
+    """
+    now = datetime.now()
+    async with session_maker() as session:
+        db = Database(session, building_id)
+        users = await db.get_broadcast_users(now)
+        skipped = await db.count_skipped_users(now)
+    outcomes, report = await deliver(bot, users, text, now)
+    async with session_maker() as session:
+        await Database(session, building_id).record_deliveries(outcomes)
+    report = report._replace(skipped=skipped)
+    logger.info("Рассылка дома %s: %s", building_id, report)
+    return report
+
+
+def format_unreachable(users: Sequence[Mapping]) -> str:
+    lines = []
+    for user in users:
+        delivered = f"{user['delivered_at']:%d.%m.%Y}" if user["delivered_at"] else "никогда"
+        lines.append(
+            f"Кв. {user['apartment_number']}, {escape(user['first_name'] or '')} ({user['user_id']}): "
+            f"ошибок подряд {user['failures']}, последняя доставка {delivered}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,53 @@
+"""
+Расчётные показания для квартир, не подавших показания за период.
+
+Для всех счетчиков дома без показаний за месяц одним запросом берутся
+первое и последнее настоящее показание за ESTIMATE_HISTORY_MONTHS месяцев
+(Database.get_estimate_history). Средний расход в день продлевается от
+последнего показания до того же числа отчётного месяца. Расчётные показания
+помечаются estimated и удаляются, когда за этот месяц приходит настоящее
+показание (Database.add_reading, Database.import_readings).
+"""
+from datetime import date, datetime
+from logging import Logger, getLogger
+from typing import Mapping, Sequence
+
+from dateutil.relativedelta import relativedelta
+
+from config import settings
+from database.database import Database, get_period_bounds
+
+logger: Logger = getLogger(__name__)
+
+
+def estimate_readings(history: Sequence[Mapping], period_start: datetime) -> list[dict]:
+    """Расчётные показания месяца period_start по границам истории счетчиков"""
+    estimates = []
+    for row in history:
+        days = (row["last_date"] - row["first_date"]).total_seconds() / 86400
+        if days <= 0:
+            continue
+        daily = max(row["last_value"] - row["first_value"], 0) / days
+        # Показание «подаётся» в тот же день месяца, что и последнее настоящее
+        reading_date = period_start.replace(day=min(row["last_date"].day, 28))
+        elapsed = (reading_date - row["last_date"]).total_seconds() / 86400
+        estimates.append(
+            {
+                "meter_id": row["meter_id"],
+                "serial_id": row["serial_id"],
+                "user_id": None,
+                "value": round(row["last_value"] + daily * elapsed),
+                "reading_date": reading_date,
+            }
+        )
+    return estimates
+
+
+async def estimate_missing_readings(db: Database, period: date | None = None) -> int:
+    """Добавляет расчётные показания за период (по умолчанию текущий отчётный), возвращает их число"""
+    if period is None:
+        period = date.today() - relativedelta(months=settings.DELTA_MONTH)
+    history = await db.get_estimate_history(period)
+    added = await db.add_estimated_readings(estimate_readings(history, get_period_bounds(period)[0]))
+    logger.info("Расчётные показания дома %s за %s: %s", db.building_id, f"{period:%m.%Y}", added)
+    return added
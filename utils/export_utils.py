@@ -0,0 +1,192 @@
+"""
+Потоковая выгрузка показаний в CSV, JSON Lines и xlsx.
+
+Database.stream_readings_for_period отдаёт строки пачками, а писатель
+формата сразу дописывает каждую пачку в файл, поэтому память не растёт
+с числом показаний. Запись в файл идёт в отдельном потоке, чтобы не
+останавливать цикл событий бота. CSV и JSON Lines можно сжать gzip.
+
+Новый формат - класс с методами write_rows и close, добавленный в EXPORT_FORMATS.
+
+Если у дома есть тарифы, в xlsx добавляется лист начислений за период,
+а в CSV и JSON Lines начисления выгружаются отдельным файлом.
+"""
+import asyncio
+import csv
+import gzip
+import json
+from datetime import date
+from logging import Logger, getLogger
+from pathlib import Path
+from typing import IO, Iterable, Mapping
+
+from database.database import Database
+from utils.billing_utils import INVOICE_COLUMNS, compute_invoices, invoice_rows
+
+logger: Logger = getLogger(__name__)
+
+# Столбцы выгрузки: поле строки запроса -> заголовок
+EXPORT_COLUMNS = {
+    "apartment_number": "Квартира",
+    "name": "Тип счётчика",
+    "serial_number": "Серийный номер",
+    "value": "Значение",
+    "reading_date": "Дата подачи",
+    "estimated": "Расчётное",
+}
+
+
+def open_text(path: Path, compress: bool) -> IO[str]:
+    if compress:
+        return gzip.open(path, "wt", encoding="utf-8", newline="")
+    # BOM, чтобы Excel открывал CSV в UTF-8
+    return open(path, "w", encoding="utf-8-sig", newline="")
+
+
+class CsvWriter:
+    """CSV с разделителем ';' - так его открывает русский Excel"""
+    suffix = ".csv"
+    compressible = True
+
+    def __init__(self, path: Path, compress: bool = False, columns: dict = EXPORT_COLUMNS):
+        self.columns = columns
+        self.file = open_text(path, compress)
+        self.writer = csv.writer(self.file, delimiter=";")
+        self.writer.writerow(columns.values())
+
+    def write_rows(self, rows: Iterable[Mapping]) -> None:
+        self.writer.writerows([row[field] for field in self.columns] for row in rows)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class JsonlWriter:
+    """Одна строка - один JSON-объект с полями запроса"""
+    suffix = ".jsonl"
+    compressible = True
+
+    def __init__(self, path: Path, compress: bool = False, columns: dict = EXPORT_COLUMNS):
+        self.columns = columns
+        self.file = gzip.open(path, "wt", encoding="utf-8") if compress else open(path, "w", encoding="utf-8")
+
+    def write_rows(self, rows: Iterable[Mapping]) -> None:
+        self.file.writelines(
+            json.dumps(
+                {field: row[field] for field in self.columns}, ensure_ascii=False, default=str
+            ) + "\n"
+            for row in rows
+        )
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class XlsxWriter:
+    """
+    Excel в режиме write_only: строки сразу уходят во временный файл openpyxl,
+    а не в дерево ячеек. xlsx уже сжат (zip), поэтому gzip не применяется.
+    """
+    suffix = ".xlsx"
+    compressible = False
+    widths = (10, 14, 22, 12, 20, 12)
+
+    def __init__(
+        self,
+        path: Path,
+        compress: bool = False,
+        columns: dict = EXPORT_COLUMNS,
+        title: str = "Показания счетчиков",
+        widths: tuple[int, ...] = widths,
+    ):
+        # openpyxl загружается при первой выгрузке xlsx, а не при старте бота
+        import openpyxl
+
+        self.path = path
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.add_sheet(title, columns, widths)
+
+    def add_sheet(self, title: str, columns: dict, widths: tuple[int, ...]) -> None:
+        """Следующие строки пишутся на новый лист"""
+        self.columns = columns
+        self.sheet = self.workbook.create_sheet(title)
+        # В режиме write_only ширину столбцов задают до первой строки
+        for letter, width in zip("ABCDEFG", widths):
+            self.sheet.column_dimensions[letter].width = width
+        self.sheet.append(list(columns.values()))
+
+    def write_rows(self, rows: Iterable[Mapping]) -> None:
+        for row in rows:
+            self.sheet.append([row[field] for field in self.columns])
+
+    def close(self) -> None:
+        self.workbook.save(self.path)
+
+
+EXPORT_FORMATS = {"xlsx": XlsxWriter, "csv": CsvWriter, "jsonl": JsonlWriter}
+
+INVOICE_WIDTHS = (10, 40, 10, 10, 12)
+
+
+async def export_readings_file(
+    db: Database,
+    directory: Path,
+    export_format: str = "xlsx",
+    compress: bool = False,
+    period: date | None = None,
+) -> tuple[Path, int]:
+    """
+    Выгружает показания за период (по умолчанию текущий отчётный) в файл в directory.
+
+    Возвращает путь к файлу и число строк. compress сжимает файл gzip
+    (для форматов, которые ещё не сжаты).
+    """
+    writer_class = EXPORT_FORMATS[export_format]
+    compress = compress and writer_class.compressible
+    path = directory / f"meter_readings{writer_class.suffix}{'.gz' if compress else ''}"
+    writer = await asyncio.to_thread(writer_class, path, compress)
+    rows = 0
+    try:
+        async for chunk in db.stream_readings_for_period(period=period):
+            await asyncio.to_thread(writer.write_rows, chunk)
+            rows += len(chunk)
+        if rows and isinstance(writer, XlsxWriter):
+            invoices = await compute_invoices(db, period)
+            if invoices:
+                writer.add_sheet("Начисления", INVOICE_COLUMNS, INVOICE_WIDTHS)
+                await asyncio.to_thread(writer.write_rows, invoice_rows(invoices))
+    finally:
+        await asyncio.to_thread(writer.close)
+    logger.info("Выгрузка %s дома %s: %s строк", path.name, db.building_id, rows)
+    return path, rows
+
+
+async def export_invoices_file(
+    db: Database,
+    directory: Path,
+    export_format: str = "xlsx",
+    compress: bool = False,
+    period: date | None = None,
+) -> tuple[Path, int]:
+    """
+    Выгружает счета квартир за период в файл в directory.
+
+    Возвращает путь к файлу и число счетов (0 - тарифов или расхода нет).
+    """
+    invoices = await compute_invoices(db, period)
+    writer_class = EXPORT_FORMATS[export_format]
+    compress = compress and writer_class.compressible
+    path = directory / f"meter_invoices{writer_class.suffix}{'.gz' if compress else ''}"
+
+    sheet = {"title": "Начисления", "widths": INVOICE_WIDTHS} if writer_class is XlsxWriter else {}
+
+    def write() -> None:
+        writer = writer_class(path, compress, INVOICE_COLUMNS, **sheet)
+        try:
+            writer.write_rows(invoice_rows(invoices))
+        finally:
+            writer.close()
+
+    await asyncio.to_thread(write)
+    logger.info("Начисления %s дома %s: %s счетов", path.name, db.building_id, len(invoices))
+    return path, len(invoices)
@@ -0,0 +1,95 @@
+"""
+История расхода квартиры для команды /history.
+
+Расход за месяц считает база (Database.get_consumption_history), здесь
+строки раскладываются по счетчикам и месяцам и оформляются текстовой
+таблицей или графиком PNG. График строит matplotlib (необязательная
+зависимость, extra "charts") в отдельном потоке, чтобы не останавливать
+цикл событий бота; без matplotlib команда отвечает таблицей.
+"""
+import asyncio
+from datetime import datetime
+from html import escape
+from io import BytesIO
+from logging import Logger, getLogger
+from typing import Mapping, NamedTuple, Sequence
+
+from dateutil.relativedelta import relativedelta
+
+logger: Logger = getLogger(__name__)
+
+class MeterHistory(NamedTuple):
+    title: str
+    # Расход по месяцам окна, None - показаний за месяц нет
+    consumption: list[float | None]
+
+
+def history_months(months: int, period: datetime) -> list[datetime]:
+    """Начала месяцев окна, заканчивающегося отчётным периодом period"""
+    end = datetime(period.year, period.month, 1)
+    return [end - relativedelta(months=shift) for shift in range(months - 1, -1, -1)]
+
+
+def group_history(rows: Sequence[Mapping], months: list[datetime]) -> list[MeterHistory]:
+    """Раскладывает расход по счетчикам и месяцам (несколько показаний за месяц суммируются)"""
+    index = {month: position for position, month in enumerate(months)}
+    meters: dict[tuple[str, str], MeterHistory] = {}
+    for row in rows:
+        key = (row["meter_type"], row["serial_number"])
+        if key not in meters:
+            title = f"{row['label']} №{row['serial_number']}, {row['unit']}"
+            meters[key] = MeterHistory(title, [None] * len(months))
+        position = index.get(datetime(row["reading_date"].year, row["reading_date"].month, 1))
+        if position is None or row["consumption"] is None:
+            continue
+        consumption = meters[key].consumption
+        consumption[position] = (consumption[position] or 0) + row["consumption"]
+    return list(meters.values())
+
+
+def format_number(value: float | None) -> str:
+    return "—" if value is None else f"{value:g}"
+
+
+def format_history(history: list[MeterHistory], months: list[datetime]) -> str:
+    """Таблицы расхода в HTML-разметке бота: по таблице на счетчик"""
+    header = f"<b>Расход за {months[0]:%m.%Y} – {months[-1]:%m.%Y}</b>"
+    blocks = []
+    for meter in history:
+        lines = [escape(meter.title)]
+        lines += [
+            f"{month:%m.%Y} {format_number(value):>10}"
+            for month, value in zip(months, meter.consumption)
+        ]
+        total = sum(value for value in meter.consumption if value is not None)
+        lines.append(f"{'Итого':<7} {format_number(total):>10}")
+        blocks.append("\n".join(lines))
+    return header + "\n<pre>" + "\n\n".join(blocks) + "</pre>"
+
+
+def render_chart(history: list[MeterHistory], months: list[datetime]) -> bytes:
+    """Столбчатые графики расхода, по одному на счетчик, в PNG"""
+    # Импорт здесь: matplotlib нужен только для графиков и грузится долго.
+    # Figure без pyplot не трогает глобальное состояние и безопасна в потоке
+    from matplotlib.figure import Figure
+
+    labels = [f"{month:%m.%y}" for month in months]
+    figure = Figure(figsize=(8, 2.5 * len(history)))
+    axes = figure.subplots(len(history), 1, squeeze=False)
+    for ax, meter in zip(axes[:, 0], history):
+        ax.bar(labels, [value or 0 for value in meter.consumption])
+        ax.set_title(meter.title, fontsize=10)
+        ax.tick_params(axis="x", labelsize=8)
+    figure.tight_layout()
+    image = BytesIO()
+    figure.savefig(image, format="png", dpi=100)
+    return image.getvalue()
+
+
+async def build_chart(history: list[MeterHistory], months: list[datetime]) -> bytes | None:
+    """График в отдельном потоке; None, если matplotlib не установлен"""
+    try:
+        return await asyncio.to_thread(render_chart, history, months)
+    except ImportError:
+        logger.warning("matplotlib не установлен, график не построен")
+        return None
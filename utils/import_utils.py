@@ -0,0 +1,411 @@
+"""
+Импорт данных дома из таблиц xlsx и CSV.
+
+Файл читается потоково: xlsx открывается openpyxl в режиме read_only,
+CSV - построчно, поэтому в памяти не держится весь лист. Строки проверяются
+пачками по IMPORT_BATCH_SIZE, ошибки собираются с номерами строк файла
+(как в Excel: первая строка - заголовок).
+
+Счетчики квартир загружаются одной транзакцией. История показаний
+загружается пачками с фиксацией после каждой пачки, ход импорта хранится
+в import_checkpoints, и повторный импорт того же файла продолжается
+с первой незагруженной строки.
+
+Запуск вручную (файлы больше 20 МБ бот скачать не может):
+    python -m utils.import_utils meters FILE [--building N]
+    python -m utils.import_utils readings FILE [--building N]
+"""
+import argparse
+import asyncio
+import csv
+import hashlib
+from contextlib import closing
+from itertools import islice
+from logging import Logger, getLogger
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Iterator, NamedTuple
+
+from pydantic import TypeAdapter, ValidationError
+
+from config import settings
+from database.database import Database
+from utils.schemas import MeterImportSchema, ReadingImportSchema
+
+logger: Logger = getLogger(__name__)
+
+XLSX_SUFFIXES = (".xlsx", ".xlsm")
+IMPORT_SUFFIXES = (*XLSX_SUFFIXES, ".csv")
+
+# Заголовок столбца (в нижнем регистре, ё -> е) -> поле схемы
+METER_COLUMNS = {
+    "apartment_number": "apartment_number",
+    "apartment": "apartment_number",
+    "квартира": "apartment_number",
+    "номер квартиры": "apartment_number",
+    "meter_type": "meter_type",
+    "type": "meter_type",
+    "тип": "meter_type",
+    "тип счетчика": "meter_type",
+    "serial_number": "serial_number",
+    "serial": "serial_number",
+    "серийный номер": "serial_number",
+    "номер счетчика": "serial_number",
+    "description": "description",
+    "описание": "description",
+}
+
+# Сокращения стандартных типов в файлах; остальные названия типов
+# (name и label) берутся из meter_types при начале импорта
+METER_TYPE_ALIASES = {
+    "гвс": "hot_water",
+    "хвс": "cold_water",
+    "электроэнергия": "electricity",
+    "отопление": "heat",
+}
+
+READING_COLUMNS = {
+    "serial_number": "serial_number",
+    "serial": "serial_number",
+    "серийный номер": "serial_number",
+    "номер счетчика": "serial_number",
+    "meter_type": "meter_type",
+    "type": "meter_type",
+    "тип": "meter_type",
+    "тип счетчика": "meter_type",
+    "value": "value",
+    "показания": "value",
+    "значение": "value",
+    "reading_date": "reading_date",
+    "date": "reading_date",
+    "дата": "reading_date",
+    "дата показаний": "reading_date",
+}
+
+FIELD_TITLES = {
+    "apartment_number": "квартира",
+    "meter_type": "тип счетчика",
+    "serial_number": "серийный номер",
+    "description": "описание",
+    "value": "показания",
+    "reading_date": "дата",
+}
+
+
+class ImportReport(NamedTuple):
+    total: int                     # Строк с данными в файле
+    imported: int                  # Загружено в базу данных
+    errors: list[tuple[int, str]]  # (номер строки файла, ошибка)
+    duplicates: int = 0            # Показания, которые уже были в базе данных
+    resumed_from: int = 0          # Строка, после которой продолжен прерванный импорт
+
+
+def normalize(name: Any) -> str:
+    return str(name or "").strip().lower().replace("ё", "е")
+
+
+def cell_text(value: Any) -> str:
+    """Значение ячейки строкой: числа из Excel приходят как float (12.0)"""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _xlsx_rows(path: Path) -> Iterator[tuple]:
+    # openpyxl загружается при первом импорте xlsx, а не при старте бота
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _csv_rows(path: Path) -> Iterator[list[str]]:
+    # Excel сохраняет CSV в UTF-8 с BOM или в cp1251
+    with open(path, "rb") as file:
+        head = file.read(64 * 1024)
+    try:
+        head.decode("utf-8")
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError:
+        encoding = "cp1251"
+    with open(path, encoding=encoding, newline="") as file:
+        sample = file.read(4096)
+        file.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=";,\t")
+        except csv.Error:
+            dialect = csv.excel
+        yield from csv.reader(file, dialect)
+
+
+def read_table(path: Path, columns: dict[str, str]) -> Iterator[tuple[int, dict[str, str]]]:
+    """
+    Потоково читает таблицу: (номер строки файла, {поле: значение}).
+
+    Столбцы сопоставляются полям по заголовку через columns, неизвестные
+    столбцы и пустые строки пропускаются.
+    """
+    rows = _xlsx_rows(path) if path.suffix.lower() in XLSX_SUFFIXES else _csv_rows(path)
+    with closing(rows):
+        header = next(rows, None)
+        if header is None:
+            return
+        fields = [columns.get(normalize(name)) for name in header]
+        for row_number, row in enumerate(rows, start=2):
+            values = {
+                field: cell_text(value)
+                for field, value in zip(fields, row)
+                if field is not None
+            }
+            if any(values.values()):
+                yield row_number, values
+
+
+def missing_columns(path: Path, columns: dict[str, str], required: set[str]) -> set[str]:
+    """Обязательные поля, для которых в заголовке файла нет столбца"""
+    rows = _xlsx_rows(path) if path.suffix.lower() in XLSX_SUFFIXES else _csv_rows(path)
+    with closing(rows):
+        header = next(rows, None) or ()
+    return required - {columns.get(normalize(name)) for name in header}
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def meter_type_names(db: Database) -> dict[str, str]:
+    """Названия типов счетчиков в файле -> meter_types.name"""
+    names = {}
+    for meter_type in await db.get_meter_types():
+        names[normalize(meter_type["name"])] = meter_type["name"]
+        names[normalize(meter_type["label"])] = meter_type["name"]
+    known = set(names.values())
+    names.update({alias: name for alias, name in METER_TYPE_ALIASES.items() if name in known})
+    return names
+
+
+def normalize_meter_types(batch: list[tuple[int, dict[str, str]]], names: dict[str, str]) -> None:
+    for _, values in batch:
+        name = values.get("meter_type", "")
+        values["meter_type"] = names.get(normalize(name), name)
+
+
+def validate_batch(
+    adapter: TypeAdapter, batch: list[tuple[int, dict[str, str]]]
+) -> tuple[list[tuple[int, Any]], list[tuple[int, str]]]:
+    """
+    Проверяет пачку строк одной валидацией списка.
+
+    Если в пачке есть ошибки, строки без ошибок проверяются повторно,
+    чтобы ошибка одной строки не отбрасывала всю пачку.
+    """
+    try:
+        items = adapter.validate_python([values for _, values in batch])
+        return [(row_number, item) for (row_number, _), item in zip(batch, items)], []
+    except ValidationError as e:
+        messages: dict[int, list[str]] = {}
+        for error in e.errors():
+            index, *field = error["loc"]
+            title = FIELD_TITLES.get(field[0], field[0]) if field else ""
+            messages.setdefault(index, []).append(f"{title}: {error['msg']}")
+    errors = [(batch[index][0], "; ".join(text)) for index, text in sorted(messages.items())]
+    rest = [row for index, row in enumerate(batch) if index not in messages]
+    valid = adapter.validate_python([values for _, values in rest]) if rest else []
+    return [(row_number, item) for (row_number, _), item in zip(rest, valid)], errors
+
+
+async def import_meters_file(db: Database, path: Path) -> ImportReport:
+    """
+    Импортирует счетчики квартир дома db.building_id из файла.
+
+    Строка файла - один счетчик: квартира, тип, серийный номер, описание.
+    Строки с ошибками (квартира вне дома, неизвестный тип, серийный номер,
+    повторяющийся в файле или уже имеющийся в доме) не загружаются.
+    """
+    missing = await asyncio.to_thread(
+        missing_columns, path, METER_COLUMNS, {"apartment_number", "meter_type", "serial_number"}
+    )
+    if missing:
+        titles = ", ".join(sorted(FIELD_TITLES[field] for field in missing))
+        return ImportReport(0, 0, [(1, f"нет столбцов: {titles}")])
+
+    await db._ensure_meter_types_exist()
+    type_ids = await db.get_meter_type_ids()
+    names = await meter_type_names(db)
+    apartments_count = settings.BUILDINGS[db.building_id]
+    # Серийный номер однозначно определяет счетчик своего типа в доме
+    known = {(row["meter_type"], row["serial_number"]) for row in await db.get_building_serials()}
+
+    adapter = TypeAdapter(list[MeterImportSchema])
+    rows = read_table(path, METER_COLUMNS)
+    total = 0
+    valid: list[MeterImportSchema] = []
+    errors: list[tuple[int, str]] = []
+    with closing(rows):
+        while batch := await asyncio.to_thread(list, islice(rows, settings.IMPORT_BATCH_SIZE)):
+            total += len(batch)
+            normalize_meter_types(batch, names)
+            checked, batch_errors = validate_batch(adapter, batch)
+            errors += batch_errors
+            for row_number, row in checked:
+                if not 1 <= row.apartment_number <= apartments_count:
+                    errors.append((row_number, f"квартира: должна быть от 1 до {apartments_count}"))
+                elif row.meter_type not in type_ids:
+                    errors.append((row_number, f"тип счетчика: неизвестный тип {row.meter_type}"))
+                elif (row.meter_type, row.serial_number) in known:
+                    errors.append((row_number, f"серийный номер {row.serial_number} уже есть в доме или в файле"))
+                else:
+                    known.add((row.meter_type, row.serial_number))
+                    valid.append(row)
+
+    imported = await db.import_meters(valid)
+    if valid and not imported:
+        errors.append((0, "ошибка базы данных, счетчики не загружены"))
+    errors.sort()
+    logger.info(
+        "Импорт счетчиков дома %s: строк %s, загружено %s, ошибок %s",
+        db.building_id, total, imported, len(errors),
+    )
+    return ImportReport(total, imported, errors)
+
+
+async def import_readings_file(
+    db: Database,
+    path: Path,
+    progress: Callable[[int, int], Awaitable[None]] | None = None,
+) -> ImportReport:
+    """
+    Импортирует историю показаний счетчиков дома db.building_id из файла.
+
+    Строка файла - одно показание: серийный номер, тип счетчика (если номер
+    встречается у разных типов), показания, дата. Серийные номера переводятся
+    в serial_id по словарю, загруженному из базы данных один раз. После каждой
+    пачки вызывается progress(обработано строк, загружено показаний).
+    Если импорт этого файла прерывался, строки до сохранённой пропускаются
+    (ошибки в них уже были показаны в прошлый раз).
+    """
+    missing = await asyncio.to_thread(
+        missing_columns, path, READING_COLUMNS, {"serial_number", "value", "reading_date"}
+    )
+    if missing:
+        titles = ", ".join(sorted(FIELD_TITLES[field] for field in missing))
+        return ImportReport(0, 0, [(1, f"нет столбцов: {titles}")])
+
+    file_hash = await asyncio.to_thread(file_sha256, path)
+    checkpoint = await db.get_import_checkpoint(file_hash)
+    resumed_from = checkpoint["row_number"] if checkpoint else 0
+    imported = checkpoint["imported"] if checkpoint else 0
+    new_file = checkpoint is None
+
+    # серийный номер -> тип счетчика -> (serial_id, meter_id)
+    serial_ids: dict[str, dict[str, tuple[int, int]]] = {}
+    for row in await db.get_building_serials():
+        serial_ids.setdefault(row["serial_number"], {})[row["meter_type"]] = (
+            row["serial_id"], row["meter_id"]
+        )
+
+    names = await meter_type_names(db)
+
+    adapter = TypeAdapter(list[ReadingImportSchema])
+    rows = read_table(path, READING_COLUMNS)
+    processed = skipped = duplicates = 0
+    errors: list[tuple[int, str]] = []
+
+    def pending() -> Iterator[tuple[int, dict[str, str]]]:
+        nonlocal skipped
+        for row in rows:
+            if row[0] <= resumed_from:
+                skipped += 1
+            else:
+                yield row
+
+    with closing(rows):
+        remaining = pending()
+        while batch := await asyncio.to_thread(list, islice(remaining, settings.IMPORT_BATCH_SIZE)):
+            processed += len(batch)
+            normalize_meter_types(batch, names)
+            checked, batch_errors = validate_batch(adapter, batch)
+            errors += batch_errors
+            values = []
+            for row_number, row in checked:
+                by_type = serial_ids.get(row.serial_number, {})
+                if row.meter_type:
+                    ids = by_type.get(row.meter_type)
+                elif len(by_type) > 1:
+                    errors.append(
+                        (row_number, f"серийный номер {row.serial_number} есть у разных типов счетчиков, укажите тип")
+                    )
+                    continue
+                else:
+                    ids = next(iter(by_type.values()), None)
+                if ids is None:
+                    errors.append((row_number, f"счетчик {row.serial_number} не найден в доме"))
+                    continue
+                values.append(
+                    {
+                        "serial_id": ids[0],
+                        "meter_id": ids[1],
+                        "value": round(row.value),
+                        "reading_date": row.reading_date,
+                    }
+                )
+            inserted = await db.import_readings(values, file_hash, batch[-1][0], new_file)
+            new_file = False
+            imported += inserted
+            duplicates += len(values) - inserted
+            if progress is not None:
+                await progress(skipped + processed, imported)
+    total = skipped + processed
+
+    errors.sort()
+    logger.info(
+        "Импорт показаний дома %s: строк %s, загружено %s, уже были %s, ошибок %s",
+        db.building_id, total, imported, duplicates, len(errors),
+    )
+    return ImportReport(total, imported, errors, duplicates, resumed_from)
+
+
+async def run_import(kind: str, path: Path, building_id: int) -> ImportReport:
+    from database.engine import create_db, get_engine, get_read_engine, get_session_maker
+
+    async def report_progress(processed: int, imported: int) -> None:
+        print(f"строк {processed}, загружено {imported}", flush=True)
+
+    await create_db()
+    try:
+        async with get_session_maker(building_id)() as session:
+            db = Database(session, building_id)
+            if kind == "meters":
+                return await import_meters_file(db, path)
+            return await import_readings_file(db, path, report_progress)
+    finally:
+        await get_read_engine(building_id).dispose()
+        await get_engine(building_id).dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Импорт счетчиков и истории показаний из xlsx/CSV")
+    parser.add_argument("kind", choices=["meters", "readings"])
+    parser.add_argument("file", type=Path)
+    parser.add_argument("--building", type=int, default=settings.DEFAULT_BUILDING_ID)
+    args = parser.parse_args()
+
+    report = asyncio.run(run_import(args.kind, args.file, args.building))
+    print(
+        f"Строк: {report.total}, загружено: {report.imported}, "
+        f"уже были: {report.duplicates}, ошибок: {len(report.errors)}"
+    )
+    for row_number, error in report.errors:
+        print(f"Строка {row_number}: {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import asyncio
+import time
+from logging import Logger, getLogger
+from typing import Awaitable, Callable
+
+from config import settings
+from utils.metrics import QueueMetrics
+
+logger: Logger = getLogger(__name__)
+
+
+class JobQueue:
+    """
+    Очередь тяжёлых задач администратора (выгрузки, рассылки).
+
+    Задачи выполняются отдельными воркерами вне обработки обновлений, поэтому
+    не занимают слоты ConcurrencyMiddleware и не задерживают жильцов.
+    """
+
+    def __init__(self, workers: int | None = None, maxsize: int | None = None):
+        self.workers = settings.JOB_WORKERS if workers is None else workers
+        self.queue: asyncio.Queue = asyncio.Queue(
+            settings.JOB_QUEUE_SIZE if maxsize is None else maxsize
+        )
+        self.metrics = QueueMetrics("Задачи")
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        for _ in range(self.workers - len(self._tasks)):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def submit(self, name: str, job: Callable[[], Awaitable[None]]) -> bool:
+        """Ставит задачу в очередь, False - очередь заполнена"""
+        try:
+            self.queue.put_nowait((name, job, time.perf_counter()))
+        except asyncio.QueueFull:
+            logger.error("Очередь задач заполнена, задача %s отклонена", name)
+            return False
+        self.metrics.enqueued()
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            name, job, queued_at = await self.queue.get()
+            self.metrics.started(time.perf_counter() - queued_at)
+            try:
+                await job()
+            except Exception as e:
+                logger.error("Ошибка в задаче %s: %s", name, e, exc_info=True)
+            finally:
+                self.metrics.done()
+                self.queue.task_done()
+
+
+job_queue = JobQueue()
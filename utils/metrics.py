@@ -0,0 +1,77 @@
+class QueueMetrics:
+    """Глубина очереди и время ожидания обработки (обновлений или задач)"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.waiting = 0
+        self.max_waiting = 0
+        self.running = 0
+        self.processed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def enqueued(self) -> None:
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+
+    def started(self, wait: float) -> None:
+        self.waiting -= 1
+        self.running += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+    def done(self) -> None:
+        self.running -= 1
+        self.processed += 1
+
+    def __str__(self) -> str:
+        started = self.processed + self.running
+        wait_avg = self.wait_total / started * 1000 if started else 0.0
+        return (
+            f"{self.name}: в очереди {self.waiting} (макс. {self.max_waiting}), "
+            f"выполняется {self.running}, обработано {self.processed}, "
+            f"ожидание ср. {wait_avg:.0f} мс / макс. {self.wait_max * 1000:.0f} мс"
+        )
+
+
+class ApiMetrics:
+    """Вызовы Telegram Bot API по методам: число, ошибки и задержка"""
+
+    def __init__(self, name: str):
+        self.name = name
+        # метод -> [вызовов, ошибок, суммарное время, максимальное время]
+        self.methods: dict[str, list] = {}
+        # тип ошибки -> число
+        self.errors: dict[str, int] = {}
+
+    def observe(self, method: str, elapsed: float, error: str | None = None) -> None:
+        stats = self.methods.setdefault(method, [0, 0, 0.0, 0.0])
+        stats[0] += 1
+        stats[2] += elapsed
+        stats[3] = max(stats[3], elapsed)
+        if error is not None:
+            stats[1] += 1
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+    @property
+    def calls(self) -> int:
+        return sum(stats[0] for stats in self.methods.values())
+
+    @property
+    def failed(self) -> int:
+        return sum(stats[1] for stats in self.methods.values())
+
+    def __str__(self) -> str:
+        calls = self.calls
+        rate = self.failed / calls * 100 if calls else 0.0
+        lines = [f"{self.name}: вызовов {calls}, ошибок {self.failed} ({rate:.1f}%)"]
+        for method, (count, failed, total, longest) in sorted(
+            self.methods.items(), key=lambda item: -item[1][0]
+        ):
+            lines.append(
+                f"  {method}: {count}, ошибок {failed}, "
+                f"ср. {total / count * 1000:.0f} мс / макс. {longest * 1000:.0f} мс"
+            )
+        if self.errors:
+            lines.append("  ошибки: " + ", ".join(f"{name} {count}" for name, count in self.errors.items()))
+        return "\n".join(lines)
@@ -0,0 +1,137 @@
+"""
+Автоматический ежемесячный отчёт для администраторов.
+
+REPORT_DAY числа отчётный период закрывается: планировщик формирует отчёт
+дома в фоне (вне обработки обновлений), загружает файл в Telegram один раз
+и рассылает остальным администраторам его file_id. Отчёты и рассылка
+сохраняются в report_runs и report_deliveries, поэтому после перезапуска
+бот не присылает отчёт повторно, а пропущенные за время простоя периоды
+и недоставленные отчёты досылает.
+
+Загрузка в Telegram и запись в базу не атомарны: отчёт сохраняется сразу
+после загрузки, и если бот остановится между ними, после перезапуска отчёт
+сформируется и загрузится заново. Первый администратор тогда получит его
+дважды, но без отчёта никто не останется.
+"""
+import asyncio
+from datetime import date, datetime
+from logging import Logger, getLogger
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import FSInputFile
+from dateutil.relativedelta import relativedelta
+
+from config import settings
+from database.database import Database
+from utils.estimate_utils import estimate_missing_readings
+from utils.export_utils import export_readings_file
+
+logger: Logger = getLogger(__name__)
+
+
+def due_periods(today: date, last: datetime | None) -> list[datetime]:
+    """
+    Периоды (начала месяцев), отчёты за которые пора разослать.
+
+    Последний сформированный период входит в список, чтобы дослать его тем,
+    кому он не был доставлен. Без истории отчётов прошлые периоды не
+    рассылаются, чтобы первый запуск не прислал отчёты за все месяцы.
+    """
+    current = datetime(today.year, today.month, 1) - relativedelta(months=settings.DELTA_MONTH)
+    closed = current if today.day >= settings.REPORT_DAY else current - relativedelta(months=1)
+    if last is None:
+        return [closed] if closed == current else []
+    periods = []
+    period = last
+    while period <= closed:
+        periods.append(period)
+        period += relativedelta(months=1)
+    return periods
+
+
+async def upload_report(
+    bot: Bot, db: Database, period: datetime, admins: list[int], caption: str
+) -> tuple[str | None, int, int | None]:
+    """
+    Формирует отчёт и загружает его первому доступному администратору.
+
+    Возвращает file_id (None - показаний нет), число строк и администратора,
+    которому файл уже отправлен.
+    """
+    with TemporaryDirectory(prefix="meters-report-") as tmpdir:
+        path, rows = await export_readings_file(
+            db, Path(tmpdir), settings.REPORT_FORMAT, period=period.date()
+        )
+        if not rows:
+            return None, 0, None
+        for chat_id in admins:
+            try:
+                message = await bot.send_document(chat_id, FSInputFile(path), caption=caption)
+                return message.document.file_id, rows, chat_id
+            except TelegramAPIError as e:
+                logger.error("Не удалось загрузить отчёт администратору %s: %s", chat_id, e)
+    raise RuntimeError("отчёт не загружен ни одному администратору")
+
+
+async def deliver_report(bot: Bot, db: Database, period: datetime) -> None:
+    """Формирует отчёт за период, если его ещё нет, и рассылает недоставленным администраторам"""
+    run = await db.get_report_run(period)
+    delivered = await db.get_report_deliveries(period) if run else set()
+    pending = [chat_id for chat_id in settings.ADMIN_IDS if chat_id not in delivered]
+    if not pending:
+        return
+    caption = f"Показания счетчиков за {period:%m.%Y}"
+    if len(settings.BUILDINGS) > 1:
+        caption += f", дом {db.building_id}"
+
+    if run is None:
+        if settings.ESTIMATE_MISSING:
+            # Неподанные показания попадают в отчёт расчётными
+            await estimate_missing_readings(db, period.date())
+        file_id, rows, uploaded_to = await upload_report(bot, db, period, pending, caption)
+        # Остановка до этой записи - повторная загрузка после перезапуска
+        # (см. описание модуля); отчёт и доставка загрузившему сохраняются вместе
+        await db.add_report_run(period, file_id, rows, uploaded_to)
+        if uploaded_to is not None:
+            pending.remove(uploaded_to)
+        logger.info("Отчёт дома %s за %s сформирован: %s строк", db.building_id, f"{period:%m.%Y}", rows)
+    else:
+        file_id = run["file_id"]
+
+    for chat_id in pending:
+        try:
+            if file_id:
+                await bot.send_document(chat_id, file_id, caption=caption)
+            else:
+                await bot.send_message(chat_id, f"{caption}: показаний нет.")
+        except TelegramAPIError as e:
+            # Администратор получит отчёт при следующей проверке
+            logger.error("Не удалось отправить отчёт администратору %s: %s", chat_id, e)
+            continue
+        await db.add_report_delivery(period, chat_id)
+
+
+async def send_due_reports(bot: Bot, db: Database, today: date | None = None) -> None:
+    """Рассылает отчёты дома за все закрытые периоды"""
+    if not settings.ADMIN_IDS:
+        return
+    last = await db.get_last_report_period()
+    for period in due_periods(today or date.today(), last):
+        await deliver_report(bot, db, period)
+
+
+async def report_loop(bot: Bot) -> None:
+    """Периодически проверяет, не пора ли разослать отчёты домов"""
+    from database.engine import get_session_maker
+
+    while True:
+        for building_id in settings.BUILDINGS:
+            try:
+                async with get_session_maker(building_id)() as session:
+                    await send_due_reports(bot, Database(session, building_id))
+            except Exception as e:
+                logger.error("Ошибка рассылки отчёта дома %s: %s", building_id, e)
+        await asyncio.sleep(settings.REPORT_CHECK_MINUTES * 60)
@@ -1,24 +1,21 @@
 from datetime import datetime
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, field_validator
 
 
-class MeterCountSchema(BaseModel):
-    hot_water_count: int
-    cold_water_count: int
-    electricity_count: int
-    heat_count: int
-
 class UserRegistrShema(BaseModel):
     user_id: int
     first_name: str
     last_name: str | None = None
     apartment_number: int
 
-class MeterSeriesSchema(BaseModel):
-    hot_water_serials: list[str] 
-    cold_water_serials: list[str] 
-    electricity_serials: list[str] 
-    heat_serials: list[str] | None = None
+class MeterSetSchema(BaseModel):
+    """Счетчики одного типа в квартире: серийные номера и их описания"""
+    serials: list[str] = []
+    descriptions: list[str] = []
+
+class ApartmentMetersSchema(BaseModel):
+    """Счетчики квартиры при регистрации: тип из meter_types -> счетчики"""
+    meters: dict[str, MeterSetSchema] = {}
 
 
 class SubmissionSchema(BaseModel):
@@ -29,8 +26,33 @@ class SubmissionSchema(BaseModel):
     value: float
     reading_date: datetime
 
-class DescriptionSchema(BaseModel):
-    hot_water_descriptions: list[str]
-    cold_water_descriptions: list[str]
-    electricity_descriptions: list[str]
-    heat_descriptions: list[str] | None = None
\ No newline at end of file
+class MeterImportSchema(BaseModel):
+    """Строка файла импорта счетчиков: один счетчик квартиры"""
+    apartment_number: int = Field(ge=1)
+    meter_type: str
+    serial_number: str = Field(min_length=1, max_length=20)
+    description: str = Field(default="", max_length=50)
+
+
+class ReadingImportSchema(BaseModel):
+    """Строка файла импорта истории показаний"""
+    serial_number: str = Field(min_length=1, max_length=20)
+    meter_type: str = ""  # Нужен, если серийный номер есть у счетчиков разных типов
+    value: float = Field(ge=0)
+    reading_date: datetime
+
+    @field_validator("value", mode="before")
+    @classmethod
+    def decimal_comma(cls, value):
+        return value.replace(",", ".") if isinstance(value, str) else value
+
+    @field_validator("reading_date", mode="before")
+    @classmethod
+    def russian_date(cls, value):
+        # Даты в выгрузках управляющей компании записаны как 01.03.2021
+        if isinstance(value, str):
+            try:
+                return datetime.strptime(value.strip(), "%d.%m.%Y")
+            except ValueError:
+                pass
+        return value